@@ -118,6 +118,7 @@ setup(name=name,
         'Levenshtein': ['python-Levenshtein'],
         'BCrypt': ['passlib[bcrypt]'],
         'html2text': ['html2text'],
+        'Redis': ['redis'],
         },
     zip_safe=False,
     test_suite='trytond.tests',
@@ -5,7 +5,7 @@ import os
 import logging.config
 from io import StringIO
 
-__all__ = ['app']
+__all__ = ['app', 'bus_app']
 
 # Logging must be set before importing
 logging_config = os.environ.get('TRYTOND_LOGGING_CONFIG')
@@ -14,6 +14,7 @@ if logging_config:
 
 from trytond.pool import Pool
 from trytond.wsgi import app
+from trytond.bus import asgi_app as bus_app
 
 Pool.start()
 # TRYTOND_CONFIG it's managed by importing config
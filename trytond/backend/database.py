@@ -29,11 +29,12 @@ class DatabaseInterface(object):
         '''
         raise NotImplementedError
 
-    def get_connection(self, autocommit, readonly=False):
+    def get_connection(self, autocommit, readonly=False, replica=False):
         '''Retrieve a connection on the database
 
         :param autocommit: a boolean to activate autocommit
         :param readonly: a boolean to specify if the transaction is readonly
+        :param replica: a boolean to allow a connection to a read replica
         '''
         raise NotImplementedError
 
@@ -44,6 +45,14 @@ class DatabaseInterface(object):
         '''
         raise NotImplementedError
 
+    def is_replica(self, connection):
+        "Return if the connection is to a read replica"
+        return False
+
+    def pool_stats(self):
+        "Return the statistics of the connection pools"
+        return {}
+
     def close(self):
         '''
         Close all connection
@@ -164,10 +173,37 @@ class DatabaseInterface(object):
         "Return if database supports FOR UPDATE/SHARE clause in SELECT."
         return False
 
+    def has_skip_locked(self):
+        "Return if database supports SKIP LOCKED in FOR UPDATE/SHARE clause."
+        return False
+
     def has_window_functions(self):
         "Return if database supports window functions."
         return False
 
+    def has_copy(self):
+        "Return if database supports bulk insert with copy_insert"
+        return False
+
+    def copy_insert(self, connection, table, columns, rows):
+        '''
+        Insert the rows of values for the columns in the table and return
+        their ids in the same order or None if some values are not supported.
+        '''
+        raise NotImplementedError
+
+    def has_update_from(self):
+        "Return if database supports FROM clause in UPDATE"
+        return False
+
+    def has_named_cursor(self):
+        "Return if database supports server-side cursors"
+        return False
+
+    def has_array(self):
+        "Return if database supports comparison with ANY of an array"
+        return False
+
     def has_unaccent(self):
         "Return if database supports unaccentuated searches"
         return False
@@ -1,14 +1,17 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 from collections import defaultdict
+import itertools
 import time
 import logging
 import os
 import urllib.request, urllib.parse, urllib.error
 import json
-from datetime import datetime
+import io
+from datetime import datetime, date
 from decimal import Decimal
-from threading import RLock
+from collections import deque
+from threading import RLock, Lock, Event
 
 try:
     from psycopg2cffi import compat
@@ -16,10 +19,11 @@ try:
 except ImportError:
     pass
 from psycopg2 import connect, Binary
-from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.pool import PoolError
 from psycopg2.extensions import cursor
 from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
 from psycopg2.extensions import register_type, register_adapter
 from psycopg2.extensions import UNICODE, AsIs
 from psycopg2.extras import Json
@@ -32,7 +36,7 @@ from psycopg2 import OperationalError as DatabaseOperationalError
 from psycopg2.extras import register_default_json, register_default_jsonb
 
 from sql import Flavor
-from sql.functions import Function
+from sql.functions import Function, CurrentTimestamp
 
 from trytond.backend.database import DatabaseInterface, SQLType
 from trytond.config import config, parse_uri
@@ -49,6 +53,9 @@ os.environ['PGTZ'] = os.environ.get('TZ', '')
 _timeout = config.getint('database', 'timeout')
 _minconn = config.getint('database', 'minconn', default=1)
 _maxconn = config.getint('database', 'maxconn', default=64)
+_replica_uris = config.get('database', 'replica_uri', default='').split()
+_replica_retry = config.getint('database', 'replica_retry', default=30)
+_pool_timeout = config.getfloat('database', 'pool_timeout', default=30)
 
 
 def unescape_quote(s):
@@ -79,6 +86,21 @@ class LoggingCursor(cursor):
         logger.debug("Wall time: {:.2f} ms".format(delta))
 
 
+_COPY_TYPES = (str, int, float, Decimal, date)
+
+
+def _copy_format(value):
+    "Format the value for the text format of COPY"
+    if value is None:
+        return '\\N'
+    elif value is True:
+        return 't'
+    elif value is False:
+        return 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r'))
+
+
 class Unaccent(Function):
     __slots__ = ()
     _function = 'unaccent'
@@ -92,16 +114,177 @@ class TryAdvisoryLock(Function):
     _function = 'pg_try_advisory_xact_lock'
 
 
+class _Waiter(object):
+    __slots__ = ('event', 'conn')
+
+    def __init__(self):
+        self.event = Event()
+        self.conn = None
+
+
+_open = object()
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of connections which serves the waiters in order and
+    keeps the session state of each connection.
+    """
+    # Upper bounds in seconds of the wait time histogram
+    buckets = (0.001, 0.01, 0.1, 1, 10, float('inf'))
+
+    def __init__(self, minconn, maxconn, **params):
+        self.maxconn = maxconn
+        self.closed = False
+        self._params = params
+        self._lock = Lock()
+        self._idle = deque()
+        self._used = {}
+        self._states = {}
+        self._waiters = deque()
+        self._opening = 0
+        self._waits = [0] * len(self.buckets)
+        self._wait_time = 0
+        for _ in range(minconn):
+            self._idle.append(connect(**params))
+
+    def getconn(self, timeout=None):
+        "Return a connection waiting at most timeout seconds"
+        start = time.time()
+        with self._lock:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+            if self._idle:
+                conn = self._idle.pop()
+                self._used[id(conn)] = conn
+                self._record(0)
+                return conn
+            waiter = None
+            if len(self._used) + self._opening < self.maxconn:
+                self._opening += 1
+                self._record(0)
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            with self._lock:
+                conn = waiter.conn
+                if conn is None:
+                    self._waiters.remove(waiter)
+                    raise PoolError("timeout waiting a connection")
+                self._record(time.time() - start)
+            if conn is not _open:
+                return conn
+        try:
+            conn = connect(**self._params)
+        except Exception:
+            self.putconn(None, close=True)
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._used[id(conn)] = conn
+        return conn
+
+    def putconn(self, conn, close=False):
+        "Give back the connection to the first waiter or to the idle ones"
+        if conn is not None:
+            if not close and not conn.closed:
+                status = conn.get_transaction_status()
+                if status == TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if close or conn.closed or self.closed:
+                if not conn.closed:
+                    conn.close()
+        with self._lock:
+            if conn is None:
+                self._opening -= 1
+            else:
+                self._used.pop(id(conn), None)
+                if conn.closed:
+                    self._states.pop(id(conn), None)
+                    conn = None
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                if conn is None:
+                    self._opening += 1
+                    waiter.conn = _open
+                else:
+                    self._used[id(conn)] = conn
+                    waiter.conn = conn
+                waiter.event.set()
+            elif conn is not None:
+                self._idle.append(conn)
+
+    def owns(self, conn):
+        return id(conn) in self._used
+
+    def configure(self, conn, autocommit=False, readonly=False):
+        "Set the session of the connection only if it changes"
+        state = (autocommit, readonly)
+        if self._states.get(id(conn)) != state:
+            conn.set_session(
+                isolation_level=ISOLATION_LEVEL_REPEATABLE_READ,
+                readonly=readonly, autocommit=autocommit)
+            self._states[id(conn)] = state
+
+    def closeall(self):
+        with self._lock:
+            self.closed = True
+            conns = list(self._idle) + list(self._used.values())
+            self._idle.clear()
+            self._used.clear()
+            self._states.clear()
+        for conn in conns:
+            if not conn.closed:
+                conn.close()
+
+    def _record(self, duration):
+        self._wait_time += duration
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                self._waits[i] += 1
+                break
+
+    def stats(self):
+        "Return the gauges and the wait time histogram"
+        with self._lock:
+            histogram, count = {}, 0
+            for bound, waits in zip(self.buckets, self._waits):
+                count += waits
+                histogram[str(bound)] = count
+            return {
+                'in_use': len(self._used),
+                'idle': len(self._idle),
+                'waiting': len(self._waiters),
+                'wait_count': count,
+                'wait_time': self._wait_time,
+                'wait_histogram': histogram,
+                }
+
+
+class _Replica(object):
+    __slots__ = ('pool', 'down_until')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.down_until = 0
+
+
 class Database(DatabaseInterface):
 
     _lock = RLock()
     _databases = defaultdict(dict)
     _connpool = None
+    _replicas = ()
     _list_cache = {}
     _list_cache_timestamp = {}
     _search_path = None
     _current_user = None
     _has_returning = None
+    _has_skip_locked = None
     _has_unaccent = {}
     flavor = Flavor(ilike=True)
 
@@ -132,10 +315,17 @@ class Database(DatabaseInterface):
                     minconn = _minconn
                 inst = DatabaseInterface.__new__(cls, name=name)
                 logger.info('connect to "%s"', name)
-                inst._connpool = ThreadedConnectionPool(
+                inst._connpool = ConnectionPool(
                     minconn, _maxconn,
                     cursor_factory=LoggingCursor,
                     **cls._connection_params(name))
+                if name != 'template1':
+                    inst._replicas = [_Replica(ConnectionPool(
+                                0, _maxconn,
+                                cursor_factory=LoggingCursor,
+                                **cls._connection_params(name, uri)))
+                        for uri in _replica_uris]
+                    inst._replica_count = itertools.count()
                 databases[name] = inst
             inst._last_use = datetime.now()
             return inst
@@ -144,8 +334,8 @@ class Database(DatabaseInterface):
         super(Database, self).__init__(name)
 
     @classmethod
-    def _connection_params(cls, name):
-        uri = parse_uri(config.get('database', 'uri'))
+    def _connection_params(cls, name, uri=None):
+        uri = parse_uri(uri or config.get('database', 'uri'))
         params = {
             'dbname': name,
             }
@@ -167,33 +357,70 @@ class Database(DatabaseInterface):
     def connect(self):
         return self
 
-    def get_connection(self, autocommit=False, readonly=False):
-        for count in range(config.getint('database', 'retry'), -1, -1):
-            try:
-                conn = self._connpool.getconn()
-                break
-            except PoolError:
-                if count and not self._connpool.closed:
-                    logger.info('waiting a connection')
-                    time.sleep(1)
-                    continue
-                raise
-        if autocommit:
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    def get_connection(self, autocommit=False, readonly=False, replica=False):
+        conn = None
+        if replica and readonly and not autocommit:
+            conn = self._get_replica_connection()
+        if conn is None:
+            pool = self._connpool
+            conn = pool.getconn(timeout=_pool_timeout)
         else:
-            conn.set_isolation_level(ISOLATION_LEVEL_REPEATABLE_READ)
-        if readonly:
-            cursor = conn.cursor()
-            cursor.execute('SET TRANSACTION READ ONLY')
+            pool = self._get_pool(conn)
+        pool.configure(conn, autocommit=autocommit,
+            readonly=readonly and not autocommit)
         return conn
 
+    def _get_replica_connection(self):
+        "Return a connection from the least used healthy replica or None"
+        now = time.time()
+        replicas = [r for r in self._replicas if r.down_until <= now]
+        if not replicas:
+            return None
+        # Rotate to share the replicas with the same number of connections
+        start = next(self._replica_count) % len(replicas)
+        replicas = replicas[start:] + replicas[:start]
+        replicas.sort(key=lambda r: len(r.pool._used))
+        for replica in replicas:
+            try:
+                conn = replica.pool.getconn(timeout=0)
+            except PoolError:
+                continue
+            except DatabaseOperationalError:
+                logger.warning('replica of "%s" unavailable', self.name,
+                    exc_info=True)
+                replica.down_until = now + _replica_retry
+                continue
+            if conn.closed:
+                replica.pool.putconn(conn, close=True)
+                replica.down_until = now + _replica_retry
+                continue
+            return conn
+        return None
+
+    def _get_pool(self, connection):
+        for replica in self._replicas:
+            if replica.pool.owns(connection):
+                return replica.pool
+        return self._connpool
+
     def put_connection(self, connection, close=False):
-        self._connpool.putconn(connection, close=close)
+        self._get_pool(connection).putconn(connection, close=close)
+
+    def is_replica(self, connection):
+        return self._get_pool(connection) is not self._connpool
+
+    def pool_stats(self):
+        return {
+            'primary': self._connpool.stats(),
+            'replicas': [r.pool.stats() for r in self._replicas],
+            }
 
     def close(self):
         with self._lock:
             logger.info('disconnect from "%s"', self.name)
             self._connpool.closeall()
+            for replica in self._replicas:
+                replica.pool.closeall()
             self._databases[os.getpid()].pop(self.name)
 
     @classmethod
@@ -305,6 +532,37 @@ class Database(DatabaseInterface):
                 return False
         return True
 
+    def copy_insert(self, connection, table, columns, rows):
+        now = None
+        lines = []
+        for row in rows:
+            line = []
+            for value in row:
+                if isinstance(value, CurrentTimestamp):
+                    if now is None:
+                        cursor = connection.cursor()
+                        cursor.execute('SELECT LOCALTIMESTAMP')
+                        now, = cursor.fetchone()
+                    value = now
+                elif value is not None and (
+                        not isinstance(value, _COPY_TYPES)
+                        or getattr(value, 'tzinfo', None) is not None):
+                    return None
+                line.append(_copy_format(value))
+            lines.append(line)
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT NEXTVAL('" + table + "_id_seq') "
+            "FROM generate_series(1, %s)", (len(lines),))
+        ids = sorted(i for i, in cursor.fetchall())
+        data = io.StringIO()
+        for id_, line in zip(ids, lines):
+            data.write('%s\t%s\n' % (id_, '\t'.join(line)))
+        data.seek(0)
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (table,
+                ', '.join('"%s"' % c for c in ['id'] + list(columns))), data)
+        return ids
+
     def nextid(self, connection, table):
         cursor = connection.cursor()
         cursor.execute("SELECT NEXTVAL('" + table + "_id_seq')")
@@ -389,9 +647,32 @@ class Database(DatabaseInterface):
     def has_select_for(self):
         return True
 
+    def has_skip_locked(self):
+        if self._has_skip_locked is None:
+            connection = self.get_connection()
+            try:
+                # SKIP LOCKED is available since PostgreSQL 9.5
+                self._has_skip_locked = (
+                    self.get_version(connection) >= (9, 5))
+            finally:
+                self.put_connection(connection)
+        return self._has_skip_locked
+
     def has_window_functions(self):
         return True
 
+    def has_array(self):
+        return True
+
+    def has_named_cursor(self):
+        return True
+
+    def has_copy(self):
+        return True
+
+    def has_update_from(self):
+        return True
+
     @classmethod
     def has_sequence(cls):
         return True
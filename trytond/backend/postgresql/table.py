@@ -2,6 +2,8 @@
 # this repository contains the full copyright notices and license terms.
 import re
 import logging
+from contextlib import contextmanager
+from threading import local
 
 from trytond.transaction import Transaction
 from trytond.backend.table import TableHandlerInterface
@@ -12,41 +14,231 @@ logger = logging.getLogger(__name__)
 VARCHAR_SIZE_RE = re.compile('VARCHAR\(([0-9]+)\)')
 
 
+class _Snapshot(object):
+    "The definitions of all the tables of the search path"
+
+    def __init__(self, connection, database):
+        self.connection = connection
+        self.database = database
+        self.loaded = False
+        self.tables = {}
+        self.owners = {}
+        self.sequences = set()
+        self.definitions = {}
+
+    def clear(self):
+        self.loaded = False
+        self.tables.clear()
+        self.owners.clear()
+        self.sequences.clear()
+        self.definitions.clear()
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        search_path = self.database.search_path
+        cursor = self.connection.cursor()
+
+        cursor.execute('SELECT table_schema, table_name '
+            'FROM information_schema.tables '
+            'WHERE table_schema = ANY(%s)', (search_path,))
+        schemas = {}
+        for schema, table in cursor.fetchall():
+            schemas.setdefault(table, set()).add(schema)
+        for table, table_schemas in schemas.items():
+            # Use the same schema as get_table_schema
+            self.tables[table] = next(
+                s for s in search_path if s in table_schemas)
+
+        cursor.execute('SELECT schemaname, tablename, '
+                'tableowner = current_user '
+            'FROM pg_tables '
+            'WHERE schemaname = ANY(%s)', (search_path,))
+        for schema, table, is_owner in cursor.fetchall():
+            self.owners[(schema, table)] = is_owner
+
+        cursor.execute('SELECT sequence_name '
+            'FROM information_schema.sequences '
+            'WHERE sequence_schema = ANY(%s)', (search_path,))
+        self.sequences.update(s for s, in cursor.fetchall())
+
+        cursor.execute('SELECT table_schema, table_name, '
+                'column_name, udt_name, is_nullable, '
+                'character_maximum_length, '
+                'column_default '
+            'FROM information_schema.columns '
+            'WHERE table_schema = ANY(%s)', (search_path,))
+        for (schema, table, column, typname, nullable, size,
+                default) in cursor.fetchall():
+            self.get(schema, table)['columns'][column] = {
+                'typname': typname,
+                'notnull': True if nullable == 'NO' else False,
+                'size': size,
+                'default': default,
+                'comment': None,
+                }
+
+        cursor.execute('SELECT n.nspname, c.relname, a.attname, '
+                'd.description '
+            'FROM pg_description d '
+                'JOIN pg_class c ON c.oid = d.objoid '
+                'JOIN pg_namespace n ON n.oid = c.relnamespace '
+                'LEFT JOIN pg_attribute a '
+                'ON a.attrelid = d.objoid AND a.attnum = d.objsubid '
+            "WHERE d.classoid = 'pg_class'::regclass "
+                'AND n.nspname = ANY(%s)', (search_path,))
+        for schema, table, column, comment in cursor.fetchall():
+            definitions = self.get(schema, table)
+            if column is None:
+                definitions['comment'] = comment
+            elif column in definitions['columns']:
+                definitions['columns'][column]['comment'] = comment
+
+        cursor.execute('SELECT table_schema, table_name, constraint_name '
+            'FROM information_schema.table_constraints '
+            'WHERE table_schema = ANY(%s)', (search_path,))
+        for schema, table, constraint in cursor.fetchall():
+            self.get(schema, table)['constraints'].append(constraint)
+
+        # add nonstandard exclude constraint
+        cursor.execute('SELECT nr.nspname, r.relname, c.conname '
+            'FROM pg_namespace nc, '
+                'pg_namespace nr, '
+                'pg_constraint c, '
+                'pg_class r '
+            'WHERE nc.oid = c.connamespace AND nr.oid = r.relnamespace '
+                'AND c.conrelid = r.oid '
+                "AND c.contype = 'x' "  # exclude type
+                "AND r.relkind IN ('r', 'p') "
+                'AND nr.nspname = ANY(%s)', (search_path,))
+        for schema, table, constraint in cursor.fetchall():
+            self.get(schema, table)['constraints'].append(constraint)
+
+        cursor.execute('SELECT k.table_schema, k.table_name, '
+                'k.column_name, r.delete_rule '
+            'FROM information_schema.key_column_usage AS k '
+            'JOIN information_schema.referential_constraints AS r '
+            'ON r.constraint_schema = k.constraint_schema '
+            'AND r.constraint_name = k.constraint_name '
+            'WHERE k.table_schema = ANY(%s)', (search_path,))
+        for schema, table, column, delete_rule in cursor.fetchall():
+            self.get(schema, table)['fk_deltypes'][column] = delete_rule
+
+        cursor.execute('SELECT n.nspname, cl.relname, cl2.relname '
+            'FROM pg_index ind '
+                'JOIN pg_class cl on (cl.oid = ind.indrelid) '
+                'JOIN pg_namespace n ON (cl.relnamespace = n.oid) '
+                'JOIN pg_class cl2 on (cl2.oid = ind.indexrelid) '
+            'WHERE n.nspname = ANY(%s)', (search_path,))
+        for schema, table, index in cursor.fetchall():
+            self.get(schema, table)['indexes'].append(index)
+
+    def get(self, schema, table):
+        "Return the definitions of the table"
+        return self.definitions.setdefault((schema, table), {
+                'columns': {},
+                'comment': None,
+                'constraints': [],
+                'fk_deltypes': {},
+                'indexes': [],
+                })
+
+    def add_table(self, table, schema, is_owner):
+        self.tables[table] = schema
+        self.owners[(schema, table)] = is_owner
+        self.definitions.pop((schema, table), None)
+
+    def rename_table(self, old_name, new_name):
+        if old_name not in self.tables or new_name in self.tables:
+            return
+        schema = self.tables.pop(old_name)
+        self.tables[new_name] = schema
+        if (schema, old_name) in self.owners:
+            self.owners[(schema, new_name)] = self.owners.pop(
+                (schema, old_name))
+        if (schema, old_name) in self.definitions:
+            self.definitions[(schema, new_name)] = self.definitions.pop(
+                (schema, old_name))
+
+    def rename_sequence(self, old_name, new_name):
+        self.sequences.discard(old_name)
+        self.sequences.add(new_name)
+        # The defaults using the sequence are displayed with its new name
+        old_default = "nextval('%s'::regclass)" % old_name
+        new_default = "nextval('%s'::regclass)" % new_name
+        for definitions in self.definitions.values():
+            for column in definitions['columns'].values():
+                if column['default'] == old_default:
+                    column['default'] = new_default
+
+    def drop_table(self, table):
+        schema = self.tables.pop(table, None)
+        self.owners.pop((schema, table), None)
+        self.definitions.pop((schema, table), None)
+
+
 class TableHandler(TableHandlerInterface):
     namedatalen = 64
+    _local = local()
 
     def __init__(self, model, module_name=None, history=False):
         super(TableHandler, self).__init__(model,
                 module_name=module_name, history=history)
         self._columns = {}
+        self._comment = None
         self._constraints = []
         self._fk_deltypes = {}
         self._indexes = []
 
         transaction = Transaction()
         cursor = transaction.connection.cursor()
+        snapshot = self._get_snapshot()
         # Create sequence if necessary
-        if not transaction.database.sequence_exist(
-                transaction.connection, self.sequence_name):
+        if snapshot is not None:
+            sequence_exist = self.sequence_name in snapshot.sequences
+        else:
+            sequence_exist = transaction.database.sequence_exist(
+                transaction.connection, self.sequence_name)
+        if not sequence_exist:
             transaction.database.sequence_create(
                 transaction.connection, self.sequence_name)
+            if snapshot is not None:
+                snapshot.sequences.add(self.sequence_name)
 
         # Create new table if necessary
         if not self.table_exist(self.table_name):
             cursor.execute('CREATE TABLE "%s" ()' % self.table_name)
-        self.table_schema = transaction.database.get_table_schema(
-            transaction.connection, self.table_name)
+            created = True
+        else:
+            created = False
 
-        cursor.execute('SELECT tableowner = current_user FROM pg_tables '
-            'WHERE tablename = %s AND schemaname = %s',
-            (self.table_name, self.table_schema))
-        self.is_owner, = cursor.fetchone()
+        if snapshot is not None and not created:
+            self.table_schema = snapshot.tables[self.table_name]
+            self.is_owner = snapshot.owners.get(
+                (self.table_schema, self.table_name), False)
+            self._load_definitions(snapshot)
+        else:
+            self.table_schema = transaction.database.get_table_schema(
+                transaction.connection, self.table_name)
 
-        if model.__doc__ and self.is_owner:
+            cursor.execute('SELECT tableowner = current_user FROM pg_tables '
+                'WHERE tablename = %s AND schemaname = %s',
+                (self.table_name, self.table_schema))
+            self.is_owner, = cursor.fetchone()
+            if snapshot is not None:
+                snapshot.add_table(
+                    self.table_name, self.table_schema, self.is_owner)
+            self._update_definitions()
+
+        if (model.__doc__ and self.is_owner
+                and self._comment != model.__doc__):
             cursor.execute('COMMENT ON TABLE "%s" IS \'%s\'' %
                 (self.table_name, model.__doc__.replace("'", "''")))
+            self._comment = model.__doc__
+            self._store_definitions()
 
-        self._update_definitions(columns=True)
+        changed = False
         if 'id' not in self._columns:
             if not self.history:
                 cursor.execute('ALTER TABLE "%s" '
@@ -59,6 +251,7 @@ class TableHandler(TableHandlerInterface):
                 cursor.execute('ALTER TABLE "%s" '
                     'ADD COLUMN id INTEGER' % self.table_name)
             self._update_definitions(columns=True)
+            changed = True
         if self.history and '__id' not in self._columns:
             cursor.execute('ALTER TABLE "%s" '
                 'ADD COLUMN __id INTEGER '
@@ -66,6 +259,7 @@ class TableHandler(TableHandlerInterface):
                 (self.table_name, self.sequence_name))
             cursor.execute('ALTER TABLE "%s" '
                 'ADD PRIMARY KEY(__id)' % self.table_name)
+            changed = True
         else:
             default = "nextval('%s'::regclass)" % self.sequence_name
             if self.history:
@@ -73,14 +267,43 @@ class TableHandler(TableHandlerInterface):
                     cursor.execute('ALTER TABLE "%s" '
                         'ALTER __id SET DEFAULT %s'
                         % (self.table_name, default))
+                    changed = True
             if self._columns['id']['default'] != default:
                     cursor.execute('ALTER TABLE "%s" '
                         'ALTER id SET DEFAULT %s'
                         % (self.table_name, default))
-        self._update_definitions()
+                    changed = True
+        if changed:
+            self._update_definitions()
+
+    @classmethod
+    @contextmanager
+    def snapshot(cls):
+        if getattr(cls._local, 'snapshot', None) is not None:
+            yield
+            return
+        transaction = Transaction()
+        cls._local.snapshot = _Snapshot(
+            transaction.connection, transaction.database)
+        try:
+            yield
+        finally:
+            cls._local.snapshot = None
+
+    @classmethod
+    def _get_snapshot(cls):
+        "Return the loaded snapshot of the transaction or None"
+        snapshot = getattr(cls._local, 'snapshot', None)
+        if (snapshot is not None
+                and snapshot.connection is Transaction().connection):
+            snapshot.load()
+            return snapshot
 
     @staticmethod
     def table_exist(table_name):
+        snapshot = TableHandler._get_snapshot()
+        if snapshot is not None:
+            return table_name in snapshot.tables
         transaction = Transaction()
         return bool(transaction.database.get_table_schema(
                 transaction.connection, table_name))
@@ -89,16 +312,26 @@ class TableHandler(TableHandlerInterface):
     def table_rename(old_name, new_name):
         transaction = Transaction()
         cursor = transaction.connection.cursor()
+        snapshot = TableHandler._get_snapshot()
         # Rename table
         if (TableHandler.table_exist(old_name)
                 and not TableHandler.table_exist(new_name)):
             cursor.execute('ALTER TABLE "%s" RENAME TO "%s"'
                 % (old_name, new_name))
+            if snapshot is not None:
+                snapshot.rename_table(old_name, new_name)
         # Rename sequence
         old_sequence = old_name + '_id_seq'
         new_sequence = new_name + '_id_seq'
-        transaction.database.sequence_rename(
-            transaction.connection, old_sequence, new_sequence)
+        if snapshot is not None:
+            if (old_sequence in snapshot.sequences
+                    and new_sequence not in snapshot.sequences):
+                transaction.database.sequence_rename(
+                    transaction.connection, old_sequence, new_sequence)
+                snapshot.rename_sequence(old_sequence, new_sequence)
+        else:
+            transaction.database.sequence_rename(
+                transaction.connection, old_sequence, new_sequence)
         # Rename history table
         old_history = old_name + "__history"
         new_history = new_name + "__history"
@@ -106,6 +339,8 @@ class TableHandler(TableHandlerInterface):
                 and not TableHandler.table_exist(new_history)):
             cursor.execute('ALTER TABLE "%s" RENAME TO "%s"'
                 % (old_history, new_history))
+            if snapshot is not None:
+                snapshot.rename_table(old_history, new_history)
 
     def column_exist(self, column_name):
         return column_name in self._columns
@@ -123,6 +358,25 @@ class TableHandler(TableHandlerInterface):
                     'Unable to rename column %s on table %s to %s.',
                     old_name, self.table_name, new_name)
 
+    def _load_definitions(self, snapshot):
+        definitions = snapshot.get(self.table_schema, self.table_name)
+        self._columns = definitions['columns']
+        self._comment = definitions['comment']
+        self._constraints = definitions['constraints']
+        self._fk_deltypes = definitions['fk_deltypes']
+        self._indexes = definitions['indexes']
+
+    def _store_definitions(self):
+        snapshot = self._get_snapshot()
+        if snapshot is not None:
+            snapshot.definitions[(self.table_schema, self.table_name)] = {
+                'columns': self._columns,
+                'comment': self._comment,
+                'constraints': self._constraints,
+                'fk_deltypes': self._fk_deltypes,
+                'indexes': self._indexes,
+                }
+
     def _update_definitions(self,
             columns=None, constraints=None, indexes=None):
         if columns is None and constraints is None and indexes is None:
@@ -144,8 +398,13 @@ class TableHandler(TableHandlerInterface):
                     'notnull': True if nullable == 'NO' else False,
                     'size': size,
                     'default': default,
+                    'comment': None,
                     }
 
+            self._comment = None
+            if self._get_snapshot() is not None:
+                self._update_comments()
+
         if constraints:
             # fetch constraints for the table
             cursor.execute('SELECT constraint_name '
@@ -187,6 +446,25 @@ class TableHandler(TableHandlerInterface):
                 "WHERE cl.relname = %s AND n.nspname = %s",
                 (self.table_name, self.table_schema))
             self._indexes = [l[0] for l in cursor.fetchall()]
+        self._store_definitions()
+
+    def _update_comments(self):
+        "Fetch the comments of the table and of its columns"
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT a.attname, d.description '
+            'FROM pg_description d '
+                'JOIN pg_class c ON c.oid = d.objoid '
+                'JOIN pg_namespace n ON n.oid = c.relnamespace '
+                'LEFT JOIN pg_attribute a '
+                'ON a.attrelid = d.objoid AND a.attnum = d.objsubid '
+            "WHERE d.classoid = 'pg_class'::regclass "
+                'AND c.relname = %s AND n.nspname = %s',
+            (self.table_name, self.table_schema))
+        for column, comment in cursor.fetchall():
+            if column is None:
+                self._comment = comment
+            elif column in self._columns:
+                self._columns[column]['comment'] = comment
 
     @property
     def _field2module(self):
@@ -223,13 +501,16 @@ class TableHandler(TableHandlerInterface):
     def db_default(self, column_name, value):
         if value in [True, False]:
             test = str(value).lower()
-        else:
+        elif value is None:
             test = value
+        else:
+            test = str(value)
         if self._columns[column_name]['default'] != test:
             cursor = Transaction().connection.cursor()
             cursor.execute('ALTER TABLE "' + self.table_name + '" '
                 'ALTER COLUMN "' + column_name + '" SET DEFAULT %s',
                 (value,))
+            self._update_definitions(columns=True)
 
     def add_column(self, column_name, sql_type, default=None, comment=''):
         cursor = Transaction().connection.cursor()
@@ -240,9 +521,13 @@ class TableHandler(TableHandlerInterface):
         field_size = int(match.group(1)) if match else None
 
         def add_comment():
-            if comment and self.is_owner:
+            if (comment and self.is_owner
+                    and self._columns.get(column_name, {}).get('comment')
+                    != comment):
                 cursor.execute('COMMENT ON COLUMN "%s"."%s" IS \'%s\'' %
                     (self.table_name, column_name, comment.replace("'", "''")))
+                if column_name in self._columns:
+                    self._columns[column_name]['comment'] = comment
         if self.column_exist(column_name):
             if (column_name in ('create_date', 'write_date')
                     and column_type[1].lower() != 'timestamp(6)'):
@@ -457,3 +742,10 @@ class TableHandler(TableHandlerInterface):
         if cascade:
             query = query + ' CASCADE'
         cursor.execute(query)
+        snapshot = TableHandler._get_snapshot()
+        if snapshot is not None:
+            if cascade:
+                # The constraints of other tables may be dropped
+                snapshot.clear()
+            else:
+                snapshot.drop_table(table)
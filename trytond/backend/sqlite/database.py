@@ -286,7 +286,7 @@ class Database(DatabaseInterface):
         self._conn.execute('PRAGMA foreign_keys = ON')
         return self
 
-    def get_connection(self, autocommit=False, readonly=False):
+    def get_connection(self, autocommit=False, readonly=False, replica=False):
         if self._conn is None:
             self.connect()
         if autocommit:
@@ -1,6 +1,7 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import hashlib
+from contextlib import contextmanager
 
 
 class TableHandlerInterface(object):
@@ -28,6 +29,15 @@ class TableHandlerInterface(object):
         self.module_name = module_name
         self.history = history
 
+    @classmethod
+    @contextmanager
+    def snapshot(cls):
+        '''
+        Return a context manager during which the definitions of the tables
+        may be loaded at once and kept up to date by the table handlers
+        '''
+        yield
+
     @staticmethod
     def table_exist(table_name):
         '''
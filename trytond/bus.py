@@ -1,7 +1,10 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
+import asyncio
 import collections
+import functools
+import http.client
 import json
 import logging
 import select
@@ -12,8 +15,9 @@ import uuid
 from werkzeug.wrappers import Response
 from werkzeug.exceptions import NotImplemented, BadRequest
 
-from trytond import backend
+from trytond import backend, security
 from trytond.wsgi import app
+from trytond.protocols.wrappers import parse_authorization_header
 from trytond.transaction import Transaction
 from trytond.protocols.jsonrpc import JSONEncoder, JSONDecoder
 from trytond.config import config
@@ -24,51 +28,122 @@ logger = logging.getLogger(__name__)
 
 _db_timeout = config.getint('database', 'timeout')
 _cache_timeout = config.getint('bus', 'cache_timeout')
+_channel_size = config.getint('bus', 'channel_size', default=1000)
 _select_timeout = config.getint('bus', 'select_timeout')
 _long_polling_timeout = config.getint('bus', 'long_polling_timeout')
 _allow_subscribe = config.getboolean('bus', 'allow_subscribe')
 
 
 class _MessageQueue:
+    """Ring buffers of messages per channel indexed by message id
 
-    Message = collections.namedtuple('Message', 'channel content timestamp')
+    The messages are numbered in arrival order so the next message of a set
+    of channels is found from the last message without scanning the others.
+    """
 
-    def __init__(self, timeout):
+    Message = collections.namedtuple(
+        'Message', 'channel content timestamp sequence')
+
+    def __init__(self, timeout, size=None):
         super().__init__()
         self._lock = threading.Lock()
         self._timeout = timeout
-        self._messages = []
+        self._size = size if size is not None else _channel_size
+        self._sequence = 0
+        # All the messages in arrival order to expire them
+        self._messages = collections.deque()
+        self._channels = {}
+        self._index = {}
 
     def append(self, channel, element):
-        self._messages.append(
-            self.Message(channel, element, time.time()))
+        now = time.time()
+        with self._lock:
+            self._sequence += 1
+            message = self.Message(channel, element, now, self._sequence)
+            messages = self._channels.get(channel)
+            if messages is None:
+                messages = self._channels[channel] = collections.deque()
+            elif self._size and len(messages) >= self._size:
+                self._discard(messages.popleft())
+            messages.append(message)
+            self._messages.append(message)
+            message_id = element.get('message_id')
+            if message_id is not None:
+                self._index[message_id] = message
+            self._expire(now - self._timeout)
+
+    def _discard(self, message):
+        message_id = message.content.get('message_id')
+        if self._index.get(message_id) is message:
+            del self._index[message_id]
+
+    def _expire(self, oldest):
+        while self._messages and self._messages[0].timestamp < oldest:
+            message = self._messages.popleft()
+            messages = self._channels.get(message.channel)
+            if messages and messages[0] is message:
+                messages.popleft()
+                self._discard(message)
+                if not messages:
+                    del self._channels[message.channel]
 
     def get_next(self, channels, from_id=None):
         oldest = time.time() - self._timeout
-        to_delete_index = 0
-        found = False
-        first_message = None
-        message = self.Message(None, None, None)
-        for idx, item in enumerate(self._messages):
-            if item.timestamp < oldest:
-                to_delete_index = idx
-                continue
-            if item.channel not in channels:
-                continue
-            if not first_message:
-                first_message = item
-            if from_id is None or found:
-                message = item
-                break
-            found = item.content['message_id'] == from_id
-        else:
-            if first_message and not found:
-                message = first_message
-
         with self._lock:
-            del self._messages[:to_delete_index]
+            self._expire(oldest)
+            # The messages after the last one or all the messages if it is
+            # unknown
+            after = 0
+            if from_id is not None:
+                last = self._index.get(from_id)
+                if last is not None and last.channel in channels:
+                    after = last.sequence
+
+            next_ = None
+            for channel in channels:
+                messages = self._channels.get(channel)
+                if not messages:
+                    continue
+                if after:
+                    candidate = None
+                    for message in reversed(messages):
+                        if message.sequence <= after:
+                            break
+                        candidate = message
+                else:
+                    candidate = messages[0]
+                if candidate and (
+                        next_ is None or candidate.sequence < next_.sequence):
+                    next_ = candidate
+        if next_ is None:
+            return None, None
+        return next_.channel, next_.content
+
+
+class _AsyncEvent:
+    "Event set from any thread to wake up a coroutine"
+    __slots__ = ('_loop', '_future')
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._future = loop.create_future()
+
+    def set(self):
+        try:
+            self._loop.call_soon_threadsafe(self._set)
+        except RuntimeError:
+            # The loop is closed
+            pass
 
-        return message.channel, message.content
+    def _set(self):
+        if not self._future.done():
+            self._future.set_result(True)
+
+    async def wait(self, timeout):
+        try:
+            return await asyncio.wait_for(self._future, timeout)
+        except asyncio.TimeoutError:
+            return False
 
 
 class LongPollingBus:
@@ -76,11 +151,40 @@ class LongPollingBus:
     _channel = 'bus'
     _queues_lock = threading.Lock()
     _queues = collections.defaultdict(
-        lambda: {'timeout': None, 'events': collections.defaultdict(list)})
+        lambda: {'timeout': None, 'events': collections.defaultdict(set)})
     _messages = {}
 
     @classmethod
     def subscribe(cls, database, channels, last_message=None):
+        event = threading.Event()
+        response = cls._register(database, channels, last_message, event)
+        if response:
+            return response
+        try:
+            triggered = event.wait(_long_polling_timeout)
+        finally:
+            cls._unregister(database, channels, event)
+        return cls._get_response(database, channels, last_message, triggered)
+
+    @classmethod
+    async def subscribe_async(cls, database, channels, last_message=None):
+        """Subscribe like subscribe but wait for the message without holding
+        a thread"""
+        event = _AsyncEvent(asyncio.get_event_loop())
+        response = cls._register(database, channels, last_message, event)
+        if response:
+            return response
+        try:
+            triggered = await event.wait(_long_polling_timeout)
+        finally:
+            cls._unregister(database, channels, event)
+        return cls._get_response(database, channels, last_message, triggered)
+
+    @classmethod
+    def _register(cls, database, channels, last_message, event):
+        """Register the event to be set by the listener of the database on
+        a message for the channels and return the response if a message is
+        already available"""
         with cls._queues_lock:
             start_listener = database not in cls._queues
             cls._queues[database]['timeout'] = time.time() + _db_timeout
@@ -89,37 +193,38 @@ class LongPollingBus:
                     target=cls._listen, args=(database,), daemon=True)
                 cls._queues[database]['listener'] = listener
                 listener.start()
+            events = cls._queues[database]['events']
+            for channel in channels:
+                events[channel].add(event)
 
+        # The event is registered before looking for an available message
+        # to not miss a message received in between
         messages = cls._messages.get(database)
         if messages:
             channel, content = messages.get_next(channels, last_message)
             if content:
+                cls._unregister(database, channels, event)
                 return cls.create_response(channel, content)
 
-        event = threading.Event()
-        for channel in channels:
-            if channel in cls._queues[database]['events']:
-                event_channel = cls._queues[database]['events'][channel]
-            else:
-                with cls._queues_lock:
-                    event_channel = cls._queues[database]['events'][channel]
-            event_channel.append(event)
-
-        triggered = event.wait(_long_polling_timeout)
-        if not triggered:
-            response = cls.create_response(None, None)
-        else:
-            response = cls.create_response(
-                *cls._messages[database].get_next(channels, last_message))
-
+    @classmethod
+    def _unregister(cls, database, channels, event):
         with cls._queues_lock:
+            if database not in cls._queues:
+                return
+            events = cls._queues[database]['events']
             for channel in channels:
-                events = cls._queues[database]['events'][channel]
-                for e in events[:]:
-                    if e.is_set():
-                        events.remove(e)
+                if channel in events:
+                    events[channel].discard(event)
+                    if not events[channel]:
+                        del events[channel]
 
-        return response
+    @classmethod
+    def _get_response(cls, database, channels, last_message, triggered):
+        messages = cls._messages.get(database)
+        if not triggered or not messages:
+            return cls.create_response(None, None)
+        return cls.create_response(
+            *messages.get_next(channels, last_message))
 
     @classmethod
     def create_response(cls, channel, message):
@@ -163,9 +268,8 @@ class LongPollingBus:
                     messages.append(channel, message)
 
                     with cls._queues_lock:
-                        events = \
-                            cls._queues[database]['events'][channel].copy()
-                        cls._queues[database]['events'][channel].clear()
+                        events = cls._queues[database]['events'].pop(
+                            channel, ())
                     for event in events:
                         event.set()
                 now = time.time()
@@ -196,6 +300,11 @@ class LongPollingBus:
             logger.debug('Database backend do not support channels')
             return
 
+        if transaction.replica:
+            # Read replicas can not notify
+            with transaction.new_transaction(_nocache=True):
+                return cls.publish(channel, message)
+
         cursor = transaction.connection.cursor()
         message['message_id'] = str(uuid.uuid4())
         payload = json.dumps({
@@ -221,9 +330,7 @@ def subscribe(request, database_name):
     if user is None:
         raise BadRequest
 
-    channels = set(filter(lambda c: not c.startswith('user:'), channels))
-    channels.add('user:%s' % user)
-
+    channels = _user_channels(user, channels)
     last_message = request.parsed_data.get('last_message')
 
     logger.debug(
@@ -236,6 +343,100 @@ def subscribe(request, database_name):
         content_type='application/json')
 
 
+def _user_channels(user, channels):
+    channels = set(filter(lambda c: not c.startswith('user:'), channels))
+    channels.add('user:%s' % user)
+    return channels
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI application serving the bus route
+
+    The clients wait for their messages in the event loop instead of holding
+    a thread each."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] != 'http':
+        return
+
+    path = scope['path'].strip('/').split('/')
+    if len(path) != 2 or path[1] != 'bus':
+        return await _asgi_response(send, http.client.NOT_FOUND)
+    database_name = path[0]
+    if scope['method'] != 'POST':
+        return await _asgi_response(send, http.client.METHOD_NOT_ALLOWED)
+    if not _allow_subscribe:
+        return await _asgi_response(send, http.client.NOT_IMPLEMENTED)
+
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1')
+        for k, v in scope['headers']}
+    auth = parse_authorization_header(headers.get('authorization'))
+    if not auth:
+        return await _asgi_response(send, http.client.UNAUTHORIZED)
+
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    try:
+        data = json.loads(b''.join(body), object_hook=JSONDecoder())
+        channels = data.get('channels', [])
+        last_message = data.get('last_message')
+    except (ValueError, AttributeError):
+        return await _asgi_response(send, http.client.BAD_REQUEST)
+
+    remote_addr = (scope.get('client') or (None,))[0]
+    context = {'_request': {
+            'remote_addr': remote_addr,
+            'http_host': headers.get('host'),
+            'scheme': scope.get('scheme', 'http'),
+            'is_secure': scope.get('scheme') == 'https',
+            }}
+    loop = asyncio.get_event_loop()
+    user = await loop.run_in_executor(None, functools.partial(
+            security.check, database_name, auth.get('userid'),
+            auth.get('session'), context=context))
+    if not user:
+        return await _asgi_response(send, http.client.UNAUTHORIZED)
+
+    channels = _user_channels(user, channels)
+    logger.debug(
+        "getting bus messages from %s@%s/%s for %s since %s",
+        auth.get('username'), remote_addr, scope['path'],
+        channels, last_message)
+    if hasattr(Bus, 'subscribe_async'):
+        bus_response = await Bus.subscribe_async(
+            database_name, channels, last_message)
+    else:
+        bus_response = await loop.run_in_executor(None,
+            Bus.subscribe, database_name, channels, last_message)
+    return await _asgi_response(send, http.client.OK,
+        json.dumps(bus_response, cls=JSONEncoder, separators=(',', ':')),
+        content_type='application/json')
+
+
+async def _asgi_response(send, status, body=None, content_type='text/plain'):
+    if body is None:
+        body = http.client.responses[status]
+    await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type.encode('latin-1'))],
+            })
+    await send({
+            'type': 'http.response.body',
+            'body': body.encode('utf-8'),
+            })
+
+
 def notify(title, body=None, priority=1, user=None, client=None):
     if user is None:
         if client is None:
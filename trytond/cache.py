@@ -1,18 +1,42 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import hashlib
+import json
+import logging
+import os
+import pickle
+import select
+import sys
+import threading
+import time
+import urllib.parse
 from threading import Lock
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, Counter
 from datetime import datetime
 
 from sql import Table
 from sql.functions import CurrentTimestamp
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from trytond import backend
 from trytond.config import config
 from trytond.transaction import Transaction
-from trytond.tools import resolve
+from trytond.tools import resolve, grouped_slice
 
-__all__ = ['BaseCache', 'Cache', 'LRUDict']
+__all__ = ['BaseCache', 'Cache', 'LRUDict', 'MemoryCache', 'SharedCache',
+    'TwoTierCache']
+logger = logging.getLogger(__name__)
 _clear_timeout = config.getint('cache', 'clean_timeout', default=5 * 60)
+_default_duration = config.getint('cache', 'duration') or None
+_max_bytes = config.getint('cache', 'max_bytes') or None
+_replica_lag = config.getfloat('database', 'replica_lag', default=5)
+_select_timeout = config.getint('cache', 'select_timeout', default=60)
+_shards = config.getint('cache', 'shards', default=1)
+_missing = object()
 
 
 def freeze(o):
@@ -26,24 +50,45 @@ def freeze(o):
 
 class BaseCache(object):
     _cache_instance = []
+    _stats_names = ('hits', 'misses', 'sets', 'evictions', 'invalidations')
 
-    def __init__(self, name, size_limit=1024, context=True):
+    def __init__(self, name, size_limit=1024, context=True, duration=None):
         self._name = name
         self.size_limit = size_limit
         self.context = context
+        self.duration = duration
+        self._stats = defaultdict(Counter)
+        self._invalidations = {}
         self._cache_instance.append(self)
 
     def _key(self, key):
         if self.context:
-            return (key, Transaction().user, freeze(Transaction().context))
+            transaction = Transaction()
+            return (key, transaction.user, transaction.frozen_context())
         return key
 
+    def _keys(self, keys):
+        if self.context:
+            transaction = Transaction()
+            suffix = (transaction.user, transaction.frozen_context())
+            return [(key,) + suffix for key in keys]
+        return list(keys)
+
     def get(self, key, default=None):
         raise NotImplemented
 
+    def get_many(self, keys, default=None):
+        "Return a dictionary with the value of each key or default"
+        return {key: self.get(key, default) for key in keys}
+
     def set(self, key, value):
         raise NotImplemented
 
+    def set_many(self, mapping):
+        "Set the value of each key of mapping"
+        for key, value in mapping.items():
+            self.set(key, value)
+
     def clear(self):
         raise NotImplemented
 
@@ -63,48 +108,131 @@ class BaseCache(object):
     def drop(cls, dbname):
         raise NotImplemented
 
+    def _count(self, dbname, name, value=1):
+        self._stats[dbname][name] += value
+
+    def _invalidated(self, dbname):
+        self._count(dbname, 'invalidations')
+        self._invalidations[dbname] = time.time()
+
+    def _stale(self, dbname):
+        """Return if the transaction reads from a replica which may not have
+        the changes of the last invalidation"""
+        return (Transaction().replica
+            and (time.time() - self._invalidations.get(dbname, 0)
+                < _replica_lag))
+
+    def size(self, dbname):
+        "Return the number of entries and of bytes stored for dbname"
+        return 0, 0
+
+    def stats(self, dbname):
+        "Return the counters and the size of the cache for database dbname"
+        stats = dict.fromkeys(self._stats_names, 0)
+        stats.update(self._stats.get(dbname, {}))
+        stats['size'], stats['bytes'] = self.size(dbname)
+        return stats
+
+    @classmethod
+    def all_stats(cls, dbname):
+        "Return the statistics of all the caches for database dbname"
+        return {inst._name: inst.stats(dbname)
+            for inst in cls._cache_instance}
+
 
 class MemoryCache(BaseCache):
     """
     A key value LRU cache with size limit.
+    The entries are sharded by key hash so lookups do not wait for a lock.
     """
     _resets = {}
     _resets_lock = Lock()
     _clean_last = datetime.now()
 
-    def __init__(self, name, size_limit=1024, context=True):
-        super(MemoryCache, self).__init__(name, size_limit, context)
+    def __init__(self, name, size_limit=1024, context=True, duration=None):
+        super(MemoryCache, self).__init__(
+            name, size_limit, context, duration)
         self._cache = {}
         self._timestamp = {}
         self._lock = Lock()
 
+    def _database_cache(self, dbname):
+        try:
+            return self._cache[dbname]
+        except KeyError:
+            with self._lock:
+                return self._cache.setdefault(dbname, ShardedLRUDict(
+                        self.size_limit, _shards, _max_bytes))
+
     def get(self, key, default=None):
         dbname = Transaction().database.name
         key = self._key(key)
-        with self._lock:
-            cache = self._cache.setdefault(dbname, LRUDict(self.size_limit))
-            try:
-                result = cache[key] = cache.pop(key)
-                return result
-            except (KeyError, TypeError):
-                return default
+        try:
+            result = self._database_cache(dbname).get(key, _missing)
+        except TypeError:
+            result = _missing
+        if result is _missing:
+            self._count(dbname, 'misses')
+            return default
+        self._count(dbname, 'hits')
+        return result
+
+    def get_many(self, keys, default=None):
+        dbname = Transaction().database.name
+        keys = list(keys)
+        values = self._database_cache(dbname).get_many(
+            self._keys(keys), _missing)
+        result, misses = {}, 0
+        for key, value in zip(keys, values):
+            if value is _missing:
+                value = default
+                misses += 1
+            result[key] = value
+        self._count(dbname, 'hits', len(keys) - misses)
+        self._count(dbname, 'misses', misses)
+        return result
 
     def set(self, key, value):
         dbname = Transaction().database.name
+        if self._stale(dbname):
+            return value
         key = self._key(key)
-        with self._lock:
-            cache = self._cache.setdefault(dbname, LRUDict(self.size_limit))
-            try:
-                cache[key] = value
-            except TypeError:
-                pass
+        try:
+            evicted = self._database_cache(dbname).set(key, value)
+        except TypeError:
+            pass
+        else:
+            self._count(dbname, 'sets')
+            self._count(dbname, 'evictions', evicted)
         return value
 
+    def set_many(self, mapping):
+        dbname = Transaction().database.name
+        if self._stale(dbname):
+            return
+        keys = self._keys(mapping.keys())
+        sets, evicted = self._database_cache(dbname).set_many(
+            zip(keys, mapping.values()))
+        self._count(dbname, 'sets', sets)
+        self._count(dbname, 'evictions', evicted)
+
     def clear(self):
         dbname = Transaction().database.name
         Cache.reset(dbname, self._name)
         with self._lock:
-            self._cache[dbname] = LRUDict(self.size_limit)
+            self._clear(dbname)
+
+    def _clear(self, dbname):
+        self._cache[dbname] = ShardedLRUDict(
+            self.size_limit, _shards, _max_bytes)
+        self._invalidated(dbname)
+
+    def size(self, dbname):
+        "Return the number of entries and of bytes stored for dbname"
+        cache = self._cache.get(dbname)
+        if cache is None:
+            return 0, 0
+        return len(cache), cache.bytes
 
     @classmethod
     def clean(cls, dbname):
@@ -124,7 +252,7 @@ class MemoryCache(BaseCache):
                     if (not inst_timestamp
                             or timestamps[inst._name] > inst_timestamp):
                         inst._timestamp[dbname] = timestamps[inst._name]
-                        inst._cache[dbname] = LRUDict(inst.size_limit)
+                        inst._clear(dbname)
         cls._clean_last = datetime.now()
 
     @classmethod
@@ -162,6 +290,708 @@ class MemoryCache(BaseCache):
         for inst in cls._cache_instance:
             inst._cache.pop(dbname, None)
 
+    @classmethod
+    def stop_listener(cls, dbname):
+        "Stop listening to the invalidations of dbname in the process"
+        pass
+
+
+def _canonical(key):
+    "Return a representation of the frozen key stable between processes"
+    if isinstance(key, frozenset):
+        return '{%s}' % ','.join(sorted(_canonical(k) for k in key))
+    elif isinstance(key, tuple):
+        return '(%s)' % ','.join(_canonical(k) for k in key)
+    return repr(key)
+
+
+class MemoryStore(object):
+    """
+    An in-process key value store with the interface of the shared stores.
+    Each namespace is a LRU with optional entry expiration.
+    """
+    shared = False
+
+    def __init__(self, uri=None):
+        self._lock = Lock()
+        self._entries = defaultdict(OrderedDict)
+        self._bytes = defaultdict(int)
+        self._generations = defaultdict(int)
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key])[0]
+
+    def get_many(self, namespace, keys):
+        "Return the list of the data of keys"
+        now = time.time()
+        result = []
+        with self._lock:
+            entries = self._entries.get(namespace)
+            for key in keys:
+                if not entries or key not in entries:
+                    result.append(None)
+                    continue
+                expire, data = entries[key]
+                if expire is not None and expire < now:
+                    del entries[key]
+                    self._bytes[namespace] -= len(data)
+                    result.append(None)
+                    continue
+                entries.move_to_end(key)
+                result.append(data)
+        return result
+
+    def set(self, namespace, key, data, duration=None, size_limit=None,
+            max_bytes=None):
+        "Set the data of key and return the number of evicted entries"
+        return self.set_many(namespace, {key: data}, duration=duration,
+            size_limit=size_limit, max_bytes=max_bytes)
+
+    def set_many(self, namespace, mapping, duration=None, size_limit=None,
+            max_bytes=None):
+        "Set the data of each key and return the number of evicted entries"
+        expire = time.time() + duration if duration else None
+        with self._lock:
+            entries = self._entries[namespace]
+            for key, data in mapping.items():
+                if key in entries:
+                    self._bytes[namespace] -= len(entries.pop(key)[1])
+                entries[key] = (expire, data)
+                self._bytes[namespace] += len(data)
+            evicted = 0
+            while entries and (
+                    (size_limit and len(entries) > size_limit)
+                    or (max_bytes and self._bytes[namespace] > max_bytes)):
+                _, (_, old) = entries.popitem(last=False)
+                self._bytes[namespace] -= len(old)
+                evicted += 1
+        return evicted
+
+    def clear(self, namespace):
+        with self._lock:
+            self._entries.pop(namespace, None)
+            self._bytes.pop(namespace, None)
+
+    def size(self, namespace):
+        "Return the number of entries and of bytes of the namespace"
+        with self._lock:
+            return (len(self._entries.get(namespace, ())),
+                self._bytes.get(namespace, 0))
+
+    def generations(self, namespaces):
+        "Return the generation counter of each namespace"
+        with self._lock:
+            return [self._generations.get(n, 0) for n in namespaces]
+
+    def incr(self, namespaces):
+        "Increment the generation counter of the namespaces"
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] += 1
+            return [self._generations[n] for n in namespaces]
+
+
+class RedisStore(object):
+    """
+    A key value store on a Redis server shared by all the processes.
+    The entries of a namespace are indexed by a sorted set of their last
+    access time to evict the least recently used. Their sizes and
+    expiration times are kept to honour the bytes limit and to prune the
+    expired entries from the index.
+    """
+    shared = True
+
+    def __init__(self, uri):
+        if redis is None:
+            raise ImportError("redis is required for '%s'" % uri)
+        self._client = redis.Redis.from_url(uri)
+
+    @staticmethod
+    def _index(namespace):
+        return 'trytond:%s' % namespace
+
+    @staticmethod
+    def _sizes(namespace):
+        return 'trytond-sizes:%s' % namespace
+
+    @staticmethod
+    def _bytes(namespace):
+        return 'trytond-bytes:%s' % namespace
+
+    @staticmethod
+    def _expires(namespace):
+        return 'trytond-expires:%s' % namespace
+
+    @staticmethod
+    def _generation(namespace):
+        return 'trytond-generation:%s' % namespace
+
+    def _name(self, namespace, key):
+        return '%s:%s' % (self._index(namespace), key)
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key])[0]
+
+    def get_many(self, namespace, keys):
+        "Return the list of the data of keys"
+        if not keys:
+            return []
+        names = [self._name(namespace, k) for k in keys]
+        result = self._client.mget(names)
+        now = time.time()
+        hits = {n: now for n, d in zip(names, result) if d is not None}
+        if hits:
+            self._client.zadd(self._index(namespace), hits, xx=True)
+        return result
+
+    def set(self, namespace, key, data, duration=None, size_limit=None,
+            max_bytes=None):
+        "Set the data of key and return the number of evicted entries"
+        return self.set_many(namespace, {key: data}, duration=duration,
+            size_limit=size_limit, max_bytes=max_bytes)
+
+    def set_many(self, namespace, mapping, duration=None, size_limit=None,
+            max_bytes=None):
+        "Set the data of each key and return the number of evicted entries"
+        if not mapping:
+            return 0
+        index = self._index(namespace)
+        sizes = self._sizes(namespace)
+        expires = self._expires(namespace)
+        now = time.time()
+        names = []
+        with self._client.pipeline() as pipe:
+            for key, data in mapping.items():
+                name = self._name(namespace, key)
+                names.append((name, len(data)))
+                pipe.hget(sizes, name)
+                pipe.set(name, data,
+                    px=int(duration * 1000) if duration else None)
+                pipe.hset(sizes, name, len(data))
+                pipe.zadd(index, {name: now})
+                if duration:
+                    pipe.zadd(expires, {name: now + duration})
+                else:
+                    pipe.zrem(expires, name)
+            results = pipe.execute()
+        # The old sizes are read atomically with their replacement
+        delta = sum(size - int(old or 0)
+            for (_, size), old in zip(names, results[::5]))
+        if delta:
+            self._client.incrby(self._bytes(namespace), delta)
+        self._prune(namespace, now)
+        return self._evict(namespace, size_limit, max_bytes)
+
+    def _prune(self, namespace, now):
+        "Remove the expired entries from the index"
+        names = self._client.zrangebyscore(
+            self._expires(namespace), '-inf', now)
+        if names:
+            self._remove(namespace, names)
+
+    def _evict(self, namespace, size_limit, max_bytes):
+        "Remove the least recently used entries above the limits"
+        if not size_limit and not max_bytes:
+            return 0
+        index = self._index(namespace)
+        with self._client.pipeline(transaction=False) as pipe:
+            pipe.zcard(index)
+            pipe.get(self._bytes(namespace))
+            count, bytes_ = pipe.execute()
+        over_count = count - size_limit if size_limit else 0
+        over_bytes = int(bytes_ or 0) - max_bytes if max_bytes else 0
+        names = []
+        start = 0
+        while over_count > 0 or over_bytes > 0:
+            oldest = self._client.zrange(index, start, start + 99)
+            if not oldest:
+                break
+            start += len(oldest)
+            oldest_sizes = self._client.hmget(self._sizes(namespace), oldest)
+            for name, size in zip(oldest, oldest_sizes):
+                if over_count <= 0 and over_bytes <= 0:
+                    break
+                names.append(name)
+                over_count -= 1
+                over_bytes -= int(size or 0)
+        if not names:
+            return 0
+        return self._remove(namespace, names)
+
+    def _remove(self, namespace, names):
+        "Remove the entries and return the number of them still indexed"
+        sizes = self._sizes(namespace)
+        with self._client.pipeline() as pipe:
+            for name in names:
+                pipe.hget(sizes, name)
+                pipe.hdel(sizes, name)
+            pipe.delete(*names)
+            pipe.zrem(self._index(namespace), *names)
+            pipe.zrem(self._expires(namespace), *names)
+            results = pipe.execute()
+        # Only the entries deleted by this call are counted in case of
+        # concurrent removals
+        removed = [(int(size or 0), deleted)
+            for size, deleted in zip(results[0:-3:2], results[1:-3:2])]
+        bytes_ = sum(size for size, deleted in removed if deleted)
+        if bytes_:
+            self._client.decrby(self._bytes(namespace), bytes_)
+        return sum(1 for _, deleted in removed if deleted)
+
+    def clear(self, namespace):
+        index = self._index(namespace)
+        names = self._client.zrange(index, 0, -1)
+        with self._client.pipeline() as pipe:
+            for sub_names in grouped_slice(names, 1000):
+                pipe.delete(*sub_names)
+            pipe.delete(index, self._sizes(namespace),
+                self._bytes(namespace), self._expires(namespace))
+            pipe.execute()
+
+    def size(self, namespace):
+        "Return the number of entries and of bytes of the namespace"
+        self._prune(namespace, time.time())
+        with self._client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._index(namespace))
+            pipe.get(self._bytes(namespace))
+            count, bytes_ = pipe.execute()
+        return count, int(bytes_ or 0)
+
+    def generations(self, namespaces):
+        "Return the generation counter of each namespace"
+        if not namespaces:
+            return []
+        values = self._client.mget(
+            [self._generation(n) for n in namespaces])
+        return [int(v or 0) for v in values]
+
+    def incr(self, namespaces):
+        "Increment the generation counter of the namespaces"
+        with self._client.pipeline() as pipe:
+            for namespace in namespaces:
+                pipe.incr(self._generation(namespace))
+            return pipe.execute()
+
+
+STORES = {
+    'memory': MemoryStore,
+    'redis': RedisStore,
+    'rediss': RedisStore,
+    }
+
+
+class SharedCache(MemoryCache):
+    """
+    A key value cache stored in a key value store shared between the workers.
+    Invalidations are pushed to all the workers using the database channel
+    and fall back to the ir_cache polling of MemoryCache otherwise.
+    """
+    _store = None
+    _store_lock = Lock()
+    _channel = 'ir_cache'
+    _listener = {}
+    _listener_lock = Lock()
+
+    def __init__(self, name, size_limit=1024, context=True, duration=None):
+        super(SharedCache, self).__init__(
+            name, size_limit, context, duration or _default_duration)
+
+    @classmethod
+    def get_store(cls):
+        with cls._store_lock:
+            if cls._store is None:
+                uri = config.get('cache', 'uri', default='memory://')
+                scheme = urllib.parse.urlparse(uri).scheme
+                cls._store = STORES[scheme](uri)
+            return cls._store
+
+    def _namespace(self, dbname):
+        return '%s:%s' % (dbname, self._name)
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(_canonical(key).encode('utf-8')).hexdigest()
+
+    def get(self, key, default=None):
+        dbname = Transaction().database.name
+        data = self.get_store().get(
+            self._namespace(dbname), self._digest(self._key(key)))
+        if data is None:
+            self._count(dbname, 'misses')
+            return default
+        self._count(dbname, 'hits')
+        return pickle.loads(data)
+
+    def get_many(self, keys, default=None):
+        dbname = Transaction().database.name
+        keys = list(keys)
+        datas = self.get_store().get_many(
+            self._namespace(dbname),
+            [self._digest(k) for k in self._keys(keys)])
+        result, misses = {}, 0
+        for key, data in zip(keys, datas):
+            if data is None:
+                result[key] = default
+                misses += 1
+            else:
+                result[key] = pickle.loads(data)
+        self._count(dbname, 'hits', len(keys) - misses)
+        self._count(dbname, 'misses', misses)
+        return result
+
+    def set(self, key, value):
+        dbname = Transaction().database.name
+        if self._stale(dbname):
+            return value
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return value
+        evicted = self.get_store().set(
+            self._namespace(dbname), self._digest(self._key(key)), data,
+            duration=self.duration, size_limit=self.size_limit,
+            max_bytes=_max_bytes)
+        self._count(dbname, 'sets')
+        self._count(dbname, 'evictions', evicted)
+        return value
+
+    def set_many(self, mapping):
+        dbname = Transaction().database.name
+        if self._stale(dbname):
+            return
+        datas = {}
+        for key, value in zip(self._keys(mapping.keys()), mapping.values()):
+            try:
+                datas[self._digest(key)] = pickle.dumps(
+                    value, pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                continue
+        evicted = self.get_store().set_many(
+            self._namespace(dbname), datas,
+            duration=self.duration, size_limit=self.size_limit,
+            max_bytes=_max_bytes)
+        self._count(dbname, 'sets', len(datas))
+        self._count(dbname, 'evictions', evicted)
+
+    def _clear(self, dbname):
+        self.get_store().clear(self._namespace(dbname))
+        self._invalidated(dbname)
+
+    def size(self, dbname):
+        return self.get_store().size(self._namespace(dbname))
+
+    @classmethod
+    def clean(cls, dbname):
+        if not Transaction().database.has_channel():
+            super(SharedCache, cls).clean(dbname)
+            return
+        if cls.get_store().shared:
+            # The entries are invalidated in the store by the resets
+            return
+        cls._start_listener(dbname)
+
+    @classmethod
+    def _start_listener(cls, dbname):
+        key = (os.getpid(), dbname)
+        with cls._listener_lock:
+            if key not in cls._listener:
+                cls._listener[key] = listener = threading.Thread(
+                    target=cls._listen, args=(dbname,), daemon=True)
+                listener.start()
+
+    @classmethod
+    def resets(cls, dbname):
+        if not Transaction().database.has_channel():
+            super(SharedCache, cls).resets(dbname)
+            return
+        with cls._resets_lock:
+            resets = cls._resets.setdefault(dbname, set())
+            names = sorted(resets)
+            resets.clear()
+        if not names:
+            return
+        for inst in cls._cache_instance:
+            if inst._name in names:
+                inst._clear(dbname)
+        if cls.get_store().shared:
+            return
+        # 8000 bytes of payload for names up to 64 characters
+        cls._notify(list(n) for n in grouped_slice(names, 100))
+
+    @classmethod
+    def _notify(cls, payloads):
+        with Transaction().new_transaction(_nocache=True) as transaction,\
+                transaction.connection.cursor() as cursor:
+            for payload in payloads:
+                cursor.execute('NOTIFY "%s", %%s' % cls._channel,
+                    (json.dumps(payload, separators=(',', ':')),))
+
+    @classmethod
+    def _received(cls, dbname, names):
+        for inst in cls._cache_instance:
+            if inst._name in names:
+                inst._clear(dbname)
+
+    @classmethod
+    def _listen(cls, dbname):
+        Database = backend.get('Database')
+        database = Database(dbname)
+        key = (os.getpid(), dbname)
+        current_thread = threading.current_thread()
+
+        logger.info("listening on channel '%s' of '%s'", cls._channel, dbname)
+        conn = database.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('LISTEN "%s"' % cls._channel)
+            conn.commit()
+
+            # Invalidations may have been missed while nobody was listening
+            for inst in cls._cache_instance:
+                inst._clear(dbname)
+
+            while cls._listener.get(key) == current_thread:
+                readable, _, _ = select.select(
+                    [conn], [], [], _select_timeout)
+                if not readable:
+                    continue
+
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop()
+                    if notification.payload:
+                        cls._received(
+                            dbname, json.loads(notification.payload))
+        except Exception:
+            logger.error(
+                "cache listener on '%s' crashed", dbname, exc_info=True)
+            raise
+        finally:
+            database.put_connection(conn)
+            with cls._listener_lock:
+                if cls._listener.get(key) == current_thread:
+                    del cls._listener[key]
+
+    @classmethod
+    def drop(cls, dbname):
+        with cls._listener_lock:
+            cls._listener.pop((os.getpid(), dbname), None)
+        for inst in cls._cache_instance:
+            inst._clear(dbname)
+
+    @classmethod
+    def stop_listener(cls, dbname):
+        with cls._listener_lock:
+            listener = cls._listener.pop((os.getpid(), dbname), None)
+        if listener is None or listener == threading.current_thread():
+            return
+        # Wake up the listener so it leaves its loop
+        Database = backend.get('Database')
+        database = Database(dbname)
+        conn = database.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('NOTIFY "%s"' % cls._channel)
+            conn.commit()
+        finally:
+            database.put_connection(conn)
+        listener.join()
+
+
+class TwoTierCache(SharedCache):
+    """
+    A SharedCache with a local LRU in front of the store.
+    The entries are validated by a generation counter per cache name which
+    is incremented by the resets instead of clearing the store.
+    """
+
+    def __init__(self, name, size_limit=1024, context=True, duration=None):
+        super(TwoTierCache, self).__init__(
+            name, size_limit, context, duration)
+        self._generations = {}
+
+    def _generation(self, dbname):
+        generation = self._generations.get(dbname)
+        if generation is None:
+            generation, = self.get_store().generations(
+                [self._namespace(dbname)])
+            self._generations[dbname] = generation
+        return generation
+
+    def get(self, key, default=None):
+        dbname = Transaction().database.name
+        generation = self._generation(dbname)
+        key = self._key(key)
+        try:
+            entry = self._database_cache(dbname).get(key)
+        except TypeError:
+            entry = None
+        if entry is not None:
+            entry_generation, expire, value = entry
+            if (entry_generation == generation
+                    and (expire is None or expire > time.time())):
+                self._count(dbname, 'hits')
+                return value
+        data = self.get_store().get(
+            self._namespace(dbname),
+            '%s:%s' % (generation, self._digest(key)))
+        if data is None:
+            self._count(dbname, 'misses')
+            return default
+        self._count(dbname, 'hits')
+        value = pickle.loads(data)
+        self._local_set(dbname, key, generation, value)
+        return value
+
+    def get_many(self, keys, default=None):
+        dbname = Transaction().database.name
+        generation = self._generation(dbname)
+        keys = list(keys)
+        local_keys = self._keys(keys)
+        entries = self._database_cache(dbname).get_many(local_keys)
+        now = time.time()
+        result, to_fetch = {}, []
+        for key, local_key, entry in zip(keys, local_keys, entries):
+            if entry is not None:
+                entry_generation, expire, value = entry
+                if (entry_generation == generation
+                        and (expire is None or expire > now)):
+                    result[key] = value
+                    continue
+            to_fetch.append((key, local_key))
+        misses = 0
+        if to_fetch:
+            datas = self.get_store().get_many(
+                self._namespace(dbname),
+                ['%s:%s' % (generation, self._digest(k))
+                    for _, k in to_fetch])
+            expire = now + self.duration if self.duration else None
+            to_set = []
+            for (key, local_key), data in zip(to_fetch, datas):
+                if data is None:
+                    result[key] = default
+                    misses += 1
+                    continue
+                value = result[key] = pickle.loads(data)
+                to_set.append((local_key, (generation, expire, value)))
+            self._database_cache(dbname).set_many(to_set)
+        self._count(dbname, 'hits', len(keys) - misses)
+        self._count(dbname, 'misses', misses)
+        return result
+
+    def set(self, key, value):
+        dbname = Transaction().database.name
+        if self._stale(dbname):
+            return value
+        generation = self._generation(dbname)
+        key = self._key(key)
+        self._local_set(dbname, key, generation, value)
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return value
+        evicted = self.get_store().set(
+            self._namespace(dbname),
+            '%s:%s' % (generation, self._digest(key)), data,
+            duration=self.duration, size_limit=self.size_limit,
+            max_bytes=_max_bytes)
+        self._count(dbname, 'sets')
+        self._count(dbname, 'evictions', evicted)
+        return value
+
+    def set_many(self, mapping):
+        dbname = Transaction().database.name
+        if self._stale(dbname):
+            return
+        generation = self._generation(dbname)
+        keys = self._keys(mapping.keys())
+        expire = time.time() + self.duration if self.duration else None
+        self._database_cache(dbname).set_many(
+            (k, (generation, expire, v))
+            for k, v in zip(keys, mapping.values()))
+        datas = {}
+        for key, value in zip(keys, mapping.values()):
+            try:
+                datas['%s:%s' % (generation, self._digest(key))] = (
+                    pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                continue
+        evicted = self.get_store().set_many(
+            self._namespace(dbname), datas,
+            duration=self.duration, size_limit=self.size_limit,
+            max_bytes=_max_bytes)
+        self._count(dbname, 'sets', len(datas))
+        self._count(dbname, 'evictions', evicted)
+
+    def _local_set(self, dbname, key, generation, value):
+        expire = time.time() + self.duration if self.duration else None
+        try:
+            self._database_cache(dbname).set(
+                key, (generation, expire, value))
+        except TypeError:
+            pass
+
+    def _clear(self, dbname):
+        self._cache[dbname] = ShardedLRUDict(
+            self.size_limit, _shards, _max_bytes)
+        self._generations.pop(dbname, None)
+        if self.get_store().shared:
+            self._invalidated(dbname)
+        else:
+            super(TwoTierCache, self)._clear(dbname)
+
+    @classmethod
+    def clean(cls, dbname):
+        if Transaction().database.has_channel():
+            cls._start_listener(dbname)
+        elif cls.get_store().shared:
+            # Without channel, the generations are fetched once per
+            # transaction
+            insts = [i for i in cls._cache_instance
+                if isinstance(i, TwoTierCache) and i._generations]
+            generations = cls.get_store().generations(
+                [i._namespace(dbname) for i in insts])
+            for inst, generation in zip(insts, generations):
+                if generation != inst._generations.get(dbname):
+                    inst._invalidations[dbname] = time.time()
+                inst._generations[dbname] = generation
+        else:
+            super(SharedCache, cls).clean(dbname)
+
+    @classmethod
+    def resets(cls, dbname):
+        store = cls.get_store()
+        has_channel = Transaction().database.has_channel()
+        if not has_channel and not store.shared:
+            super(SharedCache, cls).resets(dbname)
+            return
+        with cls._resets_lock:
+            resets = cls._resets.setdefault(dbname, set())
+            names = sorted(resets)
+            resets.clear()
+        if not names:
+            return
+        generations = dict(zip(names,
+                store.incr(['%s:%s' % (dbname, n) for n in names])))
+        cls._received(dbname, generations)
+        if has_channel:
+            cls._notify(
+                {n: generations[n] for n in sub_names}
+                for sub_names in grouped_slice(names, 100))
+
+    @classmethod
+    def _received(cls, dbname, generations):
+        if not cls.get_store().shared:
+            super(TwoTierCache, cls)._received(dbname, generations)
+            return
+        for inst in cls._cache_instance:
+            if (isinstance(inst, TwoTierCache)
+                    and inst._name in generations):
+                generation = generations[inst._name]
+                inst._generations[dbname] = max(
+                    generation, inst._generations.get(dbname) or 0)
+                inst._invalidated(dbname)
+
 
 if config.get('cache', 'class'):
     Cache = resolve(config.get('cache', 'class'))
@@ -200,6 +1030,129 @@ class LRUDict(OrderedDict):
             self.popitem(last=False)
 
 
+def sizeof(value, _seen=None):
+    "Return the approximate size in bytes of value and its content"
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen)
+            for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(v, _seen) for v in value)
+    return size
+
+
+class ShardedLRUDict(object):
+    """
+    Mapping with a size limit split in shards by key hash.
+    Lookups never wait for a lock, the recency of an entry is only updated
+    when its shard is not locked. Each shard is bounded by number of entries
+    and optionally by approximate size in bytes.
+    """
+    __slots__ = ('size_limit', 'max_bytes', '_shards', '_locks', '_bytes')
+
+    def __init__(self, size_limit, shards=1, max_bytes=None):
+        assert size_limit > 0
+        shards = max(1, min(shards, size_limit))
+        self.size_limit = -(-size_limit // shards)
+        self.max_bytes = max_bytes // shards if max_bytes else None
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._locks = [Lock() for _ in range(shards)]
+        self._bytes = [0] * shards
+
+    def __len__(self):
+        return sum(len(s) for s in self._shards)
+
+    @property
+    def bytes(self):
+        return sum(self._bytes)
+
+    def get(self, key, default=None):
+        index = hash(key) % len(self._shards)
+        shard = self._shards[index]
+        try:
+            value, _ = shard[key]
+        except KeyError:
+            return default
+        lock = self._locks[index]
+        if lock.acquire(False):
+            try:
+                shard.move_to_end(key)
+            except KeyError:
+                pass
+            finally:
+                lock.release()
+        return value
+
+    def get_many(self, keys, default=None):
+        "Return the list of the values of keys or default"
+        shards = len(self._shards)
+        values, found = [], defaultdict(list)
+        for key in keys:
+            try:
+                index = hash(key) % shards
+                value, _ = self._shards[index][key]
+            except (KeyError, TypeError):
+                values.append(default)
+                continue
+            values.append(value)
+            found[index].append(key)
+        for index, sub_keys in found.items():
+            shard, lock = self._shards[index], self._locks[index]
+            if lock.acquire(False):
+                try:
+                    for key in sub_keys:
+                        if key in shard:
+                            shard.move_to_end(key)
+                finally:
+                    lock.release()
+        return values
+
+    def set(self, key, value):
+        "Set the value of key and return the number of evicted entries"
+        index = hash(key) % len(self._shards)
+        size = sizeof(value) if self.max_bytes else 0
+        with self._locks[index]:
+            return self._set(index, [(key, value, size)])
+
+    def set_many(self, items):
+        "Set the items and return the number of set and evicted entries"
+        shards = len(self._shards)
+        entries = defaultdict(list)
+        for key, value in items:
+            try:
+                index = hash(key) % shards
+            except TypeError:
+                continue
+            size = sizeof(value) if self.max_bytes else 0
+            entries[index].append((key, value, size))
+        evicted = 0
+        for index, sub_entries in entries.items():
+            with self._locks[index]:
+                evicted += self._set(index, sub_entries)
+        return sum(len(e) for e in entries.values()), evicted
+
+    def _set(self, index, entries):
+        shard = self._shards[index]
+        for key, value, size in entries:
+            if key in shard:
+                self._bytes[index] -= shard.pop(key)[1]
+            shard[key] = (value, size)
+            self._bytes[index] += size
+        evicted = 0
+        while len(shard) > 1 and (len(shard) > self.size_limit
+                or (self.max_bytes
+                    and self._bytes[index] > self.max_bytes)):
+            _, (_, old_size) = shard.popitem(last=False)
+            self._bytes[index] -= old_size
+            evicted += 1
+        return evicted
+
+
 class LRUDictTransaction(LRUDict):
     """
     Dictionary with a size limit. (see LRUDict)
@@ -40,6 +40,15 @@ def get_parser_daemon():
     return parser
 
 
+def get_parser_server():
+    parser = get_parser_daemon()
+    parser.add_argument("-n", dest='workers', type=int, default=0,
+        help="number of processes forked after loading the databases")
+    parser.add_argument("--warm", dest='warm', action='store_true',
+        help="fill the access caches when loading the databases")
+    return parser
+
+
 def get_parser_worker():
     parser = get_parser_daemon()
     parser.add_argument("--name", dest='name',
@@ -50,6 +59,8 @@ def get_parser_worker():
         help="number of tasks a worker process before being replaced")
     parser.add_argument("-t", "--timeout", dest='timeout', default=60,
         type=int, help="maximum timeout when waiting notification")
+    parser.add_argument("--warm", dest='warm', action='store_true',
+        help="fill the access caches before forking")
     return parser
 
 
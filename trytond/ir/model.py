@@ -18,7 +18,7 @@ from ..wizard import Wizard, StateView, StateAction, Button
 from ..transaction import Transaction
 from ..cache import Cache
 from ..pool import Pool
-from ..pyson import Bool, Eval, PYSONDecoder
+from ..pyson import Bool, Eval, PYSONDecoder, compile_pyson
 from ..rpc import RPC
 from ..protocols.jsonrpc import JSONDecoder, JSONEncoder
 from ..tools import is_instance_method, cursor_dict, grouped_slice
@@ -503,24 +503,22 @@ class ModelAccess(ModelSQL, ModelView):
         # root user above constraint
         if Transaction().user == 0:
             return defaultdict(lambda: defaultdict(lambda: True))
+        User = Pool().get('res.user')
+        return cls._get_access(models, User.get_groups_fingerprint())
 
+    @classmethod
+    def _get_access(cls, models, groups):
+        "Return access for models of the users with the groups fingerprint"
         pool = Pool()
         Model = pool.get('ir.model')
-        UserGroup = pool.get('res.user-res.group')
         cursor = Transaction().connection.cursor()
-        user = Transaction().user
         model_access = cls.__table__()
         ir_model = Model.__table__()
-        user_group = UserGroup.__table__()
 
-        access = {}
-        for model in models:
-            maccess = cls._get_access_cache.get((user, model), default=-1)
-            if maccess == -1:
-                break
-            access[model] = maccess
-        else:
-            return access
+        access = cls._get_access_cache.get_many(
+            [(groups, m) for m in models], default=-1)
+        if all(a != -1 for a in access.values()):
+            return {m: access[(groups, m)] for m in models}
 
         default = {
             'read': True,
@@ -530,10 +528,11 @@ class ModelAccess(ModelSQL, ModelView):
             'export': True,
         }
         access = dict((m, default) for m in models)
+        where = model_access.group == Null
+        if groups:
+            where |= model_access.group.in_(list(groups))
         cursor.execute(*model_access.join(ir_model, 'LEFT',
                 condition=model_access.model == ir_model.id
-                ).join(user_group, 'LEFT',
-                condition=user_group.group == model_access.group
                 ).select(
                 ir_model.model,
                 Max(Case((model_access.perm_read == True, 1), else_=0)),
@@ -541,16 +540,24 @@ class ModelAccess(ModelSQL, ModelView):
                 Max(Case((model_access.perm_create == True, 1), else_=0)),
                 Max(Case((model_access.perm_delete == True, 1), else_=0)),
                 Max(Case((model_access.perm_export == True, 1), else_=0)),
-                where=ir_model.model.in_(models)
-                & ((user_group.user == user) | (model_access.group == Null)),
+                where=ir_model.model.in_(models) & where,
                 group_by=ir_model.model))
         access.update(dict(
             (m, {'read': r, 'write': w, 'create': c, 'delete': d, 'export': e})
                 for m, r, w, c, d, e in cursor.fetchall()))
-        for model, maccess in access.items():
-            cls._get_access_cache.set((user, model), maccess)
+        cls._get_access_cache.set_many(
+            {(groups, m): a for m, a in access.items()})
         return access
 
+    @classmethod
+    def warm_cache(cls, fingerprints):
+        "Fill the cache of all the models for the groups fingerprints"
+        Model = Pool().get('ir.model')
+        models = [m.model for m in Model.search([])]
+        for groups in fingerprints:
+            for sub_models in grouped_slice(models):
+                cls._get_access(list(sub_models), groups)
+
     @classmethod
     def check(cls, model_name, mode='read', raise_exception=True):
         'Check access for model_name and mode'
@@ -684,35 +691,33 @@ class ModelFieldAccess(ModelSQL, ModelView):
         if Transaction().user == 0:
             return defaultdict(lambda: defaultdict(
                     lambda: defaultdict(lambda: True)))
+        User = Pool().get('res.user')
+        return cls._get_access(models, User.get_groups_fingerprint())
 
+    @classmethod
+    def _get_access(cls, models, groups):
+        "Return fields access for models of the users with the groups"
         pool = Pool()
         Model = pool.get('ir.model')
         ModelField = pool.get('ir.model.field')
-        UserGroup = pool.get('res.user-res.group')
-        user = Transaction().user
         field_access = cls.__table__()
         ir_model = Model.__table__()
         model_field = ModelField.__table__()
-        user_group = UserGroup.__table__()
 
-        accesses = {}
-        for model in models:
-            maccesses = cls._get_access_cache.get((user, model))
-            if maccesses is None:
-                break
-            accesses[model] = maccesses
-        else:
-            return accesses
+        accesses = cls._get_access_cache.get_many(
+            [(groups, m) for m in models])
+        if all(a is not None for a in accesses.values()):
+            return {m: accesses[(groups, m)] for m in models}
 
-        default = {}
-        accesses = dict((m, default) for m in models)
+        accesses = {m: {} for m in models}
+        where = field_access.group == Null
+        if groups:
+            where |= field_access.group.in_(list(groups))
         cursor = Transaction().connection.cursor()
         cursor.execute(*field_access.join(model_field,
                 condition=field_access.field == model_field.id
                 ).join(ir_model,
                 condition=model_field.model == ir_model.id
-                ).join(user_group, 'LEFT',
-                condition=user_group.group == field_access.group
                 ).select(
                 ir_model.model,
                 model_field.name,
@@ -720,15 +725,23 @@ class ModelFieldAccess(ModelSQL, ModelView):
                 Max(Case((field_access.perm_write == True, 1), else_=0)),
                 Max(Case((field_access.perm_create == True, 1), else_=0)),
                 Max(Case((field_access.perm_delete == True, 1), else_=0)),
-                where=ir_model.model.in_(models)
-                & ((user_group.user == user) | (field_access.group == Null)),
+                where=ir_model.model.in_(models) & where,
                 group_by=[ir_model.model, model_field.name]))
         for m, f, r, w, c, d in cursor.fetchall():
             accesses[m][f] = {'read': r, 'write': w, 'create': c, 'delete': d}
-        for model, maccesses in accesses.items():
-            cls._get_access_cache.set((user, model), maccesses)
+        cls._get_access_cache.set_many(
+            {(groups, m): a for m, a in accesses.items()})
         return accesses
 
+    @classmethod
+    def warm_cache(cls, fingerprints):
+        "Fill the cache of all the models for the groups fingerprints"
+        Model = Pool().get('ir.model')
+        models = [m.model for m in Model.search([])]
+        for groups in fingerprints:
+            for sub_models in grouped_slice(models):
+                cls._get_access(list(sub_models), groups)
+
     @classmethod
     def check(cls, model_name, fields, mode='read', raise_exception=True,
             access=False):
@@ -993,7 +1006,7 @@ class ModelButtonRule(ModelSQL, ModelView):
         if self.condition:
             env = {}
             env['self'] = EvalEnvironment(record, record.__class__)
-            if not PYSONDecoder(env).decode(self.condition):
+            if not compile_pyson(self.condition)(env):
                 return True
         if self.group:
             users = {c.user for c in clicks if self.group in c.user.groups}
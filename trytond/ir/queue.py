@@ -2,17 +2,43 @@
 # this repository contains the full copyright notices and license terms.
 import datetime
 import copy
+import hashlib
+import json
 
-from sql import With, Literal, Null
+from sql import For, Literal, Null
 from sql.aggregate import Min
 from sql.functions import CurrentTimestamp, Extract
 
+from trytond.config import config
 from trytond.model import ModelSQL, fields
 from trytond.pool import Pool
-from trytond.tools import grouped_slice
+from trytond.protocols.jsonrpc import JSONEncoder
+from trytond.tools import grouped_slice, reduce_ids
 from trytond.transaction import Transaction
 
 
+_coalesce_size = config.getint('queue', 'coalesce_size', default=1000)
+
+
+class _ForSkipLocked(For):
+    __slots__ = ()
+
+    def __str__(self):
+        return super().__str__() + ' SKIP LOCKED'
+
+
+def _priority_key(task):
+    _, _, priority = task
+    return (priority is None, -(priority or 0))
+
+
+def _earliest(*dates):
+    "Return the earliest date where None means now"
+    if None in dates:
+        return None
+    return min(dates)
+
+
 class Queue(ModelSQL):
     "Queue"
     __name__ = 'ir.queue'
@@ -30,6 +56,9 @@ class Queue(ModelSQL):
     expected_at = fields.Timestamp("Expected at",
         help="When the task should be done.")
 
+    coalesce_key = fields.Char("Coalesce Key", readonly=True,
+        help="The key of the pending tasks to merge with.")
+
     @classmethod
     def default_enqueued_at(cls):
         return datetime.datetime.utcnow()
@@ -40,13 +69,23 @@ class Queue(ModelSQL):
         super().__register__(module_name)
         table_h = cls.__table_handler__(module_name)
 
-        # Add index for candidates
+        # Migration from 5.0: priority added to the index of candidates
         table_h.index_action([
                 queue.scheduled_at.nulls_first,
                 queue.expected_at.nulls_first,
                 queue.dequeued_at,
                 queue.name,
-                ], action='add')
+                ], action='remove')
+
+        # Add index for candidates
+        table_h.index_action(
+            cls._candidates_order(queue) + [queue.name],
+            where=queue.dequeued_at == Null, action='add')
+
+        # Add index for pending tasks to coalesce
+        table_h.index_action(
+            [queue.coalesce_key, queue.name],
+            where=queue.dequeued_at == Null, action='add')
 
     @classmethod
     def copy(cls, records, default=None):
@@ -57,91 +96,148 @@ class Queue(ModelSQL):
         default.setdefault('enqueued_at')
         default.setdefault('dequeued_at')
         default.setdefault('finished_at')
+        default.setdefault('coalesce_key')
         return super(Queue, cls).copy(records, default=default)
 
     @classmethod
     def push(
-        cls, name, data, scheduled_at=None, expected_at=None, priority=None
+        cls, name, data, scheduled_at=None, expected_at=None, priority=None,
+        coalesce=False
     ):
         transaction = Transaction()
         database = transaction.database
         cursor = transaction.connection.cursor()
+        coalesce_key = None
+        if coalesce and isinstance(data.get('instances'), list):
+            coalesce_key = cls._coalesce_key(data)
         with transaction.set_user(0):
+            if coalesce_key:
+                record = cls._coalesce(
+                    name, data, coalesce_key, priority=priority,
+                    scheduled_at=scheduled_at, expected_at=expected_at)
+                if record:
+                    return record.id
             record, = cls.create([{
                         'name': name,
                         'priority': priority,
                         'data': data,
                         'scheduled_at': scheduled_at,
                         'expected_at': expected_at,
+                        'coalesce_key': coalesce_key,
                         }])
         if database.has_channel():
             cursor.execute('NOTIFY "%s"', (cls.__name__,))
         return record.id
 
+    @classmethod
+    def _coalesce_key(cls, data):
+        key = json.dumps([
+                data[k] for k in sorted(data) if k != 'instances'],
+            cls=JSONEncoder, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _coalesce(
+            cls, name, data, coalesce_key, priority=None, scheduled_at=None,
+            expected_at=None):
+        "Merge the instances of data into a pending task and return it"
+        instances = data['instances']
+        if len(instances) >= _coalesce_size:
+            return
+        tasks = cls.search([
+                ('coalesce_key', '=', coalesce_key),
+                ('name', '=', name),
+                ('priority', '=', priority),
+                ('dequeued_at', '=', None),
+                ], order=[('id', 'DESC')], limit=1)
+        if not tasks:
+            return
+        task, = tasks
+        pending = task.data['instances']
+        known = set(pending)
+        merged = pending + [
+            i for i in dict.fromkeys(instances) if i not in known]
+        if len(merged) > _coalesce_size:
+            return
+        # A concurrent dequeue of the task raises a serialization error
+        cls.write([task], {
+                'data': dict(task.data, instances=merged),
+                'scheduled_at': _earliest(task.scheduled_at, scheduled_at),
+                'expected_at': _earliest(task.expected_at, expected_at),
+                })
+        return task
+
+    @classmethod
+    def _candidates_order(cls, queue):
+        return [
+            queue.priority.desc.nulls_last,
+            queue.scheduled_at.nulls_first,
+            queue.expected_at.nulls_first,
+            ]
+
     @classmethod
     def pull(cls, database, connection, name=None):
+        tasks, seconds = cls.pull_many(database, connection, name=name)
+        if tasks:
+            (task_id, queue_name, priority), = tasks
+        else:
+            task_id, queue_name, priority = None, None, None
+        return task_id, seconds, queue_name, priority
+
+    @classmethod
+    def pull_many(cls, database, connection, name=None, limit=1):
+        """Dequeue up to limit tasks by priority and return the list of
+        (id, name, priority) and the number of seconds until the next
+        scheduled task"""
         cursor = connection.cursor()
         queue = cls.__table__()
+        candidate = cls.__table__()
+
+        where = ((candidate.name == name) if name else Literal(True))
+        where &= candidate.dequeued_at == Null
+        selected = candidate.select(
+            candidate.id,
+            where=where
+            & ((candidate.scheduled_at <= CurrentTimestamp())
+                | (candidate.scheduled_at == Null)),
+            order_by=cls._candidates_order(candidate),
+            limit=limit)
+        if database.has_skip_locked():
+            selected.for_ = _ForSkipLocked('UPDATE')
+        else:
+            selected.where &= database.lock_id(candidate.id)
+        next_timeout = candidate.select(
+            Min(Extract('EPOCH',
+                    candidate.scheduled_at - CurrentTimestamp())),
+            where=where & (candidate.scheduled_at >= CurrentTimestamp()))
 
-        candidates = With('id', 'scheduled_at', 'expected_at',
-            query=queue.select(
-                queue.id,
-                queue.scheduled_at,
-                queue.expected_at,
-                where=((queue.name == name) if name else Literal(True))
-                & (queue.dequeued_at == Null),
-                order_by=[
-                    queue.scheduled_at.nulls_first,
-                    queue.expected_at.nulls_first],
-                limit=1000))
-        selected = With('id', query=candidates.select(
-                candidates.id,
-                where=((candidates.scheduled_at <= CurrentTimestamp())
-                    | (candidates.scheduled_at == Null))
-                & database.lock_id(candidates.id),
-                order_by=[
-                    candidates.scheduled_at.nulls_first,
-                    candidates.expected_at.nulls_first],
-                limit=1))
-        next_timeout = With('seconds', query=candidates.select(
-                Min(Extract('second',
-                        candidates.scheduled_at - CurrentTimestamp())
-                    ),
-                where=candidates.scheduled_at >= CurrentTimestamp()))
-
-        task_id, seconds, queue_name, priority = None, None, None, None
+        tasks = []
         if database.has_returning():
             query = queue.update([queue.dequeued_at], [CurrentTimestamp()],
-                where=queue.id == selected.select(selected.id),
-                with_=[candidates, selected, next_timeout],
-                returning=[
-                    queue.id, next_timeout.select(next_timeout.seconds),
-                    queue.name, queue.priority
-                ])
+                where=queue.id.in_(selected),
+                returning=[queue.id, queue.name, queue.priority])
             cursor.execute(*query)
-            row = cursor.fetchone()
-            if row:
-                task_id, seconds, queue_name, priority = row
+            tasks = cursor.fetchall()
         else:
-            query = queue.select(queue.id, queue.name, priority,
-                where=queue.id == selected.select(selected.id),
-                with_=[candidates, selected])
-            cursor.execute(*query)
-            row = cursor.fetchone()
-            if row:
-                task_id, queue_name, priority = row
+            cursor.execute(*selected)
+            task_ids = [i for i, in cursor.fetchall()]
+            if task_ids:
                 query = queue.update([queue.dequeued_at], [CurrentTimestamp()],
-                    where=queue.id == task_id)
+                    where=reduce_ids(queue.id, task_ids))
                 cursor.execute(*query)
-            query = next_timeout.select(next_timeout.seconds)
-            cursor.execute(*query)
-            row = cursor.fetchone()
-            if row:
-                seconds, = row
+                query = queue.select(queue.id, queue.name, queue.priority,
+                    where=reduce_ids(queue.id, task_ids))
+                cursor.execute(*query)
+                tasks = cursor.fetchall()
+        tasks = sorted(tasks, key=_priority_key)
 
-        if not task_id and database.has_channel():
-            cursor.execute('LISTEN "%s"', (cls.__name__,))
-        return task_id, seconds, queue_name, priority
+        seconds = None
+        if not tasks:
+            cursor.execute(*next_timeout)
+            seconds, = cursor.fetchone()
+            if database.has_channel():
+                cursor.execute('LISTEN "%s"', (cls.__name__,))
+        return [tuple(t) for t in tasks], seconds
 
     def run(self):
         transaction = Transaction()
@@ -173,6 +269,29 @@ class Queue(ModelSQL):
             )
         self.finished()
 
+    def split(self):
+        """Push a task per instance of the coalesced task and mark it as
+        finished. Return the ids of the pushed tasks."""
+        transaction = Transaction()
+        database = transaction.database
+        instances = self.data['instances']
+        if (not self.coalesce_key
+                or not isinstance(instances, list)
+                or len(instances) < 2):
+            return []
+        with transaction.set_user(0):
+            tasks = self.create([{
+                        'name': self.name,
+                        'priority': self.priority,
+                        'data': dict(self.data, instances=[instance]),
+                        'expected_at': self.expected_at,
+                        } for instance in instances])
+        self.finished()
+        if database.has_channel():
+            cursor = transaction.connection.cursor()
+            cursor.execute('NOTIFY "%s"', (self.__name__,))
+        return [t.id for t in tasks]
+
     def finished(self):
         if not self.dequeued_at:
             self.dequeued_at = datetime.datetime.now()
@@ -218,7 +337,7 @@ class _Method(object):
 
     def __call__(self, instances=None, *args, **kwargs):
         transaction = Transaction()
-        context = transaction.context
+        context = transaction.context.copy()
         name = context.pop('queue_name', 'default')
         priority = context.pop('priority', None)
         now = datetime.datetime.now()
@@ -226,6 +345,7 @@ class _Method(object):
         if scheduled_at is not None:
             scheduled_at = now + scheduled_at
         expected_at = context.pop('queue_expected_at', None)
+        coalesce = context.pop('queue_coalesce', False)
         context.pop('_check_access', None)
         if expected_at is not None:
             expected_at = now + expected_at
@@ -246,4 +366,5 @@ class _Method(object):
             }
         return self.__queue.push(
             name, data, priority=priority,
-            scheduled_at=scheduled_at, expected_at=expected_at)
+            scheduled_at=scheduled_at, expected_at=expected_at,
+            coalesce=coalesce)
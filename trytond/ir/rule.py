@@ -1,10 +1,12 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import json
+
 from ..model import ModelView, ModelSQL, fields, EvalEnvironment, Check
 from ..transaction import Transaction
-from ..cache import Cache
+from ..cache import Cache, freeze
 from ..pool import Pool
-from ..pyson import PYSONDecoder
+from ..pyson import PYSONDecoder, compile_pyson
 
 __all__ = [
     'RuleGroup', 'Rule',
@@ -72,20 +74,26 @@ class RuleGroup(ModelSQL, ModelView):
     def delete(cls, groups):
         super(RuleGroup, cls).delete(groups)
         # Restart the cache on the domain_get method of ir.rule
-        Pool().get('ir.rule')._domain_get_cache.clear()
+        Rule = Pool().get('ir.rule')
+        Rule._domain_get_cache.clear()
+        Rule._get_rules_cache.clear()
 
     @classmethod
     def create(cls, vlist):
         res = super(RuleGroup, cls).create(vlist)
         # Restart the cache on the domain_get method of ir.rule
-        Pool().get('ir.rule')._domain_get_cache.clear()
+        Rule = Pool().get('ir.rule')
+        Rule._domain_get_cache.clear()
+        Rule._get_rules_cache.clear()
         return res
 
     @classmethod
     def write(cls, groups, vals, *args):
         super(RuleGroup, cls).write(groups, vals, *args)
         # Restart the cache on the domain_get method of ir.rule
-        Pool().get('ir.rule')._domain_get_cache.clear()
+        Rule = Pool().get('ir.rule')
+        Rule._domain_get_cache.clear()
+        Rule._get_rules_cache.clear()
 
 
 class Rule(ModelSQL, ModelView):
@@ -97,6 +105,8 @@ class Rule(ModelSQL, ModelView):
         help='Domain is evaluated with a PYSON context containing:\n'
         '- "user" as the current user')
     _domain_get_cache = Cache('ir_rule.domain_get', context=False)
+    _get_rules_cache = Cache(
+        'ir_rule.get_rules', size_limit=10240, context=False)
 
     @classmethod
     def __setup__(cls):
@@ -139,91 +149,185 @@ class Rule(ModelSQL, ModelView):
     @staticmethod
     def _get_cache_key():
         # _datetime value will be added to the domain
-        return (Transaction().user, Transaction().context.get('_datetime'))
+        return (Transaction().context.get('_datetime'),)
 
-    @classmethod
-    def domain_get(cls, model_name, mode='read'):
-        assert mode in ['read', 'write', 'create', 'delete'], \
-            'Invalid domain mode for security'
-
-        # root user above constraint
-        if Transaction().user == 0:
-            if not Transaction().context.get('user'):
-                return
-            with Transaction().set_user(Transaction().context['user']):
-                return cls.domain_get(model_name, mode=mode)
+    @staticmethod
+    def _get_inputs(domain):
+        """
+        Return the names of the user fields used by the PYSON domain
+        or None if it depends on other values of the context.
+        """
+        names = set()
+
+        def walk(value):
+            if isinstance(value, list):
+                return all(walk(v) for v in value)
+            elif not isinstance(value, dict):
+                return True
+            class_ = value.get('__class__')
+            if class_ == 'Eval':
+                return False
+            elif class_ == 'Get':
+                obj, key = value.get('v'), value.get('k')
+                if (isinstance(obj, dict)
+                        and obj.get('__class__') == 'Eval'
+                        and obj.get('v') == 'user'
+                        and isinstance(key, str)
+                        and not key.startswith('_parent_')):
+                    names.add(key)
+                    return walk(obj.get('d')) and walk(value.get('d'))
+            return all(walk(v) for v in value.values())
+        if walk(json.loads(domain)):
+            return names
 
-        key = (model_name, mode) + cls._get_cache_key()
-        domain = cls._domain_get_cache.get(key, False)
-        if domain is not False:
-            return domain
+    @classmethod
+    def _get_rules(cls, model_name, mode, groups):
+        """
+        Return the rules of the model for the mode and the groups
+        fingerprint as a dictionary with:
+            - rules: the list of (rule group id, global, domain)
+            - empty: the id of a rule group of the groups without rule
+            - inputs: the user fields used by the domains or None
+        """
+        key = (model_name, mode, groups)
+        rules = cls._get_rules_cache.get(key)
+        if rules is not None:
+            return rules
 
         pool = Pool()
         RuleGroup = pool.get('ir.rule.group')
         Model = pool.get('ir.model')
         RuleGroup_Group = pool.get('ir.rule.group-res.group')
-        User_Group = pool.get('res.user-res.group')
 
         cursor = Transaction().connection.cursor()
         rule_table = cls.__table__()
         rule_group = RuleGroup.__table__()
         rule_group_group = RuleGroup_Group.__table__()
-        user_group = User_Group.__table__()
         model = Model.__table__()
-        user_id = Transaction().user
+
+        where = (rule_group.default_p == True) | (rule_group.global_p == True)
+        in_groups = None
+        if groups:
+            in_groups = rule_group.id.in_(rule_group_group.select(
+                    rule_group_group.rule_group,
+                    where=rule_group_group.group.in_(list(groups))))
+            where |= in_groups
         cursor.execute(*rule_table.join(rule_group,
                 condition=rule_group.id == rule_table.rule_group
                 ).join(model,
                 condition=rule_group.model == model.id
-                ).select(rule_table.id,
+                ).select(
+                rule_group.id, rule_group.global_p, rule_table.domain,
                 where=(model.model == model_name)
                 & (getattr(rule_group, 'perm_%s' % mode) == True)
-                & (rule_group.id.in_(
-                        rule_group_group.join(
-                            user_group,
-                            condition=(rule_group_group.group
-                                == user_group.group)
-                            ).select(rule_group_group.rule_group,
-                            where=user_group.user == user_id)
-                        )
-                    | (rule_group.default_p == True)
-                    | (rule_group.global_p == True)
-                    )))
-        ids = [x[0] for x in cursor.fetchall()]
-        if not ids:
-            cls._domain_get_cache.set(key, None)
+                & where))
+        rules = {
+            'rules': cursor.fetchall(),
+            'empty': None,
+            'inputs': set(),
+            }
+
+        if rules['rules'] and in_groups:
+            # Test if there is no rule_group that have no rule
+            cursor.execute(*rule_group.join(model,
+                    condition=rule_group.model == model.id
+                    ).select(rule_group.id,
+                    where=(model.model == model_name)
+                    & ~rule_group.id.in_(
+                        rule_table.select(rule_table.rule_group))
+                    & in_groups))
+            fetchone = cursor.fetchone()
+            if fetchone:
+                rules['empty'], = fetchone
+
+        for _, _, domain in rules['rules']:
+            assert domain, ('Rule domain empty,'
+                'check if migration was done')
+            inputs = cls._get_inputs(domain)
+            if inputs is None:
+                rules['inputs'] = None
+                break
+            rules['inputs'] |= inputs
+        if rules['inputs'] is not None:
+            rules['inputs'] = sorted(rules['inputs'])
+        cls._get_rules_cache.set(key, rules)
+        return rules
+
+    @classmethod
+    def _get_user_inputs(cls, names):
+        "Return the values of the user fields names"
+        if not names:
+            return ()
+        transaction = Transaction()
+        # The user fields may depend on the context like the company
+        key = ('inputs', transaction.user, tuple(names),
+            transaction.frozen_context())
+        inputs = cls._domain_get_cache.get(key)
+        if inputs is not None:
+            return inputs
+        user = cls._get_context()['user']
+        # Use root user without context to prevent recursion
+        with transaction.set_user(0), transaction.set_context(user=0):
+            inputs = freeze([user.get(n) for n in names])
+        cls._domain_get_cache.set(key, inputs)
+        return inputs
+
+    @classmethod
+    def warm_cache(cls, fingerprints):
+        "Fill the cache of the rules for the groups fingerprints"
+        pool = Pool()
+        RuleGroup = pool.get('ir.rule.group')
+        models = {g.model.model for g in RuleGroup.search([])}
+        for groups in fingerprints:
+            for model_name in models:
+                for mode in ['read', 'write', 'create', 'delete']:
+                    cls._get_rules(model_name, mode, groups)
+
+    @classmethod
+    def domain_get(cls, model_name, mode='read'):
+        assert mode in ['read', 'write', 'create', 'delete'], \
+            'Invalid domain mode for security'
+
+        # root user above constraint
+        if Transaction().user == 0:
+            if not Transaction().context.get('user'):
+                return
+            with Transaction().set_user(Transaction().context['user']):
+                return cls.domain_get(model_name, mode=mode)
+
+        pool = Pool()
+        User = pool.get('res.user')
+        groups = User.get_groups_fingerprint()
+        rules = cls._get_rules(model_name, mode, groups)
+        if not rules['rules']:
             return
+
+        if rules['inputs'] is None:
+            inputs = (Transaction().user,)
+        else:
+            inputs = cls._get_user_inputs(rules['inputs'])
+        key = (model_name, mode, groups, inputs) + cls._get_cache_key()
+        domain = cls._domain_get_cache.get(key, False)
+        if domain is not False:
+            return domain
+
+        ctx = cls._get_context()
         clause = {}
         clause_global = {}
-        ctx = cls._get_context()
         # Use root user without context to prevent recursion
         with Transaction().set_user(0), \
                 Transaction().set_context(user=0):
-            for rule in cls.browse(ids):
-                assert rule.domain, ('Rule domain empty,'
-                    'check if migration was done')
-                dom = PYSONDecoder(ctx).decode(rule.domain)
-                if rule.rule_group.global_p:
-                    clause_global.setdefault(rule.rule_group.id, ['OR'])
-                    clause_global[rule.rule_group.id].append(dom)
+            for rule_group_id, global_p, domain in rules['rules']:
+                dom = compile_pyson(domain)(ctx)
+                if global_p:
+                    clause_global.setdefault(rule_group_id, ['OR'])
+                    clause_global[rule_group_id].append(dom)
                 else:
-                    clause.setdefault(rule.rule_group.id, ['OR'])
-                    clause[rule.rule_group.id].append(dom)
+                    clause.setdefault(rule_group_id, ['OR'])
+                    clause[rule_group_id].append(dom)
 
-        # Test if there is no rule_group that have no rule
-        cursor.execute(*rule_group.join(model,
-                condition=rule_group.model == model.id
-                ).select(rule_group.id,
-                where=(model.model == model_name)
-                & ~rule_group.id.in_(rule_table.select(rule_table.rule_group))
-                & rule_group.id.in_(rule_group_group.join(user_group,
-                        condition=rule_group_group.group == user_group.group
-                        ).select(rule_group_group.rule_group,
-                        where=user_group.user == user_id))))
-        fetchone = cursor.fetchone()
-        if fetchone:
-            group_id = fetchone[0]
-            clause[group_id] = []
+        if rules['empty'] is not None:
+            clause[rules['empty']] = []
         clause = list(clause.values())
         if clause:
             clause.insert(0, 'OR')
@@ -258,12 +362,14 @@ class Rule(ModelSQL, ModelView):
         super(Rule, cls).delete(rules)
         # Restart the cache on the domain_get method of ir.rule
         cls._domain_get_cache.clear()
+        cls._get_rules_cache.clear()
 
     @classmethod
     def create(cls, vlist):
         res = super(Rule, cls).create(vlist)
         # Restart the cache on the domain_get method of ir.rule
         cls._domain_get_cache.clear()
+        cls._get_rules_cache.clear()
         return res
 
     @classmethod
@@ -271,3 +377,4 @@ class Rule(ModelSQL, ModelView):
         super(Rule, cls).write(rules, vals, *args)
         # Restart the cache on the domain_get method
         cls._domain_get_cache.clear()
+        cls._get_rules_cache.clear()
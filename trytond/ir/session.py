@@ -4,6 +4,7 @@ import binascii
 import datetime
 import json
 import os
+from threading import Lock
 try:
     from secrets import token_hex
 except ImportError:
@@ -13,12 +14,14 @@ except ImportError:
         return binascii.hexlify(os.urandom(nbytes)).decode('ascii')
 
 from trytond.model import ModelSQL, fields
+from trytond.cache import Cache
 from trytond.config import config
 from trytond.transaction import Transaction
 
 __all__ = [
     'Session', 'SessionWizard',
     ]
+_check_interval = config.getint('session', 'reset_interval', default=60)
 
 
 class Session(ModelSQL):
@@ -27,6 +30,9 @@ class Session(ModelSQL):
     _rec_name = 'key'
 
     key = fields.Char('Key', required=True, select=True)
+    _check_cache = Cache('ir_session.check', size_limit=10240, context=False)
+    _check_deleting = set()
+    _check_lock = Lock()
 
     @classmethod
     def __setup__(cls):
@@ -75,6 +81,10 @@ class Session(ModelSQL):
         if the key does not exist.
         """
         now = datetime.datetime.now()
+        if not domain:
+            expire = cls._check_cache.get((user, key))
+            if expire is not None and now < expire:
+                return True
         timeout = datetime.timedelta(
             seconds=config.getint('session', 'max_age'))
         sessions = cls.search([
@@ -87,11 +97,19 @@ class Session(ModelSQL):
             if abs(session.create_date - now) < timeout:
                 if session.key == key:
                     find = True
+                    # The other processes see the deletion only when the
+                    # entry expires
+                    expire = min(session.create_date + timeout,
+                        now + datetime.timedelta(seconds=_check_interval))
             else:
                 if find is None and session.key == key:
                     find = False
                 to_delete.append(session)
         cls.delete(to_delete)
+        if find and not domain:
+            with cls._check_lock:
+                if key not in cls._check_deleting:
+                    cls._check_cache.set((user, key), expire)
         return find
 
     @classmethod
@@ -116,13 +134,15 @@ class Session(ModelSQL):
 
     @classmethod
     def reset(cls, key, domain=None):
-        "Reset key session timestamp"
+        "Reset key session timestamp, key can also be a list of keys"
         now = datetime.datetime.now()
         timeout = datetime.timedelta(
             seconds=config.getint('session', 'timeout'))
         timestamp = now - timeout
+        if isinstance(key, str):
+            key = [key]
         sessions = cls.search([
-                ('key', '=', key),
+                ('key', 'in', key),
                 ['OR',
                     ('create_date', '>=', timestamp),
                     ('write_date', '>=', timestamp),
@@ -150,6 +170,22 @@ class Session(ModelSQL):
         cls.delete(cls.search([('create_uid', '=', Transaction().user)]))
         return super(Session, cls).create(vlist)
 
+    @classmethod
+    def delete(cls, sessions):
+        if sessions:
+            keys = {s.key for s in sessions}
+            # Do not cache the keys until the deletion is committed
+            with cls._check_lock:
+                cls._check_deleting.update(keys)
+                cls._check_cache.clear()
+            Transaction().atexit(cls._check_deleted, keys)
+        super(Session, cls).delete(sessions)
+
+    @classmethod
+    def _check_deleted(cls, keys):
+        with cls._check_lock:
+            cls._check_deleting.difference_update(keys)
+
 
 class SessionWizard(ModelSQL):
     "Session Wizard"
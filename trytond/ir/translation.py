@@ -21,7 +21,7 @@ from relatorio.templates.opendocument import get_zip_file
 from ..model import ModelView, ModelSQL, fields, Unique
 from ..wizard import Wizard, StateView, StateTransition, StateAction, \
     Button
-from ..tools import file_open, reduce_ids, grouped_slice, cursor_dict
+from ..tools import file_open, grouped_slice, cursor_dict
 from ..pyson import PYSONEncoder, Eval
 from ..transaction import Transaction
 from ..pool import Pool
@@ -48,6 +48,7 @@ TRANSLATION_TYPE = [
     ('help', 'Help'),
     ('error', 'Error'),
 ]
+_ids_range = config.getint('cache', 'translation_range', default=500)
 
 
 class TrytonPOFile(polib.POFile):
@@ -76,6 +77,7 @@ class Translation(ModelSQL, ModelView):
     overriding_module = fields.Char('Overriding Module', readonly=True)
     _translation_cache = Cache('ir.translation', size_limit=10240,
         context=False)
+    _translation_ids_cache = Cache('ir.translation.ids', context=False)
     _get_language_cache = Cache('ir.translation.get_language')
 
     @classmethod
@@ -364,7 +366,7 @@ class Translation(ModelSQL, ModelView):
         ModelFields = pool.get('ir.model.field')
         Model = pool.get('ir.model')
 
-        translations, to_fetch = {}, []
+        translations = {}
         name = str(name)
         ttype = str(ttype)
         lang = str(lang)
@@ -398,54 +400,69 @@ class Translation(ModelSQL, ModelView):
                 translations[record.id] = cls.get_source(name, ttype, lang)
             return translations
 
+        ranges = cls._get_id_ranges(
+            name, ttype, lang, {i // _ids_range for i in ids})
+        for obj_id in ids:
+            translations[obj_id] = ranges[obj_id // _ids_range].get(obj_id)
+        return translations
+
+    @classmethod
+    def _get_id_ranges(cls, name, ttype, lang, ranges):
+        """Return for each id range the dictionary of the translations
+
+        The dictionaries are shared by the cache so they must not be modified.
+        """
+        transaction = Transaction()
         # Don't use cache for fuzzy translation
-        if not Transaction().context.get(
-                'fuzzy_translation', False):
-            for obj_id in ids:
-                trans = cls._translation_cache.get((name, ttype, lang, obj_id),
-                    -1)
-                if trans != -1:
-                    translations[obj_id] = trans
-                else:
-                    to_fetch.append(obj_id)
+        fuzzy = transaction.context.get('fuzzy_translation', False)
+        result, to_fetch = {}, []
+        if not fuzzy:
+            cached = cls._translation_ids_cache.get_many(
+                [(name, ttype, lang, r) for r in ranges])
         else:
-            to_fetch = ids
-
-        if to_fetch:
-            # Get parent translations
-            parent_lang = get_parent(lang)
-            if parent_lang:
-                translations.update(
-                    cls.get_ids(name, ttype, parent_lang, to_fetch))
-
-            transaction = Transaction()
-            cursor = transaction.connection.cursor()
-            table = cls.__table__()
-            fuzzy_sql = table.fuzzy == False
-            if Transaction().context.get('fuzzy_translation', False):
-                fuzzy_sql = None
-            in_max = transaction.database.IN_MAX // 7
-            for sub_to_fetch in grouped_slice(to_fetch, in_max):
-                red_sql = reduce_ids(table.res_id, sub_to_fetch)
-                where = And(((table.lang == lang),
-                        (table.type == ttype),
-                        (table.name == name),
-                        (table.value != ''),
-                        (table.value != Null),
-                        red_sql,
-                        ))
-                if fuzzy_sql:
-                    where &= fuzzy_sql
-                cursor.execute(*table.select(table.res_id, table.value,
-                        where=where))
-                translations.update(cursor)
-            # Don't store fuzzy translation in cache
-            if not Transaction().context.get('fuzzy_translation', False):
-                for res_id in to_fetch:
-                    value = translations.setdefault(res_id)
-                    cls._translation_cache.set(
-                        (name, ttype, lang, res_id), value)
-        return translations
+            cached = {}
+        for range_ in ranges:
+            values = cached.get((name, ttype, lang, range_))
+            if values is not None:
+                result[range_] = values
+            else:
+                to_fetch.append(range_)
+        if not to_fetch:
+            return result
+
+        # Get parent translations
+        parent_lang = get_parent(lang)
+        if parent_lang:
+            fetched = {r: dict(v) for r, v in cls._get_id_ranges(
+                    name, ttype, parent_lang, to_fetch).items()}
+        else:
+            fetched = {r: {} for r in to_fetch}
+
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        in_max = transaction.database.IN_MAX // 2
+        for sub_ranges in grouped_slice(sorted(to_fetch), in_max):
+            where = And(((table.lang == lang),
+                    (table.type == ttype),
+                    (table.name == name),
+                    (table.value != ''),
+                    (table.value != Null),
+                    Or([(table.res_id >= r * _ids_range)
+                            & (table.res_id < (r + 1) * _ids_range)
+                            for r in sub_ranges]),
+                    ))
+            if not fuzzy:
+                where &= table.fuzzy == False
+            cursor.execute(*table.select(table.res_id, table.value,
+                    where=where))
+            for res_id, value in cursor:
+                fetched[res_id // _ids_range][res_id] = value
+        # Don't store fuzzy translation in cache
+        if not fuzzy:
+            cls._translation_ids_cache.set_many(
+                {(name, ttype, lang, r): v for r, v in fetched.items()})
+        result.update(fetched)
+        return result
 
     @classmethod
     def set_ids(cls, name, ttype, lang, ids, values):
@@ -604,13 +621,14 @@ class Translation(ModelSQL, ModelView):
             return res
 
         to_cache = []
+        keys = []
         for name, ttype, lang, source in args:
-            name = str(name)
-            ttype = str(ttype)
-            lang = str(lang)
             if source is not None:
                 source = str(source)
-            trans = cls._translation_cache.get((name, ttype, lang, source), -1)
+            keys.append((str(name), str(ttype), str(lang), source))
+        cached = cls._translation_cache.get_many(keys, default=-1)
+        for name, ttype, lang, source in keys:
+            trans = cached[(name, ttype, lang, source)]
             if trans != -1:
                 res[(name, ttype, lang, source)] = trans
             else:
@@ -651,19 +669,20 @@ class Translation(ModelSQL, ModelView):
                     if (name, ttype, lang, source) not in args:
                         source = None
                     res[(name, ttype, lang, source)] = value
-        for key in to_cache:
-            cls._translation_cache.set(key, res[key])
+        cls._translation_cache.set_many({k: res[k] for k in to_cache})
         return res
 
     @classmethod
     def delete(cls, translations):
         cls._translation_cache.clear()
+        cls._translation_ids_cache.clear()
         ModelView._fields_view_get_cache.clear()
         return super(Translation, cls).delete(translations)
 
     @classmethod
     def create(cls, vlist):
         cls._translation_cache.clear()
+        cls._translation_ids_cache.clear()
         ModelView._fields_view_get_cache.clear()
         vlist = [x.copy() for x in vlist]
 
@@ -677,6 +696,7 @@ class Translation(ModelSQL, ModelView):
     @classmethod
     def write(cls, translations, values, *args):
         cls._translation_cache.clear()
+        cls._translation_ids_cache.clear()
         ModelView._fields_view_get_cache.clear()
         actions = iter((translations, values) + args)
         args = []
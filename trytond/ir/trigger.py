@@ -7,7 +7,7 @@ from sql.aggregate import Count, Max
 
 from ..model import (
     ModelView, ModelSQL, DeactivableMixin, fields, EvalEnvironment, Check)
-from ..pyson import Eval, PYSONDecoder
+from ..pyson import Eval, PYSONDecoder, compile_pyson
 from ..tools import grouped_slice
 from ..tools import reduce_ids
 from ..transaction import Transaction
@@ -170,7 +170,7 @@ class Trigger(DeactivableMixin, ModelSQL, ModelView):
         env['time'] = time
         env['context'] = Transaction().context
         env['self'] = EvalEnvironment(record, record.__class__)
-        return bool(PYSONDecoder(env).decode(trigger.condition))
+        return bool(compile_pyson(trigger.condition)(env))
 
     @classmethod
     def trigger_action(cls, records, trigger):
@@ -1,14 +1,15 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import datetime
+import uuid
 from itertools import islice, chain
 from collections import OrderedDict, defaultdict
 from functools import wraps
 
 from sql import (Table, Column, Literal, Desc, Asc, Expression, Null,
-    NullsFirst, NullsLast)
+    NullsFirst, NullsLast, Select, Values)
 from sql.functions import CurrentTimestamp, Extract
-from sql.conditionals import Coalesce
+from sql.conditionals import Coalesce, Case
 from sql.operators import Or, And, Operator, Equal
 from sql.aggregate import Count, Max
 
@@ -18,12 +19,14 @@ from trytond import backend
 from trytond.tools import reduce_ids, grouped_slice, cursor_dict
 from trytond.transaction import Transaction
 from trytond.pool import Pool
-from trytond.cache import LRUDict
+from trytond.cache import LRUDict, LRUDictTransaction
 from trytond.exceptions import ConcurrencyException, FieldNameError, UserValueError
 from trytond.rpc import RPC
 from trytond.config import config
 
-from .modelstorage import cache_size, is_leaf
+from .modelstorage import cache_size, is_leaf, BrowseIds
+
+_copy_threshold = config.getint('database', 'copy_threshold', default=1000)
 
 
 class Constraint(object):
@@ -156,6 +159,7 @@ class ModelSQL(ModelStorage):
     _order = None
     _order_name = None  # Use to force order field when sorting on Many2One
     _history = False
+    _sql_cascade = False  # Allow set-based cascades on delete
     table_query = None
 
     @classmethod
@@ -558,12 +562,11 @@ class ModelSQL(ModelStorage):
         table = cls.__table__()
         modified_fields = set()
         defaults_cache = {}  # Store already computed default values
-        new_ids = []
         vlist = [v.copy() for v in vlist]
         # A way to reduce round trips to the database
         batch_insert_values = defaultdict(list)
-        ordered_queries = []
-        for values in vlist:
+        batch_indexes = defaultdict(list)
+        for index, values in enumerate(vlist):
             # Clean values
             for key in ('create_uid', 'create_date',
                     'write_uid', 'write_date', 'id'):
@@ -600,33 +603,31 @@ class ModelSQL(ModelStorage):
                     insert_values.append(field.sql_format(value))
 
             batch_insert_values[tuple(insert_columns)].append(insert_values)
-            ordered_queries.append([insert_columns, insert_values])
+            batch_indexes[tuple(insert_columns)].append(index)
 
+        new_ids = [None] * len(vlist)
         try:
-            if len(batch_insert_values) == 1:
-                # Just a single type of query that is really efficient
-                # So execute a large insert
-                columns, = batch_insert_values.keys()
-                values, = batch_insert_values.values()
-                cursor.execute(
-                    *table.insert(
-                        [Column(table, fname) for fname in columns],
-                        values,
-                        [table.id]
-                    )
-                )
-                rvalues = cursor.fetchall()
-                new_ids.extend([each[0] for each in rvalues])
-            else:
-                for columns, values in ordered_queries:
-                    cursor.execute(
-                        *table.insert(
-                            [Column(table, fname) for fname in columns],
-                            [values],
-                            [table.id]
+            # Insert at once the rows with the same columns, so the missing
+            # columns get the default of the database
+            for columns, rows in batch_insert_values.items():
+                ids = None
+                if (len(rows) >= _copy_threshold
+                        and transaction.database.has_copy()):
+                    ids = transaction.database.copy_insert(
+                        transaction.connection, cls._table, columns, rows)
+                if ids is None:
+                    ids = []
+                    for sub_rows in grouped_slice(rows):
+                        cursor.execute(
+                            *table.insert(
+                                [Column(table, fname) for fname in columns],
+                                list(sub_rows),
+                                [table.id]
+                            )
                         )
-                    )
-                    new_ids.append(cursor.fetchone()[0])
+                        ids.extend(each[0] for each in cursor.fetchall())
+                for index, id_ in zip(batch_indexes[columns], ids):
+                    new_ids[index] = id_
         except DatabaseIntegrityError as exception:
             with Transaction().new_transaction(), \
                     Transaction().set_context(_check_access=False):
@@ -961,9 +962,7 @@ class ModelSQL(ModelStorage):
     @classmethod
     @no_table_query
     def write(cls, records, values, *args):
-        DatabaseIntegrityError = backend.get('DatabaseIntegrityError')
         transaction = Transaction()
-        cursor = transaction.connection.cursor()
         pool = Pool()
         Translation = pool.get('ir.translation')
         Config = pool.get('ir.configuration')
@@ -985,6 +984,11 @@ class ModelSQL(ModelStorage):
         cls.__check_timestamp(all_ids)
         cls.__check_domain_rule(all_ids, 'write', nodomain='write_error')
 
+        has_tree = any(isinstance(f, fields.Many2One)
+            and f.model_name == cls.__name__ and f.left and f.right
+            for f in cls._fields.values())
+        groups = OrderedDict()
+        updated = {}
         fields_to_set = {}
         actions = iter((records, values) + args)
         for records, values in zip(actions, actions):
@@ -1015,19 +1019,21 @@ class ModelSQL(ModelStorage):
                         columns.append(Column(table, fname))
                         update_values.append(field.sql_format(value))
 
-            for sub_ids in grouped_slice(ids):
-                red_sql = reduce_ids(table.id, sub_ids)
-                try:
-                    cursor.execute(*table.update(columns, update_values,
-                            where=red_sql))
-                except DatabaseIntegrityError as exception:
-                    transaction = Transaction()
-                    with Transaction().new_transaction(), \
-                            Transaction().set_context(_check_access=False):
-                        cls.__raise_integrity_error(
-                            exception, values, list(values.keys()),
-                            transaction=transaction)
-                    raise
+            # Pairs updating the same columns are grouped in a single query
+            # as long as a record is not updated by two groups
+            key = tuple(c.name for c in columns[2:])
+            if any(updated.get(i, key) != key for i in ids):
+                cls.__update_grouped(groups)
+                groups.clear()
+                updated.clear()
+            if not has_tree and key:
+                group = groups.setdefault(key, ([], OrderedDict()))
+                group[0].append(values)
+                for id_ in ids:
+                    group[1][id_] = update_values[2:]
+                    updated[id_] = key
+            else:
+                cls.__update(columns, update_values, ids, [values])
 
             for fname, value in values.items():
                 field = cls._fields[fname]
@@ -1042,6 +1048,7 @@ class ModelSQL(ModelStorage):
             field_names = list(values.keys())
             cls._update_mptt(field_names, [ids] * len(field_names), values)
             all_field_names |= set(field_names)
+        cls.__update_grouped(groups)
 
         for fname in sorted(fields_to_set, key=cls.index_set_field):
             fargs = fields_to_set[fname]
@@ -1056,6 +1063,76 @@ class ModelSQL(ModelStorage):
 
         cls.trigger_write(trigger_eligibles)
 
+    @classmethod
+    def __update(cls, columns, update_values, ids, vlist):
+        DatabaseIntegrityError = backend.get('DatabaseIntegrityError')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = columns[0].table
+        for sub_ids in grouped_slice(ids):
+            red_sql = reduce_ids(table.id, sub_ids)
+            try:
+                cursor.execute(*table.update(columns, update_values,
+                        where=red_sql))
+            except DatabaseIntegrityError as exception:
+                cls.__update_integrity_error(exception, vlist)
+                raise
+
+    @classmethod
+    def __update_grouped(cls, groups):
+        """
+        Update for each group of columns the records with their values
+        using a single query per slice.
+        """
+        DatabaseIntegrityError = backend.get('DatabaseIntegrityError')
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+        for fnames, (vlist, rows) in groups.items():
+            table = cls.__table__()
+            columns = [table.write_uid, table.write_date]
+            columns += [Column(table, n) for n in fnames]
+            constants = [transaction.user, CurrentTimestamp()]
+            if len(vlist) == 1:
+                update_values = next(iter(rows.values()))
+                cls.__update(columns, constants + update_values,
+                    list(rows.keys()), vlist)
+                continue
+            size = max(1, database.IN_MAX // (len(fnames) + 1))
+            for sub_rows in grouped_slice(list(rows.items()), size):
+                if database.has_update_from():
+                    values = Values([[id_] + row for id_, row in sub_rows])
+                    update_values = [
+                        cls._fields[n].sql_cast(
+                            Column(values, 'column%s' % (i + 2)))
+                        for i, n in enumerate(fnames)]
+                    query = table.update(columns, constants + update_values,
+                        from_=[values],
+                        where=table.id == Column(values, 'column1'))
+                else:
+                    update_values = [
+                        Case(*((table.id == id_, row[i])
+                                for id_, row in sub_rows))
+                        for i in range(len(fnames))]
+                    query = table.update(columns, constants + update_values,
+                        where=reduce_ids(
+                            table.id, [id_ for id_, _ in sub_rows]))
+                try:
+                    cursor.execute(*query)
+                except DatabaseIntegrityError as exception:
+                    cls.__update_integrity_error(exception, vlist)
+                    raise
+
+    @classmethod
+    def __update_integrity_error(cls, exception, vlist):
+        transaction = Transaction()
+        with Transaction().new_transaction(), \
+                Transaction().set_context(_check_access=False):
+            for values in vlist:
+                cls.__raise_integrity_error(
+                    exception, values, list(values.keys()),
+                    transaction=transaction)
+
     @classmethod
     @no_table_query
     def delete(cls, records):
@@ -1098,23 +1175,17 @@ class ModelSQL(ModelStorage):
         foreign_keys_tocheck = []
         foreign_keys_toupdate = []
         foreign_keys_todelete = []
-        for _, model in pool.iterobject():
-            if callable(getattr(model, 'table_query', None)):
-                continue
-            if not issubclass(model, ModelStorage):
-                continue
-            for field_name, field in model._fields.items():
-                if (isinstance(field, fields.Many2One)
-                        and field.model_name == cls.__name__):
-                    if field.ondelete == 'CASCADE':
-                        foreign_keys_todelete.append((model, field_name))
-                    elif field.ondelete == 'SET NULL':
-                        if field.required:
-                            foreign_keys_tocheck.append((model, field_name))
-                        else:
-                            foreign_keys_toupdate.append((model, field_name))
-                    else:
-                        foreign_keys_tocheck.append((model, field_name))
+        for model, field_name in pool.get_foreign_keys(cls.__name__):
+            field = model._fields[field_name]
+            if field.ondelete == 'CASCADE':
+                foreign_keys_todelete.append((model, field_name))
+            elif field.ondelete == 'SET NULL':
+                if field.required:
+                    foreign_keys_tocheck.append((model, field_name))
+                else:
+                    foreign_keys_toupdate.append((model, field_name))
+            else:
+                foreign_keys_tocheck.append((model, field_name))
 
         transaction.delete.setdefault(cls.__name__, set()).update(ids)
         cls.trigger_delete(records)
@@ -1144,6 +1215,10 @@ class ModelSQL(ModelStorage):
                 if (not hasattr(Model, 'search')
                         or not hasattr(Model, 'write')):
                     continue
+                if (issubclass(Model, ModelSQL)
+                        and Model._sql_cascade_eligible('write')):
+                    Model.__set_null(field_name, sub_ids)
+                    continue
                 records = get_related_records(Model, field_name, sub_ids)
                 if records:
                     Model.write(records, {
@@ -1154,6 +1229,10 @@ class ModelSQL(ModelStorage):
                 if (not hasattr(Model, 'search')
                         or not hasattr(Model, 'delete')):
                     continue
+                if (issubclass(Model, ModelSQL)
+                        and Model._sql_cascade_eligible('delete')):
+                    Model.__delete_cascade(field_name, sub_ids)
+                    continue
                 records = get_related_records(Model, field_name, sub_ids)
                 if records:
                     Model.delete(records)
@@ -1185,6 +1264,179 @@ class ModelSQL(ModelStorage):
 
         cls._update_mptt(list(tree_ids.keys()), list(tree_ids.values()))
 
+    @classmethod
+    def _sql_cascade_eligible(cls, mode):
+        """
+        Return True if the records referencing a deleted record can be
+        deleted (mode 'delete') or unlinked (mode 'write') by a single SQL
+        statement instead of calling the method on each record.
+        """
+        pool = Pool()
+        Trigger = pool.get('ir.trigger')
+        if (not cls._sql_cascade
+                or cls._history
+                or callable(cls.table_query)):
+            return False
+        if mode == 'delete':
+            if cls.delete.__func__ is not ModelSQL.delete.__func__:
+                return False
+            for field in cls._fields.values():
+                if (isinstance(field, fields.Many2One)
+                        and field.model_name == cls.__name__
+                        and field.left and field.right):
+                    return False
+        elif cls.write.__func__ is not ModelSQL.write.__func__:
+            return False
+        return not Trigger.get_triggers(cls.__name__, mode)
+
+    @classmethod
+    def __related_where(cls, table, field_name, parent):
+        "Return the condition on table for the records linked to parent"
+        column = Column(table, field_name)
+        if isinstance(parent, Select):
+            return column.in_(parent)
+        return reduce_ids(column, parent)
+
+    @classmethod
+    def __clean_transaction_cache(cls, ids):
+        transaction = Transaction()
+        ids = set(ids)
+        for cache in list(transaction.cache.values()):
+            for cache in [cache] + list(
+                    cache.get('_language_cache', {}).values()):
+                if cls.__name__ in cache:
+                    for id_ in ids & set(cache[cls.__name__].keys()):
+                        del cache[cls.__name__][id_]
+
+    @classmethod
+    def __delete_cascade(cls, field_name, parent):
+        """
+        Delete with set-based SQL the records for which field_name is in
+        parent (a list of ids or a query) and cascade on their references.
+        """
+        DatabaseIntegrityError = backend.get('DatabaseIntegrityError')
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        Translation = pool.get('ir.translation')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        where = cls.__related_where(table, field_name, parent)
+        cursor.execute(*table.select(table.id, where=where))
+        ids = [x for x, in cursor.fetchall()]
+        deleted = transaction.delete.get(cls.__name__, set())
+        if deleted.intersection(ids):
+            # Cascade by slices on the remaining records to keep the
+            # conditions bounded
+            for sub_ids in grouped_slice([i for i in ids if i not in deleted]):
+                cls.__delete_cascade('id', list(sub_ids))
+            return
+        if not ids:
+            return
+
+        ModelAccess.check(cls.__name__, 'delete')
+        cls.__check_domain_rule(ids, 'delete')
+        if not cls.check_xml_record(cls.browse(ids), None):
+            cls.raise_user_error('delete_xml_record',
+                error_description='xml_record_desc')
+
+        transaction.delete.setdefault(cls.__name__, set()).update(ids)
+        transaction.delete_records.setdefault(cls.__name__, set()).update(ids)
+        query = table.select(table.id, where=where)
+
+        for Model, fname in pool.get_foreign_keys(cls.__name__):
+            field = Model._fields[fname]
+            is_sql = issubclass(Model, ModelSQL)
+            if (field.ondelete == 'CASCADE'
+                    and is_sql and Model._sql_cascade_eligible('delete')):
+                Model.__delete_cascade(fname, query)
+            elif (field.ondelete == 'SET NULL' and not field.required
+                    and is_sql and Model._sql_cascade_eligible('write')):
+                Model.__set_null(fname, query)
+            elif field.ondelete in {'CASCADE', 'SET NULL'}:
+                for sub_ids in grouped_slice(ids):
+                    sub_ids = list(sub_ids)
+                    if is_sql:
+                        foreign_table = Model.__table__()
+                        cursor.execute(*foreign_table.select(foreign_table.id,
+                                where=reduce_ids(
+                                    Column(foreign_table, fname), sub_ids)))
+                        records = Model.browse(
+                            [x for x, in cursor.fetchall()])
+                    else:
+                        with transaction.set_context(active_test=False):
+                            records = Model.search([(fname, 'in', sub_ids)])
+                    if not records:
+                        continue
+                    if field.ondelete == 'CASCADE':
+                        Model.delete(records)
+                    elif not field.required:
+                        Model.write(records, {fname: None})
+                    else:
+                        error_args = Model._get_error_args(fname)
+                        cls.raise_user_error('foreign_model_exist',
+                            error_args=error_args)
+            else:
+                for sub_ids in grouped_slice(ids):
+                    with Transaction().set_context(_check_access=False):
+                        if Model.search([
+                                    (fname, 'in', sub_ids),
+                                    ], order=[]):
+                            error_args = Model._get_error_args(fname)
+                            cls.raise_user_error('foreign_model_exist',
+                                error_args=error_args)
+
+        transaction.counter += 1
+        cls.__clean_transaction_cache(ids)
+
+        try:
+            cursor.execute(*table.delete(where=where))
+        except DatabaseIntegrityError as exception:
+            transaction = Transaction()
+            with Transaction().new_transaction():
+                cls.__raise_integrity_error(
+                    exception, {}, transaction=transaction)
+            raise
+
+        if any(getattr(f, 'translate', False) and not hasattr(f, 'set')
+                for f in cls._fields.values()):
+            Translation.delete_ids(cls.__name__, 'model', ids)
+
+    @classmethod
+    def __set_null(cls, field_name, parent):
+        """
+        Set to NULL with a single SQL statement the field_name of the
+        records for which it is in parent (a list of ids or a query).
+        """
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        ModelFieldAccess = pool.get('ir.model.field.access')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        where = cls.__related_where(table, field_name, parent)
+        cursor.execute(*table.select(table.id, where=where))
+        ids = [x for x, in cursor.fetchall()]
+        if not ids:
+            return
+
+        ModelAccess.check(cls.__name__, 'write')
+        ModelFieldAccess.check(cls.__name__, [field_name], 'write')
+        cls.__check_domain_rule(ids, 'write')
+        if not cls.check_xml_record(cls.browse(ids), {field_name: None}):
+            cls.raise_user_error('write_xml_record',
+                error_description='xml_record_desc')
+
+        transaction.counter += 1
+        cls.__clean_transaction_cache(ids)
+
+        cursor.execute(*table.update(
+                [Column(table, field_name), table.write_uid, table.write_date],
+                [Null, transaction.user, CurrentTimestamp()],
+                where=where))
+
     @classmethod
     def __check_domain_rule(cls, ids, mode, nodomain=None):
         pool = Pool()
@@ -1377,6 +1629,53 @@ class ModelSQL(ModelStorage):
 
         return cls.browse([x['id'] for x in rows])
 
+    @classmethod
+    def search_iter(cls, domain, order=None, batch_size=None):
+        transaction = Transaction()
+        database = transaction.database
+        if cls._history and transaction.context.get('_datetime'):
+            yield from super(ModelSQL, cls).search_iter(
+                domain, order=order, batch_size=batch_size)
+            return
+        if batch_size is None:
+            batch_size = database.IN_MAX
+
+        query = cls.search(domain, order=order, query=True)
+        if database.has_named_cursor():
+            cursor = transaction.connection.cursor(
+                'search_iter_%s' % uuid.uuid4().hex)
+        else:
+            cursor = transaction.connection.cursor()
+        # Fields cached by search
+        fnames = [n for n, f in cls._fields.items()
+            if not hasattr(f, 'get')
+            and n != 'id'
+            and not getattr(f, 'translate', False)
+            and f.loading == 'eager'
+            and not getattr(f, 'datetime_field', None)]
+        local_cache = LRUDictTransaction(cache_size())
+        transaction_cache = transaction.get_cache()
+        try:
+            cursor.execute(*query)
+            while True:
+                ids = [x for x, in cursor.fetchmany(batch_size)]
+                if not ids:
+                    break
+                if fnames:
+                    if cls.__name__ not in transaction_cache:
+                        transaction_cache[cls.__name__] = LRUDict(
+                            cache_size())
+                    cache = transaction_cache[cls.__name__]
+                    for data in cls.read(ids, fnames):
+                        cache.setdefault(data['id'], {}).update(data)
+                ids = BrowseIds(ids)
+                yield [cls(x, _ids=ids,
+                        _local_cache=local_cache,
+                        _transaction_cache=transaction_cache,
+                        _transaction=transaction) for x in ids]
+        finally:
+            cursor.close()
+
     @classmethod
     def search_domain(cls, domain, active_test=True, tables=None):
         '''
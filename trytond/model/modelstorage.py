@@ -7,16 +7,17 @@ import csv
 import warnings
 import tempfile
 from decimal import Decimal
-from itertools import islice, chain
+from itertools import islice, chain, groupby
 from functools import reduce, wraps
 from operator import itemgetter
 from collections import defaultdict
+from contextlib import contextmanager
 
 from trytond.model import Model
 from trytond.model import fields
 from trytond.tools import reduce_domain, memoize, is_instance_method, \
     grouped_slice
-from trytond.pyson import PYSONEncoder, PYSONDecoder, PYSON
+from trytond.pyson import PYSONEncoder, PYSON, compile_pyson
 from trytond.const import OPERATORS
 from trytond.config import config
 from trytond.transaction import Transaction
@@ -51,6 +52,81 @@ def is_leaf(expression):
         and expression[1] in OPERATORS)  # TODO remove OPERATORS test
 
 
+def _invalidate(name):
+    method = getattr(list, name)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._positions = None
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class BrowseIds(list):
+    "List of ids shared by browsed records with constant time position lookup"
+    __slots__ = ('_positions',)
+
+    def __init__(self, ids=()):
+        super(BrowseIds, self).__init__(ids)
+        self._positions = None
+
+    @property
+    def positions(self):
+        "Mapping of each id to its first position"
+        if self._positions is None:
+            positions = {}
+            for i, id_ in enumerate(self):
+                positions.setdefault(id_, i)
+            self._positions = positions
+        return self._positions
+
+    def index(self, id_, *args):
+        if args:
+            return super(BrowseIds, self).index(id_, *args)
+        try:
+            return self.positions[id_]
+        except KeyError:
+            raise ValueError('%r is not in list' % (id_,))
+
+    def __contains__(self, id_):
+        return id_ in self.positions
+
+    def append(self, id_):
+        if self._positions is not None:
+            self._positions.setdefault(id_, len(self))
+        super(BrowseIds, self).append(id_)
+
+    def extend(self, ids):
+        start = len(self)
+        super(BrowseIds, self).extend(ids)
+        if self._positions is not None:
+            for i in range(start, len(self)):
+                self._positions.setdefault(self[i], i)
+
+    __setitem__ = _invalidate('__setitem__')
+    __delitem__ = _invalidate('__delitem__')
+    __iadd__ = _invalidate('__iadd__')
+    __imul__ = _invalidate('__imul__')
+    insert = _invalidate('insert')
+    pop = _invalidate('pop')
+    remove = _invalidate('remove')
+    clear = _invalidate('clear')
+    sort = _invalidate('sort')
+    reverse = _invalidate('reverse')
+
+    def following(self, id_):
+        """
+        Yield the unique ids starting at the position of id_ and wrapping
+        around to the beginning of the list
+        """
+        positions = self.positions
+        start = positions[id_]
+        for i in chain(range(start, len(self)), range(0, max(start - 1, 0))):
+            id_ = self[i]
+            if positions[id_] == i:
+                yield id_
+
+
 class ModelStorage(Model):
     """
     Define a model with storage capability in Tryton.
@@ -387,7 +463,8 @@ class ModelStorage(Model):
 
         # Clean transaction cache
         for cache in list(Transaction().cache.values()):
-            for cache in (cache, list(cache.get('_language_cache', {}).values())):
+            for cache in [cache] + list(
+                    cache.get('_language_cache', {}).values()):
                 if cls.__name__ in cache:
                     for record in records:
                         if record.id in cache[cls.__name__]:
@@ -616,6 +693,17 @@ class ModelStorage(Model):
             return len(res)
         return res
 
+    @classmethod
+    def search_iter(cls, domain, order=None, batch_size=None):
+        '''
+        Yield lists of at most batch_size records that match the domain.
+        '''
+        if batch_size is None:
+            batch_size = Transaction().database.IN_MAX
+        records = cls.search(domain, order=order)
+        for sub_records in grouped_slice(records, batch_size):
+            yield list(sub_records)
+
     @classmethod
     def full_text_search_domain(cls, text, domain):
         """Downstream modules can override this method to redefine the domain"""
@@ -799,7 +887,7 @@ class ModelStorage(Model):
         Return a list of instance for the ids
         '''
         transaction = Transaction()
-        ids = list(map(int, ids))
+        ids = BrowseIds(map(int, ids))
         local_cache = LRUDictTransaction(cache_size())
         transaction_cache = transaction.get_cache()
         return [cls(x, _ids=ids,
@@ -850,7 +938,7 @@ class ModelStorage(Model):
         } for record in records])
 
     @staticmethod
-    def __export_row(record, fields_names):
+    def __export_row(record, fields_names, plan):
         pool = Pool()
         lines = []
         data = ['' for x in range(len(fields_names))]
@@ -864,23 +952,17 @@ class ModelStorage(Model):
             while i < len(fields_tree):
                 if not isinstance(value, ModelStorage):
                     break
-                field_name = fields_tree[i]
-                descriptor = None
-                if '.' in field_name:
-                    field_name, descriptor = field_name.split('.')
                 eModel = pool.get(value.__name__)
-                field = eModel._fields[field_name]
-                if field.states and 'invisible' in field.states:
-                    pyson_invisible = PYSONEncoder().encode(
-                            field.states['invisible'])
+                field_name, field, descriptor, invisible = plan.field(
+                    eModel, fields_tree[i])
+                if invisible:
                     env = EvalEnvironment(value, eModel)
                     env.update(Transaction().context)
                     env['current_date'] = datetime.datetime.today()
                     env['time'] = time
                     env['context'] = Transaction().context
                     env['active_id'] = value.id
-                    invisible = PYSONDecoder(env).decode(pyson_invisible)
-                    if invisible:
+                    if invisible(env):
                         value = ''
                         break
                 if descriptor:
@@ -896,7 +978,7 @@ class ModelStorage(Model):
                     done.append(child_fields_names)
                     for child_record in value:
                         child_lines = ModelStorage.__export_row(child_record,
-                                child_fields_names)
+                                child_fields_names, plan)
                         if first:
                             for child_fpos in range(len(fields_names)):
                                 if child_lines and child_lines[0][child_fpos]:
@@ -923,11 +1005,37 @@ class ModelStorage(Model):
         The list of values follows fields_names.
         Relational fields are defined with '/' at any depth.
         '''
+        return list(cls.export_data_iter(records, fields_names))
+
+    @classmethod
+    def export_data_iter(cls, records, fields_names, batch_size=None):
+        '''
+        Yield the rows of export_data.
+        The records are exported by batch of batch_size with the fields of
+        each relation level read at once.
+        '''
         fields_names = [x.split('/') for x in fields_names]
-        data = []
-        for record in records:
-            data += cls.__export_row(record, fields_names)
-        return data
+        plan = _ExportPlan(fields_names)
+        if batch_size is None:
+            batch_size = cache_size()
+        for sub_records in grouped_slice(records, batch_size):
+            # Instantiate each batch with its own local cache to release the
+            # instances of the previous but with the user, the context and the
+            # transaction cache of the given records. The transaction cache is
+            # kept to not read again the relations shared between the batches.
+            for _, group in groupby(sub_records, key=_ExportPlan.key):
+                group = list(group)
+                first = group[0]
+                ids = BrowseIds(r.id for r in group)
+                local_cache = LRUDictTransaction(cache_size())
+                with _ExportPlan.transaction(first):
+                    group = [cls(i, _ids=ids,
+                            _local_cache=local_cache,
+                            _transaction_cache=first._transaction_cache,
+                            _transaction=first._transaction) for i in ids]
+                plan.prefetch(cls, group)
+                for record in group:
+                    yield from cls.__export_row(record, fields_names, plan)
 
     @classmethod
     def import_data(cls, fields_names, data):
@@ -1280,7 +1388,7 @@ class ModelStorage(Model):
                     env['time'] = time
                     env['context'] = Transaction().context
                     env['active_id'] = record.id
-                    domain = freeze(PYSONDecoder(env).decode(pyson_domain))
+                    domain = freeze(compile_pyson(pyson_domain)(env))
                     domains[domain].append(record)
                 # Select strategy depending if it is closer to one domain per
                 # record or one domain for all records
@@ -1396,7 +1504,7 @@ class ModelStorage(Model):
                             env['time'] = time
                             env['context'] = Transaction().context
                             env['active_id'] = record.id
-                            required = PYSONDecoder(env).decode(pyson_required)
+                            required = compile_pyson(pyson_required)(env)
                             if required:
                                 required_test(getattr(record, field_name),
                                     field_name, field)
@@ -1412,16 +1520,17 @@ class ModelStorage(Model):
                             getattr(record, field_name), field_name, field)
                 # validate size
                 if hasattr(field, 'size') and field.size is not None:
+                    if isinstance(field.size, PYSON):
+                        pyson_size = PYSONEncoder().encode(field.size)
                     for record in records:
                         if isinstance(field.size, PYSON):
-                            pyson_size = PYSONEncoder().encode(field.size)
                             env = EvalEnvironment(record, cls)
                             env.update(Transaction().context)
                             env['current_date'] = datetime.datetime.today()
                             env['time'] = time
                             env['context'] = Transaction().context
                             env['active_id'] = record.id
-                            field_size = PYSONDecoder(env).decode(pyson_size)
+                            field_size = compile_pyson(pyson_size)(env)
                         else:
                             field_size = field.size
                         size = len(getattr(record, field_name) or '')
@@ -1460,7 +1569,7 @@ class ModelStorage(Model):
                             env['time'] = time
                             env['context'] = Transaction().context
                             env['active_id'] = record.id
-                            digits = PYSONDecoder(env).decode(pyson_digits)
+                            digits = compile_pyson(pyson_digits)(env)
                             digits_test(getattr(record, field_name), digits,
                                 field_name)
                     else:
@@ -1512,7 +1621,7 @@ class ModelStorage(Model):
                 if (field._type in ('datetime', 'time')
                         and field_name not in ('create_date', 'write_date')):
                     if is_pyson(field.format):
-                        pyson_format = PYSONDecoder().encode(field.format)
+                        pyson_format = PYSONEncoder().encode(field.format)
                         for record in records:
                             env = EvalEnvironment(record, cls)
                             env.update(Transaction().context)
@@ -1520,7 +1629,7 @@ class ModelStorage(Model):
                             env['time'] = time
                             env['context'] = Transaction().context
                             env['active_id'] = record.id
-                            format = PYSONDecoder(env).decode(pyson_format)
+                            format = compile_pyson(pyson_format)(env)
                             format_test(getattr(record, field_name), format,
                                 field_name)
                     else:
@@ -1573,10 +1682,12 @@ class ModelStorage(Model):
         if id is not None:
             id = int(id)
         if _ids is not None:
+            if not isinstance(_ids, BrowseIds):
+                _ids = BrowseIds(_ids)
             self._ids = _ids
             assert id in _ids
         else:
-            self._ids = [id]
+            self._ids = BrowseIds([id])
 
         if _transaction_cache is not None:
             self._transaction_cache = _transaction_cache
@@ -1678,16 +1789,7 @@ class ModelStorage(Model):
             return (name not in self._cache.get(id_, {})
                 and name not in self._local_cache.get(id_, {}))
 
-        def unique(ids):
-            s = set()
-            for id_ in ids:
-                if id_ not in s:
-                    s.add(id_)
-                    yield id_
-        index = self._ids.index(self.id)
-        ids = chain(islice(self._ids, index, None),
-            islice(self._ids, 0, max(index - 1, 0)))
-        ids = islice(unique(filter(filter_, ids)),
+        ids = islice(filter(filter_, self._ids.following(self.id)),
             self._transaction.database.IN_MAX)
 
         def instantiate(field, value, data):
@@ -1716,7 +1818,7 @@ class ModelStorage(Model):
             ctx = {}
             if field.context:
                 pyson_context = PYSONEncoder().encode(field.context)
-                ctx.update(PYSONDecoder(data).decode(pyson_context))
+                ctx.update(compile_pyson(pyson_context)(data))
             datetime_ = None
             if getattr(field, 'datetime_field', None):
                 datetime_ = data.get(field.datetime_field)
@@ -1726,7 +1828,7 @@ class ModelStorage(Model):
                 key = (Model, freeze(ctx))
                 kwargs['_local_cache'] = model2cache.setdefault(key,
                     LRUDictTransaction(cache_size()))
-                kwargs['_ids'] = ids = model2ids.setdefault(key, [])
+                kwargs['_ids'] = ids = model2ids.setdefault(key, BrowseIds())
                 kwargs['_transaction_cache'] = transaction.get_cache()
                 kwargs['_transaction'] = transaction
                 if field._type in ('many2one', 'one2one', 'reference'):
@@ -1746,8 +1848,7 @@ class ModelStorage(Model):
                 self._transaction.set_context(self._context):
             if self.id in self._cache and name in self._cache[self.id]:
                 # Use values from cache
-                ids = islice(chain(islice(self._ids, index, None),
-                        islice(self._ids, 0, max(index - 1, 0))),
+                ids = islice(self._ids.following(self.id),
                     self._transaction.database.IN_MAX)
                 ffields = {name: ffields[name]}
                 read_data = [{'id': i, name: self._cache[i][name]}
@@ -1902,6 +2003,115 @@ class ModelStorage(Model):
         ]
 
 
+class _ExportPlan(object):
+    "The field paths of an export"
+
+    def __init__(self, fields_names):
+        self.tree = {}
+        for fields_tree in fields_names:
+            node = self.tree
+            for name in fields_tree:
+                node = node.setdefault(name, {})
+        self._fields = {}
+
+    @staticmethod
+    def key(record):
+        "Return the key of the records read with the same user and context"
+        return (id(record._transaction), id(record._transaction_cache),
+            record._user, freeze(record._context))
+
+    @staticmethod
+    @contextmanager
+    def transaction(record):
+        "Set the transaction, the user and the context of the record"
+        transaction = record._transaction
+        with Transaction().set_current_transaction(transaction), \
+                transaction.set_user(record._user), \
+                transaction.reset_context(), \
+                transaction.set_context(record._context):
+            yield transaction
+
+    def field(self, Model, name):
+        """Return the field name, the field, the descriptor and the function
+        evaluating the invisible state of the name for the Model"""
+        key = (Model.__name__, name)
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+        field_name, descriptor = name, None
+        if '.' in name:
+            field_name, descriptor = name.split('.')
+        field = Model._fields[field_name]
+        invisible = None
+        if field.states and 'invisible' in field.states:
+            invisible = compile_pyson(
+                PYSONEncoder().encode(field.states['invisible']))
+        self._fields[key] = result = (field_name, field, descriptor, invisible)
+        return result
+
+    def prefetch(self, Model, records, tree=None):
+        "Read at once the fields of the records and of their relations"
+        pool = Pool()
+        FieldAccess = pool.get('ir.model.field.access')
+        if tree is None:
+            tree = self.tree
+        if not records or not tree:
+            return
+
+        fields_ = {}
+        for name, subtree in tree.items():
+            field_name, field, descriptor, invisible = self.field(Model, name)
+            # The export may not access the invisible fields
+            if not invisible and not descriptor:
+                fields_[field_name] = (field, subtree)
+        accesses = FieldAccess.check(
+            Model.__name__, list(fields_), 'read', access=True)
+
+        fnames, relations = [], []
+        for field_name, (field, subtree) in fields_.items():
+            if not accesses.get(field_name, True):
+                continue
+            if subtree:
+                relations.append((field_name, subtree))
+            elif (not hasattr(field, 'get')
+                    and field_name != 'id'
+                    and not getattr(field, 'translate', False)
+                    and not getattr(field, 'datetime_field', None)):
+                fnames.append(field_name)
+
+        if fnames:
+            groups = defaultdict(list)
+            for record in records:
+                groups[self.key(record)].append(record)
+            cached = set(fnames).issubset
+            for group in groups.values():
+                # Fill the cache used by the records for their context
+                cache = group[0]._cache
+                # Do not read more records than the cache can keep
+                ids = list(islice(
+                        (i for i in dict.fromkeys(r.id for r in group)
+                            if not cached(cache.get(i, ()))),
+                        cache_size()))
+                if ids:
+                    with self.transaction(group[0]):
+                        for data in Model.read(ids, fnames):
+                            cache.setdefault(data['id'], {}).update(data)
+
+        for field_name, subtree in relations:
+            children = defaultdict(list)
+            for record in records:
+                value = getattr(record, field_name)
+                if isinstance(value, ModelStorage):
+                    value = [value]
+                elif not isinstance(value, (list, tuple)):
+                    continue
+                for child in value:
+                    children[child.__name__].append(child)
+            for model_name, child_records in children.items():
+                self.prefetch(pool.get(model_name), child_records, subtree)
+
+
 class EvalEnvironment(dict):
 
     def __init__(self, record, Model):
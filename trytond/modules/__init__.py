@@ -184,7 +184,9 @@ def load_module_graph(graph, pool, update=None, lang=None):
             code = get_parent_language(code)
 
     transaction = Transaction()
-    with transaction.connection.cursor() as cursor:
+    TableHandler = backend.get('TableHandler')
+    # Load the definitions of the tables once for all the table handlers
+    with transaction.connection.cursor() as cursor, TableHandler.snapshot():
         modules = [x.name for x in graph]
         cursor.execute(*ir_module.select(ir_module.name, ir_module.state,
                 where=ir_module.name.in_(modules)))
@@ -335,6 +337,16 @@ def register_classes():
         MODULES.append(module)
 
 
+def warm_access(pool):
+    "Fill the access caches for the groups of the active users"
+    logger.info('warm access cache')
+    User = pool.get('res.user')
+    fingerprints = User.get_groups_fingerprints()
+    for model_name in [
+            'ir.model.access', 'ir.model.field.access', 'ir.rule']:
+        pool.get(model_name).warm_cache(fingerprints)
+
+
 def load_modules(
         database_name, pool, update=None, lang=None, activatedeps=False):
     res = True
@@ -410,6 +422,9 @@ def load_modules(
 
                 Module = pool.get('ir.module')
                 Module.update_list()
+
+            if config.getboolean('cache', 'warm_access', default=False):
+                warm_access(pool)
         # Need to commit to unlock SQLite database
         transaction.commit()
 
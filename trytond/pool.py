@@ -52,6 +52,7 @@ class Pool(object):
     _pool = {}
     test = False
     _instances = {}
+    _foreign_keys = {}
 
     def __new__(cls, database_name=None):
         if database_name is None:
@@ -116,6 +117,7 @@ class Pool(object):
         with lock:
             if database_name in cls._pool:
                 del cls._pool[database_name]
+            cls._foreign_keys.pop(database_name, None)
 
     @classmethod
     def database_list(cls):
@@ -153,6 +155,7 @@ class Pool(object):
                 return
             logger.info('init pool for "%s"', self.database_name)
             self._pool.setdefault(self.database_name, {})
+            self._foreign_keys.pop(self.database_name, None)
             # Clean the _pool before loading modules
             for type in self.classes.keys():
                 self._pool[self.database_name][type] = {}
@@ -191,6 +194,8 @@ class Pool(object):
         '''
         with self._locks[self.database_name]:
             self._pool[self.database_name][type][cls.__name__] = cls
+            if type == 'model':
+                self._foreign_keys.pop(self.database_name, None)
 
     def iterobject(self, type='model'):
         '''
@@ -234,6 +239,33 @@ class Pool(object):
                 cls.__setup__()
             for cls in lst:
                 cls.__post_setup__()
+        self._foreign_keys[self.database_name] = self._build_foreign_keys()
+
+    def _build_foreign_keys(self):
+        from trytond.model import ModelStorage, fields
+        foreign_keys = defaultdict(list)
+        for model_name, model in self.iterobject():
+            if callable(getattr(model, 'table_query', None)):
+                continue
+            if not issubclass(model, ModelStorage):
+                continue
+            for field_name, field in model._fields.items():
+                if isinstance(field, fields.Many2One):
+                    foreign_keys[field.model_name].append(
+                        (model_name, field_name))
+        return dict(foreign_keys)
+
+    def get_foreign_keys(self, name):
+        '''
+        Return the list of (model, field name) of the Many2One fields which
+        target the model name
+        '''
+        foreign_keys = self._foreign_keys.get(self.database_name)
+        if foreign_keys is None:
+            foreign_keys = self._foreign_keys[self.database_name] = (
+                self._build_foreign_keys())
+        return [(self.get(model_name), field_name)
+            for model_name, field_name in foreign_keys.get(name, [])]
 
     def setup_mixin(self, modules):
         logger.info('setup mixin for "%s"', self.database_name)
@@ -167,9 +167,10 @@ def _dispatch(request, pool, *args, **kwargs):
         with Transaction().start(pool.database_name, user,
                 readonly=rpc.readonly) as transaction:
             try:
-                c_args, c_kwargs, transaction.context, transaction.timestamp \
+                c_args, c_kwargs, context, transaction.timestamp \
                     = rpc.convert(obj, *args, **kwargs)
-                transaction.context['_request'] = request.context
+                context['_request'] = request.context
+                transaction.context = context
                 meth = getattr(obj, method)
                 if (rpc.instantiate is None
                         or not is_instance_method(obj, method)):
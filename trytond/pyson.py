@@ -4,7 +4,9 @@ import json
 import datetime
 from decimal import Decimal
 from dateutil.relativedelta import relativedelta
-from functools import reduce
+from functools import reduce, lru_cache
+
+from trytond.config import config
 
 
 class PYSON(object):
@@ -19,6 +21,15 @@ class PYSON(object):
     def eval(dct, context):
         raise NotImplementedError
 
+    @classmethod
+    def compile(cls, dct):
+        """Return a function evaluating the statement against a context from
+        the dictionary of functions evaluating its arguments"""
+        items = list(dct.items())
+        eval_ = cls.eval
+        return lambda context: eval_(
+            {k: f(context) for k, f in items}, context)
+
     def __invert__(self):
         if self.types() != {bool}:
             return Not(Bool(self))
@@ -127,6 +138,72 @@ class PYSONDecoder(json.JSONDecoder):
         return dct
 
 
+class _Compiled(object):
+    "Function evaluating a decoded value against a context"
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    elif isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+def _function(value):
+    if isinstance(value, _Compiled):
+        return value.function
+    elif isinstance(value, (list, dict)):
+        # Each evaluation returns a new container like PYSONDecoder
+        return lambda context: _copy(value)
+    else:
+        return lambda context: value
+
+
+def _compile_value(value):
+    if isinstance(value, list):
+        values = [_compile_value(v) for v in value]
+        if any(isinstance(v, _Compiled) for v in values):
+            functions = [_function(v) for v in values]
+            return _Compiled(lambda context: [f(context) for f in functions])
+    return value
+
+
+class PYSONCompiler(json.JSONDecoder):
+
+    def __init__(self):
+        super(PYSONCompiler, self).__init__(object_hook=self._object_hook)
+
+    def _object_hook(self, dct):
+        values = {k: _compile_value(v) for k, v in dct.items()}
+        if '__class__' in dct:
+            klass = CONTEXT.get(dct['__class__'])
+            if klass:
+                return _Compiled(klass.compile(
+                        {k: _function(v) for k, v in values.items()}))
+        if any(isinstance(v, _Compiled) for v in values.values()):
+            functions = [(k, _function(v)) for k, v in values.items()]
+            return _Compiled(
+                lambda context: {k: f(context) for k, f in functions})
+        return dct
+
+    def decode(self, s):
+        "Return a function evaluating the string against a context"
+        return _function(_compile_value(
+                super(PYSONCompiler, self).decode(s)))
+
+
+@lru_cache(maxsize=config.getint('cache', 'pyson', default=1000))
+def compile_pyson(s):
+    """Return a cached function evaluating the PYSON string against a context
+    like PYSONDecoder(context).decode(s)"""
+    return PYSONCompiler().decode(s)
+
+
 class Eval(PYSON):
 
     def __init__(self, v, d=''):
@@ -155,6 +232,11 @@ class Eval(PYSON):
     def eval(dct, context):
         return context.get(dct['v'], dct['d'])
 
+    @staticmethod
+    def compile(dct):
+        value, default = dct['v'], dct['d']
+        return lambda context: context.get(value(context), default(context))
+
 
 class Not(PYSON):
 
@@ -184,6 +266,11 @@ class Not(PYSON):
     def eval(dct, context):
         return not dct['v']
 
+    @staticmethod
+    def compile(dct):
+        value = dct['v']
+        return lambda context: not value(context)
+
 
 class Bool(PYSON):
 
@@ -208,6 +295,11 @@ class Bool(PYSON):
     def eval(dct, context):
         return bool(dct['v'])
 
+    @staticmethod
+    def compile(dct):
+        value = dct['v']
+        return lambda context: bool(value(context))
+
 
 class And(PYSON):
 
@@ -240,6 +332,12 @@ class And(PYSON):
     def eval(dct, context):
         return bool(reduce(lambda x, y: x and y, dct['s']))
 
+    @staticmethod
+    def compile(dct):
+        statements = dct['s']
+        return lambda context: bool(
+            reduce(lambda x, y: x and y, statements(context)))
+
 
 class Or(And):
 
@@ -252,6 +350,12 @@ class Or(And):
     def eval(dct, context):
         return bool(reduce(lambda x, y: x or y, dct['s']))
 
+    @staticmethod
+    def compile(dct):
+        statements = dct['s']
+        return lambda context: bool(
+            reduce(lambda x, y: x or y, statements(context)))
+
 
 class Equal(PYSON):
 
@@ -288,6 +392,11 @@ class Equal(PYSON):
     def eval(dct, context):
         return dct['s1'] == dct['s2']
 
+    @staticmethod
+    def compile(dct):
+        statement1, statement2 = dct['s1'], dct['s2']
+        return lambda context: statement1(context) == statement2(context)
+
 
 class Greater(PYSON):
 
@@ -409,6 +518,16 @@ class If(PYSON):
         else:
             return dct['e']
 
+    @staticmethod
+    def compile(dct):
+        condition, then, else_ = dct['c'], dct['t'], dct['e']
+
+        def if_(context):
+            # Evaluate all the statements like PYSONDecoder
+            values = condition(context), then(context), else_(context)
+            return values[1] if values[0] else values[2]
+        return if_
+
 
 class Get(PYSON):
 
@@ -449,6 +568,11 @@ class Get(PYSON):
     def eval(dct, context):
         return dct['v'].get(dct['k'], dct['d'])
 
+    @staticmethod
+    def compile(dct):
+        obj, key, default = dct['v'], dct['k'], dct['d']
+        return lambda context: obj(context).get(key(context), default(context))
+
 
 class In(PYSON):
 
@@ -491,6 +615,11 @@ class In(PYSON):
     def eval(dct, context):
         return dct['k'] in dct['v']
 
+    @staticmethod
+    def compile(dct):
+        key, obj = dct['k'], dct['v']
+        return lambda context: key(context) in obj(context)
+
 
 class Date(PYSON):
 
@@ -79,6 +79,7 @@ class Group(ModelSQL, ModelView):
         pool = Pool()
         # Restart the cache on the domain_get method
         pool.get('ir.rule')._domain_get_cache.clear()
+        pool.get('ir.rule')._get_rules_cache.clear()
         # Restart the cache for get_groups
         pool.get('res.user')._get_groups_cache.clear()
         # Restart the cache for get_preferences
@@ -95,6 +96,7 @@ class Group(ModelSQL, ModelView):
         pool = Pool()
         # Restart the cache on the domain_get method
         pool.get('ir.rule')._domain_get_cache.clear()
+        pool.get('ir.rule')._get_rules_cache.clear()
         # Restart the cache for get_groups
         pool.get('res.user')._get_groups_cache.clear()
         # Restart the cache for get_preferences
@@ -110,6 +112,7 @@ class Group(ModelSQL, ModelView):
         pool = Pool()
         # Restart the cache on the domain_get method
         pool.get('ir.rule')._domain_get_cache.clear()
+        pool.get('ir.rule')._get_rules_cache.clear()
         # Restart the cache for get_groups
         pool.get('res.user')._get_groups_cache.clear()
         # Restart the cache for get_preferences
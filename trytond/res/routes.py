@@ -6,6 +6,7 @@ import random
 
 from werkzeug.exceptions import abort
 
+from trytond.cache import Cache
 from trytond.config import config
 from trytond.wsgi import app
 from trytond.protocols.wrappers import with_pool, with_transaction
@@ -65,3 +66,30 @@ def user_application(request, pool):
             LoginAttempt.remove(login)
         else:
             LoginAttempt.add(login)
+
+
+def _check_admin(request, pool):
+    User = pool.get('res.user')
+    ModelData = pool.get('ir.model.data')
+    with Transaction().set_user(request.user_id):
+        groups = User.get_groups()
+    if ModelData.get_id('res', 'group_admin') not in groups:
+        abort(403)
+
+
+@app.route('/<database_name>/cache/stats', methods=['GET'])
+@app.auth_required
+@with_pool
+@with_transaction(readonly=True)
+def cache_stats(request, pool):
+    _check_admin(request, pool)
+    return Cache.all_stats(pool.database_name)
+
+
+@app.route('/<database_name>/database/stats', methods=['GET'])
+@app.auth_required
+@with_pool
+@with_transaction(readonly=True)
+def database_stats(request, pool):
+    _check_admin(request, pool)
+    return Transaction().database.pool_stats()
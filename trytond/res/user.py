@@ -402,10 +402,7 @@ class User(DeactivableMixin, ModelSQL, ModelView):
         cls._get_login_cache.clear()
         # Restart the cache for get_preferences
         cls._get_preferences_cache.clear()
-        # Restart the cache of check
-        pool.get('ir.model.access')._get_access_cache.clear()
-        # Restart the cache of check
-        pool.get('ir.model.field.access')._get_access_cache.clear()
+        # The caches of access are keyed by groups fingerprint
         # Restart the cache
         ModelView._fields_view_get_cache.clear()
 
@@ -599,6 +596,48 @@ class User(DeactivableMixin, ModelSQL, ModelView):
         cls._get_groups_cache.set(user, groups)
         return groups
 
+    @classmethod
+    def get_groups_fingerprint(cls):
+        """
+        Return the fingerprint of the groups of the user
+        It is shared by the users having the same groups.
+        """
+        pool = Pool()
+        UserGroup = pool.get('res.user-res.group')
+        user_id = Transaction().user
+        # The groups are read without the access checks which depend on them
+        key = ('fingerprint', user_id)
+        fingerprint = cls._get_groups_cache.get(key)
+        if fingerprint is not None:
+            return fingerprint
+        cursor = Transaction().connection.cursor()
+        user_group = UserGroup.__table__()
+        cursor.execute(*user_group.select(user_group.group,
+                where=user_group.user == user_id))
+        fingerprint = tuple(sorted(g for g, in cursor.fetchall()))
+        cls._get_groups_cache.set(key, fingerprint)
+        return fingerprint
+
+    @classmethod
+    def get_groups_fingerprints(cls):
+        "Return the set of the groups fingerprints of the active users"
+        pool = Pool()
+        UserGroup = pool.get('res.user-res.group')
+        cursor = Transaction().connection.cursor()
+        user = cls.__table__()
+        user_group = UserGroup.__table__()
+
+        cursor.execute(*user.join(user_group, 'LEFT',
+                condition=user_group.user == user.id
+                ).select(user.id, user_group.group,
+                where=(user.active == True) & (user.id != 0)))
+        groups = {}
+        for user_id, group_id in cursor.fetchall():
+            user_groups = groups.setdefault(user_id, [])
+            if group_id is not None:
+                user_groups.append(group_id)
+        return {tuple(sorted(g)) for g in groups.values()}
+
     @classmethod
     def _get_login(cls, login):
         result = cls._get_login_cache.get(login)
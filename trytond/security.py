@@ -1,6 +1,9 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import logging
+import time
+from collections import defaultdict
+from threading import Lock
 
 from trytond.pool import Pool
 from trytond.config import config
@@ -9,6 +12,10 @@ from trytond import backend
 from trytond.exceptions import LoginException, RateLimitException
 
 logger = logging.getLogger(__name__)
+_reset_interval = config.getint('session', 'reset_interval', default=60)
+_resets = defaultdict(dict)
+_resets_pending = defaultdict(set)
+_resets_lock = Lock()
 
 
 def _get_pool(dbname):
@@ -70,6 +77,9 @@ def logout(dbname, user, session, context=None):
                 if count:
                     continue
                 raise
+    with _resets_lock:
+        _resets[dbname].pop(session, None)
+        _resets_pending[dbname].discard(session)
     if name:
         logger.info("logout for '%s' from '%s' on database '%s'",
             name, _get_remote_addr(context), dbname)
@@ -129,11 +139,28 @@ def check_timeout(dbname, user, session, context=None):
 
 
 def reset(dbname, session, context):
+    # The timestamp of a session is written at most once per reset_interval
+    # together with the other pending sessions
+    now = time.time()
+    with _resets_lock:
+        timestamps = _resets[dbname]
+        timestamp = timestamps.get(session)
+        if timestamp is not None and now - timestamp < _reset_interval:
+            return
+        for key, timestamp in list(timestamps.items()):
+            if now - timestamp >= _reset_interval:
+                del timestamps[key]
+        timestamps[session] = now
+        sessions = _resets_pending.pop(dbname, set())
+        sessions.add(session)
+
     DatabaseOperationalError = backend.get('DatabaseOperationalError')
     try:
         with Transaction().start(dbname, 0, context=context):
             pool = _get_pool(dbname)
             Session = pool.get('ir.session')
-            Session.reset(session)
+            Session.reset(list(sessions))
     except DatabaseOperationalError:
         logger.debug('Reset session failed', exc_info=True)
+        with _resets_lock:
+            _resets_pending[dbname].update(sessions)
@@ -0,0 +1,181 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"Preload the pools once and fork the processes sharing them"
+import gc
+import logging
+import os
+import signal
+import time
+
+from trytond import backend
+from trytond.cache import Cache
+from trytond.config import config, split_netloc
+from trytond.modules import warm_access
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+__all__ = ['preload', 'freeze', 'memory', 'report', 'serve']
+logger = logging.getLogger(__name__)
+# A worker dying sooner after its start is counted as a failure
+MIN_UPTIME = 10
+# The delay before spawning again a worker is multiplied by the failures
+RESPAWN_DELAY = 1
+# The workers are stopped after this number of consecutive failures
+MAX_FAILURES = 5
+
+
+def preload(database_names, warm=False):
+    """Initialize the pool of the databases in the current process
+    and return the duration in seconds.
+    The cache listeners are stopped and the connections are closed so they
+    are not shared with the forks."""
+    started = time.monotonic()
+    # Prevent the collections to split the pages before the fork
+    gc.disable()
+    try:
+        Pool.start()
+        for database_name in database_names:
+            pool = Pool(database_name)
+            pool.init()
+            if warm:
+                with Transaction().start(database_name, 0, readonly=True):
+                    warm_access(pool)
+        Database = backend.get('Database')
+        for database_name in database_names:
+            # The listener thread uses a connection of the database
+            Cache.stop_listener(database_name)
+            Database(database_name).close()
+    except Exception:
+        gc.enable()
+        raise
+    duration = time.monotonic() - started
+    logger.info('preload %s in %.1fs', ', '.join(database_names), duration)
+    return duration
+
+
+def freeze():
+    "Move the preloaded objects out of the reach of the garbage collector"
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    gc.enable()
+
+
+def memory(pid=None):
+    """Return the resident and the proportional set sizes in bytes of the
+    process or None if not available"""
+    if pid is None:
+        pid = os.getpid()
+    sizes = {}
+    for name in ['smaps_rollup', 'status']:
+        try:
+            with open('/proc/%s/%s' % (pid, name)) as fp:
+                for line in fp:
+                    key, _, value = line.partition(':')
+                    if key in {'Rss', 'VmRSS', 'Pss'}:
+                        sizes.setdefault(key.replace('VmRSS', 'Rss'),
+                            int(value.split()[0]) * 1024)
+        except (IOError, ValueError):
+            continue
+    if 'Rss' not in sizes:
+        return None
+    return sizes.get('Rss'), sizes.get('Pss')
+
+
+def report(pids):
+    "Log the memory used by the processes"
+    for pid in pids:
+        sizes = memory(pid)
+        if sizes is None:
+            continue
+        rss, pss = sizes
+        if pss is not None:
+            logger.info('process %d rss %.1fMB pss %.1fMB',
+                pid, rss / 2 ** 20, pss / 2 ** 20)
+        else:
+            logger.info('process %d rss %.1fMB', pid, rss / 2 ** 20)
+
+
+def serve(options, app):
+    """Serve the WSGI app with forked processes sharing the preloaded pools
+    and return the exit status"""
+    from werkzeug.serving import make_server
+
+    preload(options.database_names, warm=options.warm)
+    hostname, port = split_netloc(config.get('web', 'listen'))
+    certificate = config.get('ssl', 'certificate')
+    privatekey = config.get('ssl', 'privatekey')
+    if certificate or privatekey:
+        ssl_context = (certificate, privatekey)
+    else:
+        ssl_context = None
+    server = make_server(hostname, port, app,
+        threaded=True, ssl_context=ssl_context)
+    freeze()
+
+    children = {}
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid:
+            children[pid] = time.monotonic()
+            return
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        status = 1
+        try:
+            server.serve_forever()
+            status = 0
+        except Exception:
+            logger.exception('worker %d failed', os.getpid())
+        finally:
+            os._exit(status)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(
+        signal.SIGUSR1, lambda signum, frame: report(sorted(children)))
+
+    logger.info('start %d workers on %s:%s', options.workers, hostname, port)
+    for _ in range(options.workers):
+        spawn()
+    report([os.getpid()] + sorted(children))
+
+    failures = 0
+    exit_status = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        logger.warning('worker %d died with status %d', pid, status)
+        if time.monotonic() - started < MIN_UPTIME:
+            failures += 1
+            if failures >= MAX_FAILURES:
+                logger.critical(
+                    'workers failed %d times at start, stop', failures)
+                exit_status = 1
+                stop(signal.SIGTERM, None)
+                continue
+            time.sleep(RESPAWN_DELAY * failures)
+        else:
+            failures = 0
+        if not stopping:
+            spawn()
+    server.server_close()
+    return exit_status
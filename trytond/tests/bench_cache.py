@@ -0,0 +1,94 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""Benchmark the lookups of many keys by key and at once in the caches
+
+Usage::
+
+    DB_NAME=:memory: python -m trytond.tests.bench_cache [options]
+
+The best time of the repeats is reported for each cache class.
+The shared caches use the store of the `uri` option of the `cache` section
+(e.g. `--uri redis://localhost:6379/0`).
+"""
+import argparse
+import time
+
+from trytond.cache import MemoryCache, SharedCache, TwoTierCache
+from trytond.config import config
+from trytond.tests.test_tryton import activate_module, DB_NAME
+from trytond.transaction import Transaction
+
+CLASSES = {
+    'memory': MemoryCache,
+    'shared': SharedCache,
+    'two-tier': TwoTierCache,
+    }
+
+
+def best(func, repeat):
+    "Return the best duration in seconds of repeat calls to func"
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def bench(Cache, keys, repeat):
+    "Return the durations of setting and getting keys by key and at once"
+    cache = Cache('bench.%s' % Cache.__name__, size_limit=len(keys))
+    mapping = {k: {'id': k, 'name': 'Record %s' % k} for k in keys}
+
+    def set_():
+        for key, value in mapping.items():
+            cache.set(key, value)
+
+    def set_many():
+        cache.set_many(mapping)
+
+    def get():
+        for key in keys:
+            cache.get(key)
+
+    def get_many():
+        cache.get_many(keys)
+
+    results = []
+    for name, func in [
+            ('set', set_),
+            ('set_many', set_many),
+            ('get', get),
+            ('get_many', get_many),
+            ]:
+        results.append((name, best(func, repeat)))
+    assert cache.get_many(keys) == mapping
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=1000,
+        help="number of keys (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=20,
+        help="number of repeats (default: %(default)s)")
+    parser.add_argument('--uri', help="the URI of the shared store")
+    parser.add_argument('classes', nargs='*', choices=[[]] + list(CLASSES),
+        help="the cache classes (default: all)")
+    options = parser.parse_args()
+    if options.uri:
+        config.set('cache', 'uri', options.uri)
+
+    activate_module('ir')
+    keys = list(range(options.keys))
+    with Transaction().start(DB_NAME, 0):
+        for name in options.classes or list(CLASSES):
+            for method, duration in bench(
+                    CLASSES[name], keys, options.repeat):
+                print('%-8s %-8s %8.2fms %8.2fus/key' % (
+                        name, method, duration * 1000,
+                        duration * 10 ** 6 / len(keys)))
+
+
+if __name__ == '__main__':
+    main()
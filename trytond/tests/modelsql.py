@@ -49,6 +49,39 @@ class ModelSQLOne2ManyTarget(ModelSQL):
     origin = fields.Many2One('test.modelsql.one2many', "Origin")
 
 
+class ModelSQLCascade(ModelSQL):
+    "ModelSQL Cascade"
+    __name__ = 'test.modelsql.cascade'
+    lines = fields.One2Many(
+        'test.modelsql.cascade.line', 'parent', "Lines")
+
+
+class ModelSQLCascadeLine(ModelSQL):
+    "ModelSQL Cascade Line"
+    __name__ = 'test.modelsql.cascade.line'
+    _sql_cascade = True
+    parent = fields.Many2One(
+        'test.modelsql.cascade', "Parent", ondelete='CASCADE')
+    sublines = fields.One2Many(
+        'test.modelsql.cascade.subline', 'line', "Sub Lines")
+
+
+class ModelSQLCascadeSubLine(ModelSQL):
+    "ModelSQL Cascade Sub Line"
+    __name__ = 'test.modelsql.cascade.subline'
+    _sql_cascade = True
+    line = fields.Many2One(
+        'test.modelsql.cascade.line', "Line", ondelete='CASCADE')
+    link = fields.Many2One('test.modelsql.cascade.link', "Link")
+
+
+class ModelSQLCascadeLink(ModelSQL):
+    "ModelSQL Cascade Link"
+    __name__ = 'test.modelsql.cascade.link'
+    _sql_cascade = True
+    line = fields.Many2One('test.modelsql.cascade.line', "Line")
+
+
 class NullOrder(ModelSQL):
     "Null Order"
     __name__ = 'test.modelsql.null_order'
@@ -118,6 +151,10 @@ def register(module):
         ModelSQLFieldSet,
         ModelSQLOne2Many,
         ModelSQLOne2ManyTarget,
+        ModelSQLCascade,
+        ModelSQLCascadeLine,
+        ModelSQLCascadeSubLine,
+        ModelSQLCascadeLink,
         NullOrder,
         ModelTranslation,
         ModelCheck,
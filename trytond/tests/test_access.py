@@ -346,6 +346,60 @@ class ModelAccessTestCase(unittest.TestCase):
                 })
         TestAccess.delete([tests.pop()])
 
+    @with_transaction()
+    def test_groups_fingerprint(self):
+        'Test access shared by the users with the same groups'
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        User = pool.get('res.user')
+        Group = pool.get('res.group')
+
+        group, = Group.create([{'name': 'Test Access'}])
+        user1, user2 = User.create([{
+                    'name': 'User %s' % i,
+                    'login': 'user%s' % i,
+                    'groups': [('add', [group.id])],
+                    } for i in range(2)])
+
+        with Transaction().set_user(user1.id):
+            fingerprint = User.get_groups_fingerprint()
+            access = ModelAccess.get_access(['test.access'])
+        with Transaction().set_user(user2.id):
+            self.assertEqual(User.get_groups_fingerprint(), fingerprint)
+
+        self.assertEqual(fingerprint, (group.id,))
+        self.assertEqual(
+            ModelAccess._get_access_cache.get((fingerprint, 'test.access')),
+            access['test.access'])
+        self.assertIn(fingerprint, User.get_groups_fingerprints())
+
+    @with_transaction()
+    def test_read_cold_caches(self):
+        'Test read as a user with cold caches'
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        ModelFieldAccess = pool.get('ir.model.field.access')
+        Rule = pool.get('ir.rule')
+        User = pool.get('res.user')
+        Group = pool.get('res.group')
+
+        group, = Group.create([{'name': 'Test Access'}])
+        user, = User.create([{
+                    'name': 'User',
+                    'login': 'user',
+                    'groups': [('add', [group.id])],
+                    }])
+        for cache in [User._get_groups_cache, ModelAccess._get_access_cache,
+                ModelFieldAccess._get_access_cache, Rule._domain_get_cache,
+                Rule._get_rules_cache]:
+            cache.clear()
+
+        with Transaction().set_user(user.id):
+            self.assertEqual(list(User.get_groups()), [group.id])
+            record, = User.read([user.id], ['login'])
+
+        self.assertEqual(record['login'], 'user')
+
 
 class ModelFieldAccessTestCase(unittest.TestCase):
     'Test Model Field Access'
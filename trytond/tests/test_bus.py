@@ -1,5 +1,6 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import asyncio
 import time
 import unittest
 from unittest.mock import patch
@@ -72,6 +73,18 @@ class MessageQueueTestCase(unittest.TestCase):
 
         self.assertEqual(content, {'message_id': 10})
 
+    def test_get_next_channel_size(self):
+        "Testing get_next when the channel is full"
+        with patch('time.time', self._time):
+            mq = _MessageQueue(100, size=3)
+            for x in range(15):
+                mq.append('odd' if x % 2 else 'even', {'message_id': x})
+            channel, content = mq.get_next({'even'}, 2)
+            channel, next_content = mq.get_next({'even'}, 12)
+
+        self.assertEqual(content, {'message_id': 10})
+        self.assertEqual(next_content, {'message_id': 14})
+
 
 class BusTestCase(unittest.TestCase):
     "Test Bus"
@@ -114,6 +127,16 @@ class BusTestCase(unittest.TestCase):
 
         self.assertEqual(response, {'message': None, 'channel': None})
 
+    @unittest.skipIf(backend.name() == 'sqlite', 'SQLite has not channel')
+    def test_subscribe_async_nothing(self):
+        "Test subscribe_async with nothing"
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        response = loop.run_until_complete(
+            Bus.subscribe_async(DB_NAME, ['user:1']))
+
+        self.assertEqual(response, {'message': None, 'channel': None})
+
     @unittest.skipIf(backend.name() == 'sqlite', 'SQLite has not channel')
     def test_subscribe_message(self):
         "Test subscribe with message"
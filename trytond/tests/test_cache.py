@@ -1,9 +1,27 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
+import time
 import unittest
+from unittest.mock import patch
 
-from trytond.cache import freeze
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from trytond import backend
+from trytond.cache import (freeze, MemoryCache, MemoryStore, RedisStore,
+    SharedCache, ShardedLRUDict, TwoTierCache)
+from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.transaction import Transaction
+
+memory_cache = MemoryCache('test.memory_cache', context=False)
+shared_cache = SharedCache('test.shared_cache', context=False)
+shared_cache_context = SharedCache('test.shared_cache_context')
+two_tier_cache = TwoTierCache('test.two_tier_cache', context=False)
+two_tier_cache_duration = TwoTierCache(
+    'test.two_tier_cache_duration', context=False, duration=0.01)
 
 
 class CacheTestCase(unittest.TestCase):
@@ -32,9 +50,427 @@ class CacheTestCase(unittest.TestCase):
                                             ]))]))]))
 
 
+class ShardedLRUDictTestCase(unittest.TestCase):
+    "Test ShardedLRUDict"
+
+    def test_get_set(self):
+        "Test get and set"
+        cache = ShardedLRUDict(10, shards=4)
+        for i in range(10):
+            cache.set(i, str(i))
+
+        self.assertEqual([cache.get(i) for i in range(10)],
+            [str(i) for i in range(10)])
+        self.assertEqual(cache.get(10, 'default'), 'default')
+        self.assertEqual(len(cache), 10)
+
+    def test_size_limit(self):
+        "Test size limit evicts least recently used"
+        cache = ShardedLRUDict(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+
+        self.assertEqual(cache.set('c', 3), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_max_bytes(self):
+        "Test bytes limit"
+        cache = ShardedLRUDict(100, max_bytes=1000)
+        for i in range(100):
+            cache.set(i, 'x' * 100)
+
+        self.assertLessEqual(cache.bytes, 1000)
+        self.assertLess(len(cache), 100)
+        self.assertEqual(cache.get(99), 'x' * 100)
+
+    def test_unhashable(self):
+        "Test unhashable key"
+        cache = ShardedLRUDict(10)
+
+        with self.assertRaises(TypeError):
+            cache.set([], 1)
+
+    def test_get_many_set_many(self):
+        "Test get_many and set_many"
+        cache = ShardedLRUDict(10, shards=2)
+
+        self.assertEqual(
+            cache.set_many([(i, str(i)) for i in range(10)] + [([], 1)]),
+            (10, 0))
+        self.assertEqual(cache.get_many([0, 5, 10, []], 'default'),
+            ['0', '5', 'default', 'default'])
+        self.assertEqual(cache.set_many([(10, '10')]), (1, 1))
+        self.assertEqual(len(cache), 10)
+
+
+class MemoryStoreTestCase(unittest.TestCase):
+    "Test MemoryStore"
+
+    def setUp(self):
+        self.store = MemoryStore()
+
+    def test_get_set(self):
+        "Test get and set"
+        self.store.set('db:cache', 'key', b'value')
+
+        self.assertEqual(self.store.get('db:cache', 'key'), b'value')
+        self.assertEqual(self.store.get('db:cache', 'foo'), None)
+        self.assertEqual(self.store.get('db:other', 'key'), None)
+
+    def test_get_many_set_many(self):
+        "Test get_many and set_many"
+        self.assertEqual(self.store.set_many('db:cache', {
+                    'a': b'x' * 4,
+                    'b': b'x' * 6,
+                    'c': b'x' * 2,
+                    }, size_limit=2), 1)
+
+        self.assertEqual(self.store.get_many('db:cache', ['a', 'b', 'c']),
+            [None, b'x' * 6, b'x' * 2])
+        self.assertEqual(self.store.get_many('db:other', ['a']), [None])
+        self.assertEqual(self.store.size('db:cache'), (2, 8))
+
+    def test_duration(self):
+        "Test entry expiration"
+        self.store.set('db:cache', 'key', b'value', duration=0.01)
+        time.sleep(0.02)
+
+        self.assertEqual(self.store.get('db:cache', 'key'), None)
+        self.assertEqual(self.store.size('db:cache'), (0, 0))
+
+    def test_size_limit(self):
+        "Test size limit evicts least recently used"
+        for key in ['a', 'b', 'c']:
+            self.store.set('db:cache', key, b'value', size_limit=2)
+
+        self.assertEqual(self.store.get('db:cache', 'a'), None)
+        self.assertEqual(self.store.size('db:cache'), (2, 10))
+
+    def test_max_bytes(self):
+        "Test bytes limit"
+        self.store.set('db:cache', 'a', b'x' * 6, max_bytes=10)
+        self.store.set('db:cache', 'b', b'x' * 4, max_bytes=10)
+        self.store.get('db:cache', 'a')
+        self.store.set('db:cache', 'c', b'x' * 4, max_bytes=10)
+
+        self.assertEqual(self.store.get('db:cache', 'b'), None)
+        self.assertEqual(self.store.size('db:cache'), (2, 10))
+
+    def test_clear(self):
+        "Test clear namespace"
+        self.store.set('db:cache', 'key', b'value')
+        self.store.set('db:other', 'key', b'value')
+        self.store.clear('db:cache')
+
+        self.assertEqual(self.store.get('db:cache', 'key'), None)
+        self.assertEqual(self.store.get('db:other', 'key'), b'value')
+
+    def test_generations(self):
+        "Test generation counters"
+        self.assertEqual(
+            self.store.generations(['db:cache', 'db:other']), [0, 0])
+        self.assertEqual(self.store.incr(['db:cache']), [1])
+        self.assertEqual(
+            self.store.generations(['db:cache', 'db:other']), [1, 0])
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is missing")
+class RedisStoreTestCase(MemoryStoreTestCase):
+    "Test RedisStore"
+
+    def setUp(self):
+        with patch('redis.Redis.from_url',
+                return_value=fakeredis.FakeRedis()):
+            self.store = RedisStore('redis://')
+
+    def test_size_limit_expired(self):
+        "Test expired entries are pruned before evicting"
+        self.store.set('db:cache', 'a', b'value')
+        self.store.set('db:cache', 'b', b'value', duration=0.01)
+        time.sleep(0.02)
+
+        self.assertEqual(
+            self.store.set('db:cache', 'c', b'value', size_limit=2), 0)
+        self.assertEqual(self.store.get_many('db:cache', ['a', 'c']),
+            [b'value', b'value'])
+        self.assertEqual(self.store.size('db:cache'), (2, 10))
+
+    def test_replace(self):
+        "Test replace entry updates the bytes"
+        self.store.set('db:cache', 'a', b'x' * 6)
+        self.store.set('db:cache', 'a', b'x' * 4)
+
+        self.assertEqual(self.store.size('db:cache'), (1, 4))
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+    "Test MemoryCache"
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    @with_transaction()
+    def test_get_set(self):
+        "Test get and set"
+        memory_cache.set('foo', 'bar')
+
+        self.assertEqual(memory_cache.get('foo'), 'bar')
+
+    @with_transaction()
+    def test_replica_after_invalidation(self):
+        "Test values read from a replica are not set after an invalidation"
+        memory_cache.clear()
+
+        with patch.object(Transaction(), 'replica', True):
+            memory_cache.set('foo', 'bar')
+            memory_cache.set_many({'bar': 'foo'})
+        self.assertIsNone(memory_cache.get('foo'))
+        self.assertIsNone(memory_cache.get('bar'))
+
+        memory_cache.set('foo', 'bar')
+        self.assertEqual(memory_cache.get('foo'), 'bar')
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    "Test SharedCache"
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def setUp(self):
+        self.store = MemoryStore()
+        store_patcher = patch.object(SharedCache, '_store', self.store)
+        store_patcher.start()
+        self.addCleanup(store_patcher.stop)
+        for cache in [shared_cache, shared_cache_context]:
+            cache._stats.clear()
+
+    @with_transaction()
+    def test_get_set(self):
+        "Test get and set"
+        dbname = Transaction().database.name
+
+        self.assertEqual(shared_cache.set('foo', 'bar'), 'bar')
+        self.assertEqual(shared_cache.get('foo'), 'bar')
+        self.assertEqual(shared_cache.get('bar', 'default'), 'default')
+        self.assertEqual(
+            self.store.size(shared_cache._namespace(dbname))[0], 1)
+        stats = shared_cache.stats(dbname)
+        self.assertEqual(
+            (stats['sets'], stats['hits'], stats['misses'], stats['size']),
+            (1, 1, 1, 1))
+
+    @with_transaction()
+    def test_get_many_set_many(self):
+        "Test get_many and set_many"
+        shared_cache.set_many({'foo': 1, 'bar': [2]})
+
+        self.assertEqual(shared_cache.get_many(['foo', 'bar', 'baz'], 0),
+            {'foo': 1, 'bar': [2], 'baz': 0})
+
+    @with_transaction()
+    def test_unpicklable(self):
+        "Test unpicklable values are not stored"
+        dbname = Transaction().database.name
+        value = lambda: None  # noqa: E731
+
+        self.assertIs(shared_cache.set('foo', value), value)
+        shared_cache.set_many({'bar': value, 'baz': 1})
+
+        self.assertEqual(shared_cache.get_many(['foo', 'bar', 'baz']),
+            {'foo': None, 'bar': None, 'baz': 1})
+        self.assertEqual(shared_cache.stats(dbname)['sets'], 1)
+
+    @with_transaction()
+    def test_context(self):
+        "Test the values are stored per user and context"
+        shared_cache_context.set('foo', 'bar')
+
+        self.assertEqual(shared_cache_context.get('foo'), 'bar')
+        with Transaction().set_context(test=True):
+            self.assertIsNone(shared_cache_context.get('foo'))
+        with Transaction().set_user(0):
+            self.assertIsNone(shared_cache_context.get('foo'))
+
+    @with_transaction()
+    def test_clear(self):
+        "Test clear the store"
+        dbname = Transaction().database.name
+        shared_cache.set('foo', 'bar')
+        shared_cache_context.set('foo', 'bar')
+
+        shared_cache.clear()
+
+        self.assertIsNone(shared_cache.get('foo'))
+        self.assertEqual(shared_cache_context.get('foo'), 'bar')
+        self.assertEqual(shared_cache.stats(dbname)['invalidations'], 1)
+
+    @with_transaction()
+    def test_received(self):
+        "Test the names received from the channel are cleared"
+        dbname = Transaction().database.name
+        shared_cache.set('foo', 'bar')
+        shared_cache_context.set('foo', 'bar')
+
+        SharedCache._received(dbname, [shared_cache._name])
+
+        self.assertIsNone(shared_cache.get('foo'))
+        self.assertEqual(shared_cache_context.get('foo'), 'bar')
+
+    @with_transaction()
+    def test_replica_after_invalidation(self):
+        "Test values read from a replica are not set after an invalidation"
+        shared_cache.clear()
+
+        with patch.object(Transaction(), 'replica', True):
+            shared_cache.set('foo', 'bar')
+            shared_cache.set_many({'bar': 'foo'})
+        self.assertEqual(shared_cache.get_many(['foo', 'bar']),
+            {'foo': None, 'bar': None})
+
+
+class TwoTierCacheTestCase(unittest.TestCase):
+    "Test TwoTierCache"
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def setUp(self):
+        # A store shared like Redis but kept in the process
+        self.store = MemoryStore()
+        self.store.shared = True
+        store_patcher = patch.object(TwoTierCache, '_store', self.store)
+        store_patcher.start()
+        self.addCleanup(store_patcher.stop)
+        for cache in [two_tier_cache, two_tier_cache_duration]:
+            cache._cache.clear()
+            cache._generations.clear()
+            cache._stats.clear()
+
+    @with_transaction()
+    def test_local_hit(self):
+        "Test get from the local tier"
+        dbname = Transaction().database.name
+        two_tier_cache.set('foo', 'bar')
+        self.store.clear(two_tier_cache._namespace(dbname))
+
+        self.assertEqual(two_tier_cache.get('foo'), 'bar')
+        self.assertEqual(two_tier_cache.get_many(['foo']), {'foo': 'bar'})
+        self.assertEqual(two_tier_cache.stats(dbname)['hits'], 2)
+
+    @with_transaction()
+    def test_store_fallback(self):
+        "Test get from the store when missing in the local tier"
+        dbname = Transaction().database.name
+        two_tier_cache.set('foo', 'bar')
+        two_tier_cache.set('bar', 'foo')
+        # As a worker which did not set the values
+        two_tier_cache._cache.clear()
+
+        self.assertEqual(two_tier_cache.get('foo'), 'bar')
+        self.assertEqual(
+            two_tier_cache.get_many(['bar', 'baz'], 'default'),
+            {'bar': 'foo', 'baz': 'default'})
+        stats = two_tier_cache.stats(dbname)
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+        # The values fetched are kept in the local tier
+        self.store.clear(two_tier_cache._namespace(dbname))
+        self.assertEqual(two_tier_cache.get('foo'), 'bar')
+        self.assertEqual(two_tier_cache.get('bar'), 'foo')
+
+    @with_transaction()
+    def test_reset_generation(self):
+        "Test reset increments the generation"
+        dbname = Transaction().database.name
+        namespace = two_tier_cache._namespace(dbname)
+        two_tier_cache.set('foo', 'bar')
+
+        two_tier_cache.clear()
+        TwoTierCache.resets(dbname)
+
+        self.assertEqual(self.store.generations([namespace]), [1])
+        self.assertIsNone(two_tier_cache.get('foo'))
+        # The entry of the previous generation is not cleared from the store
+        self.assertEqual(self.store.size(namespace)[0], 1)
+
+        two_tier_cache.set('foo', 'baz')
+        self.assertEqual(two_tier_cache.get('foo'), 'baz')
+
+    @with_transaction()
+    def test_clean_generation(self):
+        "Test clean without channel fetches the generation"
+        transaction = Transaction()
+        dbname = transaction.database.name
+        two_tier_cache.set('foo', 'bar')
+        # As a reset from an other worker
+        self.store.incr([two_tier_cache._namespace(dbname)])
+
+        self.assertEqual(two_tier_cache.get('foo'), 'bar')
+
+        with patch.object(
+                transaction.database, 'has_channel', return_value=False):
+            TwoTierCache.clean(dbname)
+
+        self.assertIsNone(two_tier_cache.get('foo'))
+
+    @unittest.skipIf(backend.name() == 'sqlite', 'SQLite has not channel')
+    @with_transaction()
+    def test_notify_generation(self):
+        "Test the generation received from the channel"
+        dbname = Transaction().database.name
+        self.addCleanup(TwoTierCache.stop_listener, dbname)
+
+        TwoTierCache.clean(dbname)
+        # The listener clears the caches once it listens
+        self.assertTrue(self._wait(
+                lambda: two_tier_cache.stats(dbname)['invalidations']))
+        two_tier_cache.set('foo', 'bar')
+
+        # As a reset from an other worker
+        generation, = self.store.incr([two_tier_cache._namespace(dbname)])
+        TwoTierCache._notify([{two_tier_cache._name: generation}])
+
+        self.assertTrue(self._wait(
+                lambda: two_tier_cache.get('foo') is None))
+
+    @staticmethod
+    def _wait(condition, timeout=5):
+        end = time.time() + timeout
+        while not condition():
+            if time.time() > end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    @with_transaction()
+    def test_duration(self):
+        "Test entry expiration"
+        dbname = Transaction().database.name
+        two_tier_cache_duration.set('foo', 'bar')
+        two_tier_cache_duration.set_many({'bar': 'foo'})
+
+        self.assertEqual(two_tier_cache_duration.get('foo'), 'bar')
+
+        time.sleep(0.02)
+
+        self.assertIsNone(two_tier_cache_duration.get('foo'))
+        self.assertEqual(
+            two_tier_cache_duration.get_many(['bar']), {'bar': None})
+        self.assertEqual(
+            two_tier_cache_duration.size(dbname), (0, 0))
+
+
 def suite():
     func = unittest.TestLoader().loadTestsFromTestCase
     suite = unittest.TestSuite()
-    for testcase in (CacheTestCase,):
+    for testcase in (CacheTestCase, ShardedLRUDictTestCase,
+            MemoryStoreTestCase, RedisStoreTestCase, MemoryCacheTestCase,
+            SharedCacheTestCase, TwoTierCacheTestCase):
         suite.addTests(func(testcase))
     return suite
@@ -0,0 +1,203 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import threading
+import time
+import unittest
+from unittest.mock import ANY, Mock, patch
+
+try:
+    from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+        TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_UNKNOWN)
+    from psycopg2.pool import PoolError
+    from trytond.backend.postgresql.database import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+
+def _connect(**params):
+    conn = Mock(closed=False)
+    conn.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+
+    def close():
+        conn.closed = True
+    conn.close.side_effect = close
+    return conn
+
+
+@unittest.skipIf(ConnectionPool is None, "psycopg2 is missing")
+class ConnectionPoolTestCase(unittest.TestCase):
+    "Test ConnectionPool"
+
+    def setUp(self):
+        connect_patcher = patch(
+            'trytond.backend.postgresql.database.connect',
+            side_effect=_connect)
+        self.connect = connect_patcher.start()
+        self.addCleanup(connect_patcher.stop)
+
+    def _wait_waiting(self, pool, count, timeout=5):
+        end = time.time() + timeout
+        while pool.stats()['waiting'] != count:
+            if time.time() > end:
+                self.fail("%s waiters expected" % count)
+            time.sleep(0.001)
+
+    def test_getconn_putconn(self):
+        "Test get and put connection"
+        pool = ConnectionPool(1, 2, dbname='test')
+
+        conn = pool.getconn()
+        other = pool.getconn()
+
+        self.assertEqual(self.connect.call_count, 2)
+        self.connect.assert_called_with(dbname='test')
+        self.assertTrue(pool.owns(conn))
+        self.assertEqual(pool.stats()['in_use'], 2)
+
+        pool.putconn(conn)
+        pool.putconn(other)
+
+        self.assertFalse(pool.owns(conn))
+        self.assertEqual(
+            (pool.stats()['in_use'], pool.stats()['idle']), (0, 2))
+        self.assertIs(pool.getconn(), other)
+
+    def test_putconn_transaction(self):
+        "Test put connection with a pending transaction"
+        pool = ConnectionPool(0, 2)
+        conn = pool.getconn()
+        unknown = pool.getconn()
+        conn.get_transaction_status.return_value = TRANSACTION_STATUS_INTRANS
+        unknown.get_transaction_status.return_value = (
+            TRANSACTION_STATUS_UNKNOWN)
+
+        pool.putconn(conn)
+        pool.putconn(unknown)
+
+        conn.rollback.assert_called_once_with()
+        self.assertFalse(conn.closed)
+        self.assertTrue(unknown.closed)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_waiters_order(self):
+        "Test the waiters are served in order"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+        served = []
+
+        def wait(name):
+            waiter_conn = pool.getconn(timeout=5)
+            served.append((name, waiter_conn))
+            pool.putconn(waiter_conn)
+
+        threads = []
+        for i, name in enumerate(['first', 'second']):
+            thread = threading.Thread(target=wait, args=(name,))
+            thread.start()
+            threads.append(thread)
+            self._wait_waiting(pool, i + 1)
+        pool.putconn(conn)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(served, [('first', conn), ('second', conn)])
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_waiter_closed(self):
+        "Test the waiter opens a connection when the given one is closed"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+        served = []
+
+        thread = threading.Thread(
+            target=lambda: served.append(pool.getconn(timeout=5)))
+        thread.start()
+        self._wait_waiting(pool, 1)
+        pool.putconn(conn, close=True)
+        thread.join()
+
+        new_conn, = served
+        self.assertIsNot(new_conn, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_timeout(self):
+        "Test timeout waiting a connection"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+
+        with self.assertRaises(PoolError):
+            pool.getconn(timeout=0.01)
+
+        self.assertEqual(pool.stats()['waiting'], 0)
+        pool.putconn(conn)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_configure(self):
+        "Test the session is set only when it changes"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+
+        pool.configure(conn, readonly=True)
+        pool.configure(conn, readonly=True)
+        self.assertEqual(conn.set_session.call_count, 1)
+
+        pool.configure(conn, autocommit=True)
+        self.assertEqual(conn.set_session.call_count, 2)
+        conn.set_session.assert_called_with(isolation_level=ANY,
+            readonly=False, autocommit=True)
+
+    def test_configure_closed(self):
+        "Test the session state is forgotten with the closed connection"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+        pool.configure(conn, readonly=True)
+
+        pool.putconn(conn, close=True)
+
+        self.assertEqual(pool._states, {})
+
+    def test_stats(self):
+        "Test the wait histogram"
+        pool = ConnectionPool(0, 1)
+        conn = pool.getconn()
+
+        thread = threading.Thread(
+            target=lambda: pool.putconn(pool.getconn(timeout=5)))
+        thread.start()
+        self._wait_waiting(pool, 1)
+        time.sleep(0.02)
+        pool.putconn(conn)
+        thread.join()
+
+        stats = pool.stats()
+        self.assertEqual(stats['wait_count'], 2)
+        self.assertGreaterEqual(stats['wait_time'], 0.02)
+        self.assertEqual(stats['wait_histogram'], {
+                '0.001': 1,
+                '0.01': 1,
+                '0.1': 2,
+                '1': 2,
+                '10': 2,
+                'inf': 2,
+                })
+
+    def test_closeall(self):
+        "Test close all the connections"
+        pool = ConnectionPool(1, 2)
+        conn = pool.getconn()
+        other = pool.getconn()
+        pool.putconn(other)
+
+        pool.closeall()
+
+        self.assertTrue(conn.closed)
+        self.assertTrue(other.closed)
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(
+        ConnectionPoolTestCase)
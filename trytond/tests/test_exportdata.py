@@ -4,8 +4,10 @@
 import unittest
 from decimal import Decimal
 import datetime
+from unittest.mock import patch
 from trytond.tests.test_tryton import activate_module, with_transaction
 from trytond.pool import Pool
+from trytond.transaction import Transaction
 
 
 class ExportDataTestCase(unittest.TestCase):
@@ -360,6 +362,107 @@ class ExportDataTestCase(unittest.TestCase):
             ExportData.export_data([export1], ['reference.translated']),
             [["Target"]])
 
+    @with_transaction()
+    def test_export_data_iter(self):
+        'Test export_data_iter'
+        pool = Pool()
+        ExportData = pool.get('test.export_data')
+        ExportDataTarget = pool.get('test.export_data.target')
+
+        target, = ExportDataTarget.create([{
+                    'name': 'Target',
+                    }])
+        exports = ExportData.create([{
+                    'char': 'Export %s' % i,
+                    'many2one': target.id,
+                    'one2many': [('create', [
+                                {'name': 'Line %s.1' % i},
+                                {'name': 'Line %s.2' % i},
+                                ])],
+                    } for i in range(3)])
+        fields_names = ['char', 'many2one/name', 'one2many/name']
+
+        rows = ExportData.export_data_iter(
+            exports, fields_names, batch_size=2)
+
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(list(rows), [
+                ['Export 0', 'Target', 'Line 0.1'],
+                ['', '', 'Line 0.2'],
+                ['Export 1', 'Target', 'Line 1.1'],
+                ['', '', 'Line 1.2'],
+                ['Export 2', 'Target', 'Line 2.1'],
+                ['', '', 'Line 2.2'],
+                ])
+        self.assertEqual(
+            ExportData.export_data(exports, fields_names),
+            list(ExportData.export_data_iter(exports, fields_names)))
+
+    @with_transaction()
+    def test_export_data_iter_queries(self):
+        "Test export_data_iter reads each batch at once"
+        pool = Pool()
+        ExportData = pool.get('test.export_data')
+        ExportDataTarget = pool.get('test.export_data.target')
+
+        target, = ExportDataTarget.create([{
+                    'name': 'Target',
+                    }])
+        exports = ExportData.create([{
+                    'char': 'Export %s' % i,
+                    'many2one': target.id,
+                    'one2many': [('create', [
+                                {'name': 'Line %s.1' % i},
+                                {'name': 'Line %s.2' % i},
+                                ])],
+                    } for i in range(3)])
+        fields_names = ['char', 'many2one/name', 'one2many/name']
+        Transaction().cache.clear()
+        exports = ExportData.browse(exports)
+
+        with patch.object(ExportData, 'read', wraps=ExportData.read) as read, \
+                patch.object(ExportDataTarget, 'read',
+                    wraps=ExportDataTarget.read) as target_read:
+            rows = list(ExportData.export_data_iter(
+                    exports, fields_names, batch_size=2))
+
+        self.assertEqual(len(rows), 6)
+        # The char, the many2one and the one2many of each batch
+        self.assertEqual([len(c[0][0]) for c in read.call_args_list],
+            [2, 2, 2, 1, 1, 1])
+        # The target is kept in the transaction cache for the second batch
+        self.assertEqual([c[0][0] for c in target_read.call_args_list],
+            [[target.id]])
+
+    @with_transaction()
+    def test_export_data_iter_context(self):
+        "Test export_data_iter keeps the context of the records"
+        pool = Pool()
+        ExportData = pool.get('test.export_data')
+        transaction = Transaction()
+
+        exports = ExportData.create([{
+                    'char': 'Export %s' % i,
+                    } for i in range(3)])
+        with transaction.set_context(language='fr'):
+            exports = ExportData.browse(exports)
+        transaction.cache.clear()
+        languages = []
+        read = ExportData.read
+
+        def context_read(*args, **kwargs):
+            languages.append(Transaction().context.get('language'))
+            return read(*args, **kwargs)
+
+        with patch.object(ExportData, 'read', side_effect=context_read):
+            rows = list(ExportData.export_data_iter(
+                    exports, ['char'], batch_size=2))
+
+        self.assertEqual(rows, [['Export 0'], ['Export 1'], ['Export 2']])
+        self.assertEqual(languages, ['fr', 'fr'])
+        self.assertIn('char', exports[0]._cache[exports[0].id])
+        self.assertNotIn(ExportData.__name__, transaction.get_cache())
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(ExportDataTestCase)
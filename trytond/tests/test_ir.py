@@ -3,10 +3,13 @@
 from dateutil.relativedelta import relativedelta
 import datetime
 import unittest
+from unittest.mock import patch
 
+from trytond.cache import Cache
 from trytond.pool import Pool
 from trytond.transaction import Transaction
 from trytond.exceptions import UserError
+from trytond.ir import session
 from .test_tryton import ModuleTestCase, with_transaction
 
 
@@ -158,6 +161,148 @@ class IrTestCase(ModuleTestCase):
                 lang.strftime(datetime.date(*date), format_),
                 result)
 
+    @with_transaction()
+    def test_session_check_cache(self):
+        "Test Session.check uses the cache until deletion"
+        pool = Pool()
+        Session = pool.get('ir.session')
+        user = Transaction().user
+
+        key = Session.new()
+        self.assertTrue(Session.check(user, key))
+        self.assertIsNotNone(Session._check_cache.get((user, key)))
+
+        Session.remove(key)
+        self.assertIsNone(Session._check_cache.get((user, key)))
+        self.assertIsNone(Session.check(user, key))
+
+    @with_transaction()
+    def test_session_check_other_cache(self):
+        "Test Session.check of a deleted session from another cache"
+        pool = Pool()
+        Session = pool.get('ir.session')
+        user = Transaction().user
+        other_cache = Cache('ir_session.check.other', context=False)
+
+        key = Session.new()
+        with patch.object(Session, '_check_cache', other_cache):
+            self.assertTrue(Session.check(user, key))
+        expire = other_cache.get((user, key))
+        self.assertLessEqual(
+            expire - datetime.datetime.now(),
+            datetime.timedelta(seconds=session._check_interval))
+
+        Session.remove(key)
+        self.assertIsNotNone(other_cache.get((user, key)))
+        with patch.object(Session, '_check_cache', other_cache):
+            # Once the entry of the other cache is expired
+            other_cache.set((user, key), datetime.datetime.now())
+            self.assertIsNone(Session.check(user, key))
+
+    @with_transaction()
+    def test_session_check_deleting(self):
+        "Test Session.check does not cache a session being deleted"
+        pool = Pool()
+        Session = pool.get('ir.session')
+        user = Transaction().user
+
+        key = Session.new()
+        Session._check_deleting.add(key)
+        try:
+            self.assertTrue(Session.check(user, key))
+            self.assertIsNone(Session._check_cache.get((user, key)))
+        finally:
+            Session._check_deleting.discard(key)
+
+    @with_transaction()
+    def test_session_reset_keys(self):
+        "Test Session.reset with a list of keys"
+        pool = Pool()
+        Session = pool.get('ir.session')
+
+        key = Session.new()
+        session, = Session.search([('key', '=', key)])
+        Session.reset([key])
+        session = Session(session.id)
+
+        self.assertIsNotNone(session.write_date)
+
+    @with_transaction()
+    def test_translation_get_ids(self):
+        "Test Translation.get_ids by id ranges"
+        pool = Pool()
+        Translation = pool.get('ir.translation')
+        Menu = pool.get('ir.ui.menu')
+        name = 'ir.ui.menu,name'
+
+        menu1, menu2 = Menu.search([], limit=2)
+        Translation.create([{
+                    'name': name,
+                    'res_id': menu1.id,
+                    'lang': 'fr',
+                    'type': 'model',
+                    'src': menu1.name,
+                    'value': "Menu 1",
+                    }])
+        ids = [menu1.id, menu2.id]
+
+        self.assertEqual(Translation.get_ids(name, 'model', 'fr', ids), {
+                menu1.id: "Menu 1",
+                menu2.id: None,
+                })
+        self.assertEqual(Translation.get_ids(name, 'model', 'fr', ids), {
+                menu1.id: "Menu 1",
+                menu2.id: None,
+                })
+
+        Translation.set_ids(name, 'model', 'fr', [menu2.id], ["Menu 2"])
+        self.assertEqual(Translation.get_ids(name, 'model', 'fr', ids), {
+                menu1.id: "Menu 1",
+                menu2.id: "Menu 2",
+                })
+
+    @with_transaction()
+    def test_translation_get_ids_parent_fuzzy(self):
+        "Test Translation.get_ids with parent language and fuzzy translation"
+        pool = Pool()
+        Translation = pool.get('ir.translation')
+        Menu = pool.get('ir.ui.menu')
+        name = 'ir.ui.menu,name'
+
+        menu1, menu2 = Menu.search([], limit=2)
+        Translation.create([{
+                    'name': name,
+                    'res_id': menu1.id,
+                    'lang': 'fr',
+                    'type': 'model',
+                    'src': menu1.name,
+                    'value': "Menu 1",
+                    }, {
+                    'name': name,
+                    'res_id': menu2.id,
+                    'lang': 'fr',
+                    'type': 'model',
+                    'src': menu2.name,
+                    'value': "Menu 2",
+                    'fuzzy': True,
+                    }])
+        ids = [menu1.id, menu2.id]
+
+        self.assertEqual(Translation.get_ids(name, 'model', 'fr_CA', ids), {
+                menu1.id: "Menu 1",
+                menu2.id: None,
+                })
+        with Transaction().set_context(fuzzy_translation=True):
+            self.assertEqual(
+                Translation.get_ids(name, 'model', 'fr_CA', ids), {
+                    menu1.id: "Menu 1",
+                    menu2.id: "Menu 2",
+                    })
+        self.assertEqual(Translation.get_ids(name, 'model', 'fr_CA', ids), {
+                menu1.id: "Menu 1",
+                menu2.id: None,
+                })
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(IrTestCase)
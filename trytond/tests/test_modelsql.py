@@ -2,10 +2,14 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of this
 # repository contains the full copyright notices and license terms.
 
+import datetime
 import unittest
 import time
+from decimal import Decimal
 from unittest.mock import patch, call
 
+from sql.functions import CurrentTimestamp
+
 from trytond import backend
 from trytond.exceptions import UserError, ConcurrencyException
 from trytond.transaction import Transaction
@@ -178,6 +182,187 @@ class ModelSQLTestCase(unittest.TestCase):
         delete_ids.assert_called_with(
             'test.modelsql.translation', 'model', [record.id])
 
+    @with_transaction()
+    def test_pool_foreign_keys(self):
+        "Test the foreign keys indexed by the pool"
+        pool = Pool()
+        Target = pool.get('test.modelsql.one2many.target')
+
+        self.assertEqual(
+            pool.get_foreign_keys('test.modelsql.one2many'),
+            [(Target, 'origin')])
+
+    @with_transaction()
+    def test_delete_one2many_target(self):
+        "Test delete of a record referenced by a Many2One"
+        pool = Pool()
+        Origin = pool.get('test.modelsql.one2many')
+        Target = pool.get('test.modelsql.one2many.target')
+        origin, = Origin.create([{
+                    'targets': [('create', [{'name': "Target"}])],
+                    }])
+        target, = origin.targets
+
+        Origin.delete([origin])
+
+        self.assertEqual(Target.search([('id', '=', target.id)]), [target])
+        self.assertEqual(Target(target.id).origin, None)
+
+    @with_transaction()
+    def test_delete_sql_cascade(self):
+        "Test delete with set-based cascade"
+        pool = Pool()
+        Parent = pool.get('test.modelsql.cascade')
+        Line = pool.get('test.modelsql.cascade.line')
+        SubLine = pool.get('test.modelsql.cascade.subline')
+        Link = pool.get('test.modelsql.cascade.link')
+        parent, = Parent.create([{
+                    'lines': [('create', [{
+                                    'sublines': [('create', [{}, {}])],
+                                    }])],
+                    }])
+        line, = parent.lines
+        link, = Link.create([{'line': line.id}])
+        self.assertTrue(Line._sql_cascade_eligible('delete'))
+        self.assertTrue(Link._sql_cascade_eligible('write'))
+
+        Parent.delete([parent])
+
+        self.assertEqual(Line.search([]), [])
+        self.assertEqual(SubLine.search([]), [])
+        self.assertEqual(Link(link.id).line, None)
+
+    @with_transaction()
+    def test_delete_sql_cascade_deleted(self):
+        "Test set-based cascade skipping records being deleted"
+        pool = Pool()
+        Parent = pool.get('test.modelsql.cascade')
+        Line = pool.get('test.modelsql.cascade.line')
+        SubLine = pool.get('test.modelsql.cascade.subline')
+        transaction = Transaction()
+        parent, = Parent.create([{
+                    'lines': [('create', [{
+                                    'sublines': [('create', [{}])],
+                                    }] * 4)],
+                    }])
+        line_ids = {line.id for line in parent.lines}
+        deleting = parent.lines[0]
+        transaction.delete[Line.__name__] = {deleting.id}
+
+        with patch.object(transaction.database, 'IN_MAX', 1):
+            Parent.delete([parent])
+
+        self.assertEqual(
+            SubLine.search([('line', '!=', deleting.id)]), [])
+        self.assertEqual(transaction.delete[Line.__name__], line_ids)
+
+    @with_transaction()
+    def test_delete_clean_language_cache(self):
+        "Test delete cleans the transaction cache per language"
+        pool = Pool()
+        Parent = pool.get('test.modelsql.cascade')
+        Line = pool.get('test.modelsql.cascade.line')
+        transaction = Transaction()
+        parent, = Parent.create([{
+                    'lines': [('create', [{}])],
+                    }])
+        line, = parent.lines
+        cache = transaction.get_cache()
+        cache['_language_cache'] = {
+            'fr': {Line.__name__: {line.id: {}}},
+            }
+
+        Parent.delete([parent])
+
+        self.assertNotIn(
+            line.id, cache['_language_cache']['fr'][Line.__name__])
+
+    @with_transaction()
+    def test_sql_cascade_eligible(self):
+        "Test models not eligible to set-based cascade"
+        pool = Pool()
+        Parent = pool.get('test.modelsql.cascade')
+        Target = pool.get('test.modelsql.one2many.target')
+
+        self.assertFalse(Parent._sql_cascade_eligible('delete'))
+        self.assertFalse(Target._sql_cascade_eligible('write'))
+
+    @with_transaction()
+    def test_create_mixed_columns(self):
+        "Test create with different fields per record"
+        pool = Pool()
+        Origin = pool.get('test.modelsql.one2many')
+        Target = pool.get('test.modelsql.one2many.target')
+        origin, = Origin.create([{}])
+
+        targets = Target.create([
+                {'name': "Foo"},
+                {'name': "Bar", 'origin': origin.id},
+                {'name': "Baz"},
+                ])
+
+        self.assertEqual(len({t.id for t in targets}), 3)
+        self.assertEqual([t.name for t in targets], ["Foo", "Bar", "Baz"])
+        self.assertEqual(
+            [t.origin for t in targets], [None, origin, None])
+
+    @with_transaction()
+    def test_create_mixed_columns_default(self):
+        "Test create with different fields keeps the column default"
+        pool = Pool()
+        Boolean = pool.get('test.boolean')
+        table = Boolean.__table__()
+        cursor = Transaction().connection.cursor()
+
+        # Without Python default, the column default of the database is used
+        with patch.object(Boolean, 'default_get', return_value={}):
+            single, = Boolean.create([{}])
+            mixed, _ = Boolean.create([{}, {'boolean': True}])
+
+        cursor.execute(*table.select(table.id, table.boolean,
+                where=table.id.in_([single.id, mixed.id])))
+        values = dict(cursor.fetchall())
+        self.assertEqual(values[mixed.id], values[single.id])
+        if backend.name() != 'sqlite':
+            self.assertIs(values[mixed.id], False)
+
+    @with_transaction()
+    def test_write_grouped(self):
+        "Test write of many pairs of records and values"
+        pool = Pool()
+        Origin = pool.get('test.modelsql.one2many')
+        Target = pool.get('test.modelsql.one2many.target')
+        origin, = Origin.create([{}])
+        foo, bar, baz = Target.create([
+                {'name': "Foo"}, {'name': "Bar"}, {'name': "Baz"}])
+
+        Target.write(
+            [foo], {'name': "Foo 2"},
+            [bar], {'name': "Bar 2"},
+            [baz], {'name': "Baz 2", 'origin': origin.id},
+            [foo], {'name': "Foo 3", 'origin': origin.id},
+            [bar], {'name': "Bar 3"})
+
+        self.assertEqual(
+            [(t.name, t.origin) for t in Target.browse([foo, bar, baz])],
+            [("Foo 3", origin), ("Bar 3", None), ("Baz 2", origin)])
+
+    @with_transaction()
+    def test_search_iter(self):
+        "Test search_iter"
+        pool = Pool()
+        Target = pool.get('test.modelsql.one2many.target')
+        targets = Target.create([{'name': str(i)} for i in range(5)])
+
+        batches = list(Target.search_iter(
+                [('id', 'in', [t.id for t in targets])],
+                order=[('id', 'DESC')], batch_size=2))
+
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(sum(batches, []), targets[::-1])
+        self.assertEqual(batches[0][0].name, '4')
+        self.assertIs(batches[0][0]._local_cache, batches[2][0]._local_cache)
+
     @with_transaction()
     def test_constraint_check(self):
         "Test check constraint"
@@ -278,6 +463,275 @@ class ModelSQLTestCase(unittest.TestCase):
         with self.assertRaises(UserError):
             Model.create([{'value': 42}, {'value': 42}])
 
+    @with_transaction()
+    def test_table_handler_snapshot(self):
+        "Test table handlers sharing a snapshot"
+        pool = Pool()
+        Model = pool.get('test.modelsql')
+        TableHandler = backend.get('TableHandler')
+
+        with TableHandler.snapshot():
+            self.assertTrue(TableHandler.table_exist(Model._table))
+            self.assertFalse(TableHandler.table_exist('test_snapshot'))
+
+            table = Model.__table_handler__()
+            self.assertTrue(table.column_exist('id'))
+            table.add_column('snapshot', 'VARCHAR')
+            table.index_action('snapshot', 'add')
+
+            table = Model.__table_handler__()
+            self.assertTrue(table.column_exist('snapshot'))
+
+
+def _model(name, table, doc):
+    return type('Model', (), {
+            '__name__': name,
+            '__doc__': doc,
+            '_table': table,
+            })
+
+
+@unittest.skipIf(backend.name() != 'postgresql', 'PostgreSQL only')
+class TableHandlerSnapshotTestCase(unittest.TestCase):
+    'Test TableHandler snapshot'
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def assertSnapshotFresh(self, snapshot):
+        "Assert the snapshot is the same as a new one"
+        from trytond.backend.postgresql.table import _Snapshot
+        transaction = Transaction()
+        fresh = _Snapshot(transaction.connection, transaction.database)
+        fresh.load()
+        self.assertEqual(snapshot.tables, fresh.tables)
+        self.assertEqual(snapshot.owners, fresh.owners)
+        self.assertEqual(snapshot.sequences, fresh.sequences)
+
+        def definitions(snapshot, key):
+            definitions = dict(snapshot.get(*key))
+            for name in ['constraints', 'indexes']:
+                definitions[name] = sorted(definitions[name])
+            return definitions
+
+        for key in snapshot.definitions.keys() | fresh.definitions.keys():
+            self.assertEqual(
+                definitions(snapshot, key), definitions(fresh, key), msg=key)
+
+    @with_transaction()
+    def test_create_rename_drop(self):
+        "Test create, rename and drop tables"
+        TableHandler = backend.get('TableHandler')
+        Model = _model('test.snapshot', 'test_snapshot', "Snapshot")
+
+        with TableHandler.snapshot():
+            table = TableHandler(Model)
+            table.add_column('name', 'VARCHAR', comment="Name")
+            table.index_action('name', 'add')
+            snapshot = TableHandler._get_snapshot()
+            self.assertTrue(TableHandler.table_exist('test_snapshot'))
+            self.assertTrue(TableHandler(Model).column_exist('name'))
+            self.assertSnapshotFresh(snapshot)
+
+            TableHandler.table_rename('test_snapshot', 'test_snapshot2')
+            self.assertFalse(TableHandler.table_exist('test_snapshot'))
+            self.assertTrue(TableHandler.table_exist('test_snapshot2'))
+            self.assertSnapshotFresh(snapshot)
+
+            TableHandler.drop_table('test.snapshot', 'test_snapshot2')
+            self.assertFalse(TableHandler.table_exist('test_snapshot2'))
+            self.assertSnapshotFresh(snapshot)
+
+    @with_transaction()
+    def test_drop_cascade(self):
+        "Test drop table with cascade"
+        TableHandler = backend.get('TableHandler')
+        Target = _model('test.snapshot.target', 'test_snapshot_target', "")
+        Origin = _model('test.snapshot.origin', 'test_snapshot_origin', "")
+
+        with TableHandler.snapshot():
+            TableHandler(Target)
+            origin = TableHandler(Origin)
+            origin.add_column('target', 'INTEGER')
+            origin.add_fk('target', 'test_snapshot_target')
+            snapshot = TableHandler._get_snapshot()
+            self.assertSnapshotFresh(snapshot)
+
+            TableHandler.drop_table(
+                'test.snapshot.target', 'test_snapshot_target', cascade=True)
+            snapshot = TableHandler._get_snapshot()
+            self.assertSnapshotFresh(snapshot)
+            self.assertNotIn('target', TableHandler(Origin)._fk_deltypes)
+
+    @with_transaction()
+    def test_db_default(self):
+        "Test db_default updates the snapshot"
+        TableHandler = backend.get('TableHandler')
+        Model = _model('test.snapshot', 'test_snapshot', "Snapshot")
+
+        with TableHandler.snapshot():
+            table = TableHandler(Model)
+            table.add_column('value', 'INTEGER')
+            table.db_default('value', 2)
+            snapshot = TableHandler._get_snapshot()
+            self.assertSnapshotFresh(snapshot)
+
+            with patch.object(TableHandler, '_update_definitions') as update:
+                TableHandler(Model).db_default('value', 2)
+            update.assert_not_called()
+
+    @with_transaction()
+    def test_no_comments_without_snapshot(self):
+        "Test comments are not fetched without snapshot"
+        pool = Pool()
+        Model = pool.get('test.modelsql')
+        TableHandler = backend.get('TableHandler')
+
+        with patch.object(TableHandler, '_update_comments') as update:
+            TableHandler(Model)
+        update.assert_not_called()
+
+
+@unittest.skipIf(backend.name() != 'postgresql', 'PostgreSQL only')
+class CopyInsertTestCase(unittest.TestCase):
+    'Test insert with COPY'
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def test_copy_format(self):
+        "Test format of values"
+        from trytond.backend.postgresql.database import _copy_format
+
+        for value, result in [
+                (None, '\\N'),
+                (True, 't'),
+                (False, 'f'),
+                (42, '42'),
+                (1.5, '1.5'),
+                (Decimal('1.10'), '1.10'),
+                (datetime.date(2020, 1, 2), '2020-01-02'),
+                (datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+                    '2020-01-02 03:04:05.000006'),
+                ('foo', 'foo'),
+                ('a\tb\nc\rd\\e', 'a\\tb\\nc\\rd\\\\e'),
+                ('\\N', '\\\\N'),
+                ]:
+            with self.subTest(value=value):
+                self.assertEqual(_copy_format(value), result)
+
+    def _create_table(self):
+        cursor = Transaction().connection.cursor()
+        cursor.execute('CREATE TABLE test_copy_insert ('
+            'id SERIAL PRIMARY KEY, '
+            'name VARCHAR, '
+            'amount NUMERIC, '
+            'day DATE, '
+            'moment TIMESTAMP, '
+            'data BYTEA)')
+
+    @with_transaction()
+    def test_copy_insert(self):
+        "Test copy_insert values"
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        self._create_table()
+        rows = [
+            ['a\tb\nc\rd\\e', Decimal('1.10'), datetime.date(2020, 1, 2),
+                datetime.datetime(2020, 1, 2, 3, 4, 5, 6)],
+            ['\\N', None, None, None],
+            [None, Decimal('-0.5'), None, CurrentTimestamp()],
+            ]
+
+        ids = transaction.database.copy_insert(transaction.connection,
+            'test_copy_insert', ['name', 'amount', 'day', 'moment'], rows)
+
+        self.assertEqual(ids, sorted(ids))
+        cursor.execute('SELECT id, name, amount, day, moment '
+            'FROM test_copy_insert ORDER BY id')
+        result = cursor.fetchall()
+        self.assertEqual([r[0] for r in result], ids)
+        self.assertEqual([r[1:4] for r in result], [
+                ('a\tb\nc\rd\\e', Decimal('1.10'),
+                    datetime.date(2020, 1, 2)),
+                ('\\N', None, None),
+                (None, Decimal('-0.5'), None),
+                ])
+        self.assertEqual(
+            result[0][4], datetime.datetime(2020, 1, 2, 3, 4, 5, 6))
+        self.assertIsNone(result[1][4])
+        self.assertIsInstance(result[2][4], datetime.datetime)
+
+    @with_transaction()
+    def test_copy_insert_unsupported(self):
+        "Test copy_insert with unsupported values"
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        self._create_table()
+
+        for column, value in [
+                ('data', b'\x00binary'),
+                ('moment', datetime.datetime(
+                        2020, 1, 2, tzinfo=datetime.timezone.utc)),
+                ]:
+            with self.subTest(column=column):
+                self.assertIsNone(transaction.database.copy_insert(
+                        transaction.connection, 'test_copy_insert',
+                        ['name', column], [['foo', None], ['bar', value]]))
+        cursor.execute('SELECT COUNT(*) FROM test_copy_insert')
+        self.assertEqual(cursor.fetchone(), (0,))
+
+    def _create(self, Model, vlist):
+        "Create the records and return them with the ids of copy_insert"
+        database = Transaction().database
+        copy_insert = database.copy_insert
+        results = []
+
+        def copy_insert_result(*args):
+            ids = copy_insert(*args)
+            results.append(ids)
+            return ids
+
+        with patch('trytond.model.modelsql._copy_threshold', 2), \
+                patch.object(database, 'copy_insert', copy_insert_result):
+            records = Model.create(vlist)
+        return records, results
+
+    @with_transaction()
+    def test_create_copy(self):
+        "Test create with copy"
+        pool = Pool()
+        Char = pool.get('test.char')
+
+        records, results = self._create(
+            Char, [{'char': 'a\tb'}, {'char': None}, {'char': 'c'}])
+
+        self.assertEqual(results, [[r.id for r in records]])
+        self.assertEqual([r.char for r in records], ['a\tb', None, 'c'])
+
+    @with_transaction()
+    def test_create_copy_fallback(self):
+        "Test create falls back to insert when copy_insert returns None"
+        pool = Pool()
+        Timedelta = pool.get('test.timedelta')
+        day = datetime.timedelta(days=1)
+
+        records, results = self._create(
+            Timedelta,
+            [{'timedelta': day}, {'timedelta': None}, {'timedelta': -day}])
+
+        self.assertEqual(results, [None])
+        self.assertEqual(
+            [r.id for r in records], sorted(r.id for r in records))
+        self.assertEqual(
+            [r.timedelta for r in records], [day, None, -day])
 
 def suite():
-    return unittest.TestLoader().loadTestsFromTestCase(ModelSQLTestCase)
+    func = unittest.TestLoader().loadTestsFromTestCase
+    suite = unittest.TestSuite()
+    for testcase in [ModelSQLTestCase, TableHandlerSnapshotTestCase,
+            CopyInsertTestCase]:
+        suite.addTests(func(testcase))
+    return suite
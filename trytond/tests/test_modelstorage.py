@@ -89,6 +89,27 @@ class ModelStorageTestCase(unittest.TestCase):
             record = ModelStorageContext(record.id)
             self.assertEqual(record.context.get('foo'), 'bar')
 
+    @with_transaction()
+    def test_browse_ids(self):
+        'Test ids shared by browsed records'
+        pool = Pool()
+        ModelStorage = pool.get('test.modelstorage')
+
+        records = ModelStorage.create([{'name': str(i)} for i in range(5)])
+        ids = [r.id for r in records]
+        records = ModelStorage.browse(ids + ids[:2])
+        _ids = records[0]._ids
+
+        self.assertEqual(_ids.index(ids[3]), 3)
+        self.assertEqual(
+            list(_ids.following(ids[2])), ids[2:] + ids[:1])
+        self.assertEqual([r.name for r in records],
+            [str(i) for i in range(5)] + ['0', '1'])
+
+        _ids.remove(ids[0])
+        self.assertEqual(_ids.index(ids[1]), 0)
+        self.assertEqual(_ids.index(ids[0]), 4)
+
     @with_transaction()
     def test_save_mixed_context(self):
         'Test save with mixed context '
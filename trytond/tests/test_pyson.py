@@ -664,6 +664,53 @@ class PYSONTestCase(unittest.TestCase):
             self.assertEqual(decoder.decode(encoder.encode(instance)).pyson(),
                 instance.pyson())
 
+    def test_compile_pyson(self):
+        "Test compile_pyson evaluates like PYSONDecoder"
+        encoder = pyson.PYSONEncoder()
+        contexts = [
+            {},
+            {'test': 1, 'bool': True, 'context': {'company': 1},
+                'lines': [1, 2]},
+            {'test': 0, 'bool': False, 'context': {}},
+            ]
+
+        for instance in [
+                pyson.Eval('test', 0),
+                pyson.Not(pyson.Eval('bool', False)),
+                pyson.Bool(pyson.Eval('test', 0)),
+                pyson.And(pyson.Eval('bool', False), True, True),
+                pyson.Or(False, pyson.Eval('bool', False)),
+                pyson.Equal(pyson.Eval('test', 0), 1),
+                pyson.Greater(pyson.Eval('test', 0), 0),
+                pyson.Less(pyson.Eval('test', 0), 1, True),
+                pyson.If(pyson.Eval('bool', False), 'foo', 'bar'),
+                pyson.Get(pyson.Eval('context', {}), 'company', -1),
+                pyson.In('company', pyson.Eval('context', {})),
+                pyson.Date(2020, 1, pyson.Eval('day', 1)),
+                pyson.TimeDelta(pyson.Eval('test', 0)),
+                pyson.Len(pyson.Eval('lines', [])),
+                [('company', '=', pyson.Eval('context', {}).get(
+                            'company', -1)),
+                    ['OR', ('id', '>', 0), ('id', 'in', [1, 2])]],
+                {'foo': [pyson.Eval('test', 0), {'bar': 'baz'}]},
+                [('id', '=', 1)],
+                ]:
+            string = encoder.encode(instance)
+            for context in contexts:
+                self.assertEqual(
+                    pyson.compile_pyson(string)(context),
+                    pyson.PYSONDecoder(context).decode(string),
+                    msg='%s with %s' % (string, context))
+
+    def test_compile_pyson_new_value(self):
+        "Test compile_pyson returns a new value at each evaluation"
+        string = pyson.PYSONEncoder().encode([('id', '=', 1)])
+
+        value = pyson.compile_pyson(string)({})
+        value.append(('id', '=', 2))
+
+        self.assertEqual(pyson.compile_pyson(string)({}), [['id', '=', 1]])
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(PYSONTestCase)
@@ -6,6 +6,7 @@ import unittest
 
 from trytond.pool import Pool
 from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.transaction import Transaction
 
 
 class QueueTestCase(unittest.TestCase):
@@ -32,6 +33,73 @@ class QueueTestCase(unittest.TestCase):
         assert queued_task.run() is None
         assert queued_task.finished_at is not None
 
+    @with_transaction()
+    def test_pull_priority(self):
+        "Test pull dequeues the tasks by priority"
+        pool = Pool()
+        Queue = pool.get('ir.queue')
+        transaction = Transaction()
+        database, connection = transaction.database, transaction.connection
+
+        low = Queue.push('test_priority', {}, priority=0)
+        default = Queue.push('test_priority', {})
+        high = Queue.push('test_priority', {}, priority=3)
+
+        tasks, _ = Queue.pull_many(
+            database, connection, name='test_priority', limit=2)
+        self.assertEqual(tasks, [
+                (high, 'test_priority', 3),
+                (low, 'test_priority', 0),
+                ])
+        task_id, _, _, _ = Queue.pull(
+            database, connection, name='test_priority')
+        self.assertEqual(task_id, default)
+        task_id, _, _, _ = Queue.pull(
+            database, connection, name='test_priority')
+        self.assertIsNone(task_id)
+
+    @with_transaction()
+    def test_coalesce(self):
+        "Test coalescing pending tasks"
+        pool = Pool()
+        Queue = pool.get('ir.queue')
+        Caller = Queue.caller(Queue)
+
+        with Transaction().set_context(
+                queue_name='test_coalesce', queue_coalesce=True):
+            task_id = Caller.finished([1, 2])
+            self.assertEqual(Caller.finished([2, 3]), task_id)
+            other_id = Caller.finished([4], 'other')
+        task_default_id = Caller.finished([5])
+
+        task = Queue(task_id)
+        self.assertEqual(task.data['instances'], [1, 2, 3])
+        self.assertNotEqual(other_id, task_id)
+        self.assertEqual(Queue(other_id).data['instances'], [4])
+        self.assertNotEqual(task_default_id, task_id)
+        self.assertIsNone(Queue(task_default_id).coalesce_key)
+
+    @with_transaction()
+    def test_coalesce_split(self):
+        "Test splitting a coalesced task"
+        pool = Pool()
+        Queue = pool.get('ir.queue')
+        Caller = Queue.caller(Queue)
+
+        with Transaction().set_context(
+                queue_name='test_split', queue_coalesce=True):
+            task_id = Caller.finished([1, 2])
+            Caller.finished([3])
+        task = Queue(task_id)
+
+        task_ids = task.split()
+        tasks = Queue.browse(task_ids)
+        self.assertEqual(
+            [t.data['instances'] for t in tasks], [[1], [2], [3]])
+        self.assertFalse(any(t.coalesce_key for t in tasks))
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(tasks[0].split(), [])
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(QueueTestCase)
@@ -0,0 +1,100 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import base64
+import json
+import unittest
+from urllib.parse import quote
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from trytond import backend
+from trytond.pool import Pool
+from trytond.tests.test_tryton import activate_module, DB_NAME
+from trytond.transaction import Transaction
+from trytond.wsgi import app
+
+
+class RoutesTestCase(unittest.TestCase):
+    "Test routes"
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def setUp(self):
+        with Transaction().start(DB_NAME, 0) as transaction:
+            pool = Pool()
+            User = pool.get('res.user')
+            Session = pool.get('ir.session')
+
+            admin, = User.search([('login', '=', 'admin')])
+            user, = User.search([('login', '=', 'routes')]) or User.create([{
+                        'name': 'Routes',
+                        'login': 'routes',
+                        }])
+            self.headers = {}
+            for name, user_id in [('admin', admin.id), ('user', user.id)]:
+                with transaction.set_user(user_id):
+                    key = Session.new()
+                self.headers[name] = {
+                    'Accept': 'application/json',
+                    'Authorization': 'Session ' + base64.b64encode(
+                        ('%s:%s:%s' % (name, user_id, key)).encode('utf-8')
+                        ).decode('ascii'),
+                    }
+            transaction.commit()
+        self.client = Client(app, Response)
+
+    def get(self, path, user):
+        return self.client.get(
+            '/%s/%s' % (quote(DB_NAME), path), headers=self.headers[user])
+
+    def test_cache_stats(self):
+        "Test cache stats"
+        response = self.get('cache/stats', 'admin')
+
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.get_data(as_text=True))
+        self.assertIn('ir.translation.ids', stats)
+        self.assertEqual(
+            set(stats['ir.translation.ids']),
+            {'size', 'bytes', 'hits', 'misses', 'sets', 'evictions',
+                'invalidations'})
+
+    def test_cache_stats_not_admin(self):
+        "Test cache stats without administration group"
+        response = self.get('cache/stats', 'user')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_cache_stats_anonymous(self):
+        "Test cache stats without authentication"
+        response = self.client.get('/%s/cache/stats' % quote(DB_NAME))
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_database_stats(self):
+        "Test database stats"
+        response = self.get('database/stats', 'admin')
+
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.get_data(as_text=True))
+        if backend.name() == 'postgresql':
+            self.assertEqual(set(stats), {'primary', 'replicas'})
+            self.assertEqual(set(stats['primary']), {
+                    'in_use', 'idle', 'waiting', 'wait_count', 'wait_time',
+                    'wait_histogram'})
+            self.assertGreaterEqual(stats['primary']['wait_count'], 1)
+        else:
+            self.assertEqual(stats, {})
+
+    def test_database_stats_not_admin(self):
+        "Test database stats without administration group"
+        response = self.get('database/stats', 'user')
+
+        self.assertEqual(response.status_code, 403)
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(RoutesTestCase)
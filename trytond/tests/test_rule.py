@@ -2,10 +2,13 @@
 # this repository contains the full copyright notices and license terms.
 import json
 import unittest
+from unittest.mock import patch
 
 from trytond.exceptions import UserError
 from trytond.pool import Pool
+from trytond.pyson import PYSONEncoder, Eval, If
 from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.transaction import Transaction
 
 
 class ModelRuleTestCase(unittest.TestCase):
@@ -341,6 +344,103 @@ class ModelRuleTestCase(unittest.TestCase):
 
         self.assertListEqual(TestRule.search([]), [])
 
+    @with_transaction()
+    def test_search_with_rule_user(self):
+        "Test search with rule using user fields"
+        pool = Pool()
+        TestRule = pool.get('test.rule')
+        RuleGroup = pool.get('ir.rule.group')
+        Model = pool.get('ir.model')
+        User = pool.get('res.user')
+
+        model, = Model.search([('model', '=', 'test.rule')])
+        rule_group, = RuleGroup.create([{
+                    'model': model.id,
+                    'global_p': True,
+                    'perm_read': True,
+                    'perm_create': False,
+                    'perm_write': False,
+                    'perm_delete': False,
+                    'rules': [('create', [{
+                                    'domain': PYSONEncoder().encode(
+                                        [('field', '=',
+                                                Eval('user', {}).get(
+                                                    'login'))]),
+                                    }])],
+                    }])
+        users = User.create([{
+                    'name': 'User %s' % i,
+                    'login': 'user%s' % i,
+                    } for i in range(2)])
+        tests = TestRule.create([{'field': 'user%s' % i} for i in range(2)])
+
+        for user, test in zip(users, tests):
+            with Transaction().set_user(user.id):
+                self.assertListEqual(TestRule.search([]), [test])
+
+    @with_transaction()
+    def test_search_with_rule_user_context(self):
+        "Test search with rule using user fields depending on the context"
+        pool = Pool()
+        TestRule = pool.get('test.rule')
+        RuleGroup = pool.get('ir.rule.group')
+        Rule = pool.get('ir.rule')
+        Model = pool.get('ir.model')
+        User = pool.get('res.user')
+
+        model, = Model.search([('model', '=', 'test.rule')])
+        RuleGroup.create([{
+                    'model': model.id,
+                    'global_p': True,
+                    'perm_read': True,
+                    'perm_create': False,
+                    'perm_write': False,
+                    'perm_delete': False,
+                    'rules': [('create', [{
+                                    'domain': PYSONEncoder().encode(
+                                        [('field', '=',
+                                                Eval('user', {}).get(
+                                                    'login'))]),
+                                    }])],
+                    }])
+        user, = User.create([{
+                    'name': 'User',
+                    'login': 'user',
+                    }])
+        tests = TestRule.create([{'field': 'user%s' % i} for i in range(2)])
+
+        def get_context():
+            # As a user field which depends on the context like the company
+            return {
+                'user': {'login': Transaction().context.get('test_login')},
+                }
+
+        with patch.object(Rule, '_get_context', get_context), \
+                Transaction().set_user(user.id):
+            for i, test in enumerate(tests):
+                with Transaction().set_context(test_login='user%s' % i):
+                    self.assertListEqual(TestRule.search([]), [test])
+
+    @with_transaction()
+    def test_get_inputs(self):
+        "Test user fields used by rule domain"
+        pool = Pool()
+        Rule = pool.get('ir.rule')
+        encode = PYSONEncoder().encode
+        user = Eval('user', {})
+
+        for domain, inputs in [
+                ([('field', '=', 'foo')], set()),
+                ([('field', '=', user.get('login'))], {'login'}),
+                ([('field', '=', If(user.get('active'),
+                                user.get('login'), user.get('name')))],
+                    {'active', 'login', 'name'}),
+                ([('field', '=', user.get('_parent_company'))], None),
+                ([('field', '=', Eval('company'))], None),
+                ([('field', '=', Eval('user'))], None),
+                ]:
+            self.assertEqual(Rule._get_inputs(encode(domain)), inputs)
+
 
 def suite():
     suite_ = unittest.TestSuite()
@@ -0,0 +1,138 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import gc
+import os
+import signal
+import socket
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.request import urlopen
+
+from trytond import supervisor
+from trytond.config import config
+from trytond.pool import Pool
+from trytond.tests.test_tryton import activate_module, DB_NAME
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+class SupervisorTestCase(unittest.TestCase):
+    "Test supervisor"
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('tests')
+
+    def tearDown(self):
+        gc.enable()
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    @unittest.skipIf(
+        not os.path.exists('/proc/self/status'), "Requires /proc")
+    def test_memory(self):
+        "Test memory of the process"
+        rss, pss = supervisor.memory()
+
+        self.assertGreater(rss, 0)
+        if pss is not None:
+            self.assertGreater(pss, 0)
+        self.assertGreater(supervisor.memory(os.getpid())[0], 0)
+
+    def test_memory_missing(self):
+        "Test memory of a missing process"
+        self.assertIsNone(supervisor.memory(2 ** 22 + 1))
+
+    def test_preload(self):
+        "Test preload"
+        duration = supervisor.preload([DB_NAME], warm=True)
+
+        self.assertGreaterEqual(duration, 0)
+        self.assertFalse(gc.isenabled())
+        self.assertIn(DB_NAME, Pool.database_list())
+
+        supervisor.freeze()
+        self.assertTrue(gc.isenabled())
+
+    def test_preload_failure(self):
+        "Test preload enables the garbage collector on failure"
+        with patch.object(Pool, 'init', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                supervisor.preload([DB_NAME])
+
+        self.assertTrue(gc.isenabled())
+
+    @unittest.skipIf(not hasattr(os, 'fork'), "Requires fork")
+    def test_serve(self):
+        "Test serve with one worker"
+        port = _free_port()
+        pid = os.fork()
+        if not pid:
+            try:
+                config.set('web', 'listen', 'localhost:%s' % port)
+                supervisor.serve(SimpleNamespace(
+                        database_names=[], warm=False, workers=1), _app)
+            finally:
+                os._exit(0)
+        try:
+            for _ in range(100):
+                try:
+                    with urlopen('http://localhost:%s/' % port) as response:
+                        worker = int(response.read())
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            else:
+                self.fail("server not started")
+            self.assertNotEqual(worker, pid)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, status = os.waitpid(pid, 0)
+
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    @unittest.skipIf(not hasattr(os, 'fork'), "Requires fork")
+    def test_serve_failure(self):
+        "Test serve stops when the workers fail at start"
+        port = _free_port()
+        pid = os.fork()
+        if not pid:
+            status = 2
+            try:
+                config.set('web', 'listen', 'localhost:%s' % port)
+                with patch('werkzeug.serving.BaseWSGIServer.serve_forever',
+                        side_effect=ValueError), \
+                        patch.object(supervisor, 'RESPAWN_DELAY', 0.01), \
+                        patch.object(supervisor.logger, 'disabled', True):
+                    status = supervisor.serve(SimpleNamespace(
+                            database_names=[], warm=False, workers=2), _app)
+            finally:
+                os._exit(status)
+        for _ in range(100):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.fail("server not stopped")
+
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SupervisorTestCase)
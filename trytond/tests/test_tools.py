@@ -6,12 +6,15 @@ import unittest
 import doctest
 import datetime
 import sys
+from unittest.mock import Mock, patch
 
 import sql
 import sql.operators
 
 from trytond.tools import reduce_ids, datetime_strftime, \
-    reduce_domain, decimal_, is_instance_method, file_open
+    reduce_domain, decimal_, is_instance_method, file_open, grouped_slice, \
+    iter_csv
+from trytond.transaction import Transaction
 
 
 class ToolsTestCase(unittest.TestCase):
@@ -52,6 +55,47 @@ class ToolsTestCase(unittest.TestCase):
             (((self.table.id >= 1) & (self.table.id <= 12))
                 | (self.table.id.in_([15, 18, 19, 21]))))
 
+    def test_reduce_ids_duplicates(self):
+        'Test reduce_ids with duplicates and unsorted list'
+        sql = reduce_ids(self.table.id, [21, 3, 1, 2, 3, 4, 5, 6, 7, 1, 15])
+        self.assertEqual(str(sql),
+            str(((self.table.id >= 1) & (self.table.id <= 7))
+                | (self.table.id.in_([15, 21]))))
+        self.assertEqual(sql.params, (1, 7, 15, 21))
+
+    def _reduce_ids_array(self, ids, array_ids=True, has_array=True):
+        database = Mock()
+        database.has_array.return_value = has_array
+        with patch('trytond.tools.misc._array_ids', array_ids), \
+                patch.object(Transaction(), 'database', database):
+            return reduce_ids(self.table.id, ids)
+
+    def test_reduce_ids_array(self):
+        'Test reduce_ids with array'
+        expression = self._reduce_ids_array([21, 1, 2, 3, 4, 5, 6, 7, 15])
+        range_ = (self.table.id >= 1) & (self.table.id <= 7)
+
+        self.assertEqual(str(expression),
+            '(%s OR (%s = ANY(CAST(%s AS INTEGER[]))))' % (
+                range_, self.table.id, sql.Flavor.get().param))
+        self.assertEqual(expression.params, (1, 7, '{15,21}'))
+
+    def test_reduce_ids_array_single(self):
+        'Test reduce_ids with array and a single discontinue id'
+        self.assertEqual(self._reduce_ids_array([1, 2, 3, 4, 5, 6, 7, 15]),
+            (((self.table.id >= 1) & (self.table.id <= 7))
+                | (self.table.id.in_([15]))))
+
+    def test_reduce_ids_array_unsupported(self):
+        'Test reduce_ids with array without database support'
+        for array_ids, has_array in [(True, False), (False, True)]:
+            with self.subTest(array_ids=array_ids, has_array=has_array):
+                self.assertEqual(
+                    self._reduce_ids_array(
+                        [1, 15, 21], array_ids=array_ids, has_array=has_array),
+                    sql.operators.Or(
+                        (self.table.id.in_([1, 15, 21]),)))
+
     @unittest.skipIf(sys.flags.optimize, "assert removed by optimization")
     def test_reduce_ids_float(self):
         'Test reduce_ids with integer as float'
@@ -62,6 +106,33 @@ class ToolsTestCase(unittest.TestCase):
                 | (self.table.id.in_([15.0, 18.0, 19.0, 21.0]))))
         self.assertRaises(AssertionError, reduce_ids, self.table.id, [1.1])
 
+    def test_grouped_slice_list(self):
+        'Test grouped_slice on list'
+        for size in [10000, 100000, 1000000]:
+            ids = list(range(size))
+            slices = list(grouped_slice(ids, 1000))
+            self.assertEqual(len(slices), size // 1000)
+            self.assertEqual(slices[-1], ids[-1000:])
+
+    def test_grouped_slice_iterator(self):
+        'Test grouped_slice on iterator'
+        self.assertEqual(
+            [list(s) for s in grouped_slice((i for i in range(5)), 2)],
+            [[0, 1], [2, 3], [4]])
+
+    def test_grouped_slice_empty(self):
+        'Test grouped_slice on empty'
+        self.assertEqual(list(grouped_slice([], 2)), [])
+        self.assertEqual(list(grouped_slice(iter([]), 2)), [])
+
+    def test_iter_csv(self):
+        'Test iter_csv'
+        self.assertEqual(
+            list(iter_csv(
+                    [[1, None, datetime.date(2005, 3, 2)], ['a,b', '', 0]],
+                    header=['int', 'none', 'date'])),
+            ['int,none,date\r\n', '1,,2005-03-02\r\n', '"a,b",,0\r\n'])
+
     def test_datetime_strftime(self):
         'Test datetime_strftime'
         self.assertTrue(datetime_strftime(datetime.date(2005, 3, 2),
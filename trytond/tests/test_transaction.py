@@ -1,8 +1,10 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import time
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+from trytond import backend
 from trytond.tests.test_tryton import DB_NAME, USER, CONTEXT, activate_module
 from trytond.transaction import Transaction
 
@@ -77,6 +79,46 @@ class TransactionTestCase(unittest.TestCase):
                 self.assertIs(Transaction(), new_transaction)
             self.assertIs(Transaction(), transaction)
 
+    def test_replica_after_commit(self):
+        'Test read-only transaction does not use replica after a commit'
+        Database = backend.get('Database')
+        Transaction._commits.pop((DB_NAME, USER), None)
+
+        def replica():
+            return get_connection.call_args[1]['replica']
+
+        with patch.object(Database, 'get_connection', autospec=True,
+                side_effect=Database.get_connection) as get_connection, \
+                patch.object(Database, 'is_replica', return_value=True):
+            with Transaction().start(DB_NAME, USER, readonly=True,
+                    context=CONTEXT) as transaction:
+                self.assertTrue(replica())
+                self.assertTrue(transaction.replica)
+
+            with Transaction().start(DB_NAME, USER, context=CONTEXT):
+                self.assertFalse(replica())
+
+            with Transaction().start(DB_NAME, USER, readonly=True,
+                    context=CONTEXT):
+                self.assertFalse(replica())
+
+    def test_replica_connection(self):
+        'Test replica is set from the connection'
+        with Transaction().start(DB_NAME, USER, readonly=True,
+                context=CONTEXT) as transaction:
+            self.assertEqual(transaction.replica,
+                transaction.database.is_replica(transaction.connection))
+
+    def test_commits_pruned(self):
+        'Test the old commits are pruned'
+        Transaction._commits[(DB_NAME, -1)] = time.time() - 3600
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            pass
+
+        self.assertNotIn((DB_NAME, -1), Transaction._commits)
+        self.assertIn((DB_NAME, USER), Transaction._commits)
+
     def test_two_phase_commit(self):
         # A successful transaction
         dm = Mock()
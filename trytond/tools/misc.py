@@ -4,19 +4,31 @@
 """
 Miscelleanous tools used by tryton
 """
+import csv
+import datetime
 import os
 import sys
 from array import array
+from collections.abc import Sequence
 from itertools import islice
 import types
 import io
 import warnings
 import importlib
 
-from sql import Literal
+from sql import Literal, Cast
+from sql.functions import Function
 from sql.operators import Or
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from trytond.const import OPERATORS
+from trytond.config import config
+
+_array_ids = config.getboolean('database', 'array_ids', default=False)
 
 
 def file_open(name, mode="r", subdir='modules', encoding=None):
@@ -149,6 +161,33 @@ def memoize(maxsize):
     return wrap
 
 
+class _Any(Function):
+    __slots__ = ()
+    _function = 'ANY'
+
+
+def _runs(ids):
+    "Return the sorted unique ids and the start and end indexes of the runs"
+    if numpy is not None:
+        ids = numpy.unique(numpy.fromiter(ids, dtype=numpy.int64))
+        breaks = numpy.flatnonzero(numpy.diff(ids) != 1) + 1
+        starts = [0] + breaks.tolist()
+        ends = breaks.tolist() + [len(ids)]
+        return ids.tolist(), starts, ends
+    ids = sorted(set(ids))
+    breaks = [i
+        for i, a, b in zip(range(1, len(ids)), ids, islice(ids, 1, None))
+        if b - a != 1]
+    return ids, [0] + breaks, breaks + [len(ids)]
+
+
+def _use_array():
+    from trytond.transaction import Transaction
+    database = Transaction().database
+    return (_array_ids and database is not None
+        and database.has_array())
+
+
 def reduce_ids(field, ids):
     '''
     Return a small SQL expression for the list of ids and the sql column
@@ -158,32 +197,26 @@ def reduce_ids(field, ids):
         return Literal(False)
     assert all(x.is_integer() for x in ids if isinstance(x, float)), \
         'ids must be integer'
-    ids = list(map(int, ids))
-    ids.sort()
-    prev = ids.pop(0)
-    continue_list = [prev, prev]
+    ids, starts, ends = _runs(map(int, ids))
+    ranges = [(start, end) for start, end in zip(starts, ends)
+        if ids[end - 1] - ids[start] >= 5]
+    # The discontinue ids are the slices between the ranges
     discontinue_list = array('l')
     sql = Or()
-    for i in ids:
-        if i == prev:
-            continue
-        if i != prev + 1:
-            if continue_list[-1] - continue_list[0] < 5:
-                discontinue_list.extend([continue_list[0] + x for x in
-                    range(continue_list[-1] - continue_list[0] + 1)])
-            else:
-                sql.append((field >= continue_list[0])
-                    & (field <= continue_list[-1]))
-            continue_list = []
-        continue_list.append(i)
-        prev = i
-    if continue_list[-1] - continue_list[0] < 5:
-        discontinue_list.extend([continue_list[0] + x for x in
-            range(continue_list[-1] - continue_list[0] + 1)])
-    else:
-        sql.append((field >= continue_list[0]) & (field <= continue_list[-1]))
+    prev = 0
+    for start, end in ranges:
+        discontinue_list.extend(ids[prev:start])
+        sql.append((field >= ids[start]) & (field <= ids[end - 1]))
+        prev = end
+    discontinue_list.extend(ids[prev:])
     if discontinue_list:
-        sql.append(field.in_(discontinue_list))
+        if len(discontinue_list) > 1 and _use_array():
+            sql.append(field == _Any(Cast(
+                        Literal('{%s}' % ','.join(
+                                map(str, discontinue_list))),
+                        'INTEGER[]')))
+        else:
+            sql.append(field.in_(discontinue_list))
     return sql
 
 
@@ -219,13 +252,51 @@ def reduce_domain(domain):
 
 
 def grouped_slice(records, count=None):
-    'Grouped slice'
+    '''
+    Grouped slice
+    Sequences are sliced and other iterables are consumed by chunk of count
+    '''
     from trytond.transaction import Transaction
     if count is None:
         count = Transaction().database.IN_MAX
     count = max(1, count)
-    for i in range(0, len(records), count):
-        yield islice(records, i, i + count)
+    if isinstance(records, (Sequence, array)):
+        for i in range(0, len(records), count):
+            yield records[i:i + count]
+    else:
+        iterator = iter(records)
+        while True:
+            chunk = list(islice(iterator, count))
+            if not chunk:
+                break
+            yield chunk
+
+
+class _CSVLine(object):
+    "File-like object returning the written line"
+
+    def write(self, line):
+        return line
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows, header=None, **fmtparams):
+    """Yield each row as a line of CSV
+
+    The dates and times are written in ISO 8601 and None as an empty string
+    to be read by the spreadsheets."""
+    writer = csv.writer(_CSVLine(), **fmtparams)
+    if header is not None:
+        yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_value(v) for v in row])
 
 
 def is_instance_method(cls, method):
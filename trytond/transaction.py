@@ -1,6 +1,7 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import logging
+import time
 from threading import local
 from sql import Flavor
 
@@ -8,6 +9,7 @@ from trytond import backend
 from trytond.config import config
 
 logger = logging.getLogger(__name__)
+_replica_lag = config.getfloat('database', 'replica_lag', default=5)
 
 
 class _AttributeManager(object):
@@ -45,6 +47,7 @@ class Transaction(object):
 
     database = None
     readonly = False
+    replica = False
     connection = None
     close = None
     user = None
@@ -53,6 +56,8 @@ class Transaction(object):
     delete_records = None
     delete = None  # TODO check to merge with delete_records
     timestamp = None
+    _frozen_context = None
+    _commits = {}  # Time of the last commit per database and user
 
     def __new__(cls, new=False):
         transactions = cls._local.transactions
@@ -77,6 +82,15 @@ class Transaction(object):
         return self.cache.setdefault((self.user, keys),
             LRUDict(config.getint('cache', 'model')))
 
+    def frozen_context(self):
+        "Return the frozen context which is kept until context is replaced"
+        context = self.context
+        if (self._frozen_context is None
+                or self._frozen_context[0] is not context):
+            from trytond.cache import freeze
+            self._frozen_context = (context, freeze(context))
+        return self._frozen_context[1]
+
     def start(self, database_name, user, readonly=False, context=None,
             close=False, autocommit=False, _nocache=False):
         '''
@@ -92,11 +106,16 @@ class Transaction(object):
         else:
             database = Database(database_name).connect()
         Flavor.set(Database.flavor)
+        # Read from the primary shortly after a commit of the same user
+        replica = (readonly and not autocommit and not _nocache
+            and (time.time() - self._commits.get((database.name, user), 0)
+                > _replica_lag))
         self.connection = database.get_connection(readonly=readonly,
-            autocommit=autocommit)
+            autocommit=autocommit, replica=replica)
         self.user = user
         self.database = database
         self.readonly = readonly
+        self.replica = database.is_replica(self.connection)
         self.close = close
         self.context = context or {}
         self.create_records = {}
@@ -139,6 +158,7 @@ class Transaction(object):
                 finally:
                     self.database = None
                     self.readonly = False
+                    self.replica = False
                     self.connection = None
                     self.close = None
                     self.user = None
@@ -147,6 +167,7 @@ class Transaction(object):
                     self.delete_records = None
                     self.delete = None
                     self.timestamp = None
+                    self._frozen_context = None
                     self._datamanagers = []
 
                 for func, args, kwargs in self._atexit:
@@ -212,6 +233,12 @@ class Transaction(object):
             self.rollback()
             raise
         else:
+            if not self.readonly:
+                now = time.time()
+                for key, timestamp in list(self._commits.items()):
+                    if now - timestamp > _replica_lag:
+                        self._commits.pop(key, None)
+                self._commits[(self.database.name, self.user)] = now
             try:
                 for datamanager in self._datamanagers:
                     datamanager.tpc_finish(self)
@@ -1,16 +1,19 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import logging
+import os
 import select
 import signal
 import time
-from multiprocessing import Pool as MPool, cpu_count
+import multiprocessing
+from multiprocessing import cpu_count
 
 from sql import Flavor
 
 from trytond import backend
 from trytond.config import config
 from trytond.pool import Pool
+from trytond.supervisor import preload, freeze, report
 from trytond.transaction import Transaction
 
 __all__ = ['work']
@@ -26,9 +29,11 @@ class Queue(object):
         self.pool = pool
         self.mpool = mpool
 
-    def pull(self, name=None):
+    def pull(self, name=None, limit=1):
         Queue = self.pool.get('ir.queue')
-        return Queue.pull(self.database, self.connection, name=name)
+        tasks, next_ = Queue.pull_many(
+            self.database, self.connection, name=name, limit=limit)
+        return [t[0] for t in tasks], next_
 
     def run(self, task_id):
         return self.mpool.apply_async(
@@ -51,9 +56,13 @@ def work(options):
         processes = options.processes or cpu_count()
     except NotImplementedError:
         processes = 1
+    # Initialize the pools before forking so the processes share them
+    preload(options.database_names, warm=options.warm)
+    freeze()
     logger.info("start %d workers", processes)
-    mpool = MPool(
+    mpool = multiprocessing.get_context('fork').Pool(
         processes, initializer, (options,), options.maxtasksperchild)
+    report([os.getpid()] + [p.pid for p in multiprocessing.active_children()])
     queues = [Queue(pool, mpool) for pool in initializer(options, False)]
 
     tasks = TaskList()
@@ -63,11 +72,12 @@ def work(options):
             while len(tasks.filter()) >= processes:
                 time.sleep(0.1)
             for queue in queues:
-                task_id, next_ = queue.pull(options.name)
+                task_ids, next_ = queue.pull(
+                    options.name, processes - len(tasks))
                 timeout = min(
                     next_ or options.timeout, timeout, options.timeout)
-                if task_id:
-                    tasks.append(queue.run(task_id))
+                if task_ids:
+                    tasks.extend(queue.run(task_id) for task_id in task_ids)
                     break
             else:
                 connections = [q.connection for q in queues]
@@ -112,4 +122,15 @@ def run_task(pool, task_id):
                     raise
         logger.info('task "%d" done', task_id)
     except Exception:
-        logger.critical('task "%d" failed', task_id, exc_info=True)
+        try:
+            with Transaction().start(pool.database_name, 0):
+                task_ids = Queue(task_id).split()
+        except Exception:
+            logger.error('task "%d" split failed', task_id, exc_info=True)
+            task_ids = []
+        if task_ids:
+            # Run each instance of the coalesced task on its own
+            logger.warning('task "%d" failed, split into %d tasks',
+                task_id, len(task_ids), exc_info=True)
+        else:
+            logger.critical('task "%d" failed', task_id, exc_info=True)